@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+# Array-backed color grid for large maps.
+#
+# ColorGrid creates a GridNode object per cell, each with a dict of neighbors and a
+# list of adjacent colors, which takes about a kilobyte per cell and makes loading
+# multi-million cell maps slow. ArrayColorGrid keeps the same information in a few
+# numpy arrays (about 20 bytes per cell), built in bulk from the grid file.
+#
+# get_node() returns a light-weight view of one cell with the attributes of a
+# GridNode, so an ArrayColorGrid can be used wherever a ColorGrid is read, e.g. by
+# TrainGrid and TrainEmitGrid, with the same results.
+
+import numpy as np
+from color_grid import COLORS, DIRECTIONS, EMPTY_COLOR
+
+# color code of an empty cell
+EMPTY = -1
+
+# color codes of the bytes of a grid file, -2 for invalid bytes
+COLOR_CODES = np.full(256, -2, dtype=np.int8)
+COLOR_CODES[ord(EMPTY_COLOR)] = EMPTY
+for c, color in enumerate(COLORS):
+    COLOR_CODES[ord(color)] = c
+
+# the colors of every adjacency bitmask
+ADJACENT_COLORS = [tuple([color for c, color in enumerate(COLORS) if mask & (1 << c)])
+                   for mask in range(0, 1 << len(COLORS))]
+
+
+class GridNodeView:
+    """
+    One cell of an ArrayColorGrid, with the same attributes as a GridNode. Views are
+    created on demand and read everything from the arrays of the grid.
+    """
+
+    def __init__(self, grid, id):
+        self.grid = grid
+        self.id = id
+        self._neighbors = None
+
+    @property
+    def color(self):
+        code = self.grid.colors[self.id]
+        return EMPTY_COLOR if code == EMPTY else COLORS[code]
+
+    @property
+    def num_neighbors(self):
+        return int(self.grid.num_neighbors[self.id])
+
+    @property
+    def neighbors(self):
+        if self._neighbors is None:
+            self._neighbors = {}
+            for d, direction in enumerate(DIRECTIONS):
+                nb = self.grid.neighbors[d][self.id]
+                self._neighbors[direction] = (
+                    GridNodeView(self.grid, int(nb)) if nb >= 0 else None)
+
+        return self._neighbors
+
+    @property
+    def adjacent_colors(self):
+        return ADJACENT_COLORS[self.grid.adjacent[self.id]]
+
+    def is_empty(self):
+        return self.grid.colors[self.id] == EMPTY
+
+    def neighbor(self, direction):
+        direction = direction.upper()
+        if not direction in DIRECTIONS:
+            raise Exception("direction %s wrong" % direction)
+
+        return self.neighbors[direction]
+
+    def dump_neighbors(self):
+        dl = []
+        for direction in DIRECTIONS:
+            nb = self.neighbor(direction)
+            if nb:
+                dl.append(str(nb))
+            else:
+                dl.append('---,---')
+
+        print('%s: %s' % (self, ', '.join(dl)))
+
+    def __str__(self) -> str:
+        return "(%2d, %s)" % (self.id, self.color)
+
+
+class ArrayColorGrid:
+    """
+    A color grid in arrays, read from the same files as ColorGrid:
+
+    * colors[i]: index in COLORS of the color of cell i, EMPTY for an empty cell;
+    * neighbors[d][i]: the cell next to cell i in direction DIRECTIONS[d], -1 if none;
+    * num_neighbors[i]: number of non-empty neighbors of cell i;
+    * adjacent[i]: bit c is set if a non-empty neighbor of cell i has color COLORS[c].
+    """
+
+    def __init__(self):
+        self.num_rows = 0
+        self.num_cols = 0
+        self.colors = np.zeros(0, dtype=np.int8)
+        self.neighbors = np.zeros((len(DIRECTIONS), 0), dtype=np.int32)
+        self.num_neighbors = np.zeros(0, dtype=np.int8)
+        self.adjacent = np.zeros(0, dtype=np.uint8)
+
+    @property
+    def num_elements(self):
+        return len(self.colors)
+
+    def get_node(self, i):
+        if i < 0 or i >= self.num_elements:
+            raise Exception("element id %d out of bound" % i)
+
+        return GridNodeView(self, i)
+
+    def init_from_file(self, filename):
+        with open(filename, 'rb') as f:
+            tokens = f.readline().split(b',')
+            self.num_rows = int(tokens[0].strip())
+            self.num_cols = int(tokens[1].strip())
+            # every cell is one color character
+            cells = f.read().translate(None, b' \t\r\n')
+
+        if len(cells) > self.num_rows * self.num_cols:
+            raise Exception("%s: more than %d cells" %
+                            (filename, self.num_rows * self.num_cols))
+
+        self.colors = COLOR_CODES[np.frombuffer(cells, dtype=np.uint8)]
+        bad = np.flatnonzero(self.colors == -2)
+        if len(bad) > 0:
+            raise Exception("%s: invalid color %s in cell %d" %
+                            (filename, chr(cells[bad[0]]), bad[0]))
+
+        self.build_neighbors()
+
+    def build_neighbors(self):
+        n, cols = self.num_elements, self.num_cols
+        ids = np.arange(n, dtype=np.int32)
+        col = ids % cols
+
+        left = np.where(col > 0, ids - 1, -1)
+        up = np.where(ids + cols < n, ids + cols, -1)
+        right = np.where((col < cols - 1) & (ids + 1 < n), ids + 1, -1)
+        down = np.where(ids - cols >= 0, ids - cols, -1)
+        # in DIRECTIONS order
+        self.neighbors = np.array([left, up, right, down], dtype=np.int32)
+
+        self.num_neighbors = np.zeros(n, dtype=np.int8)
+        self.adjacent = np.zeros(n, dtype=np.uint8)
+        for nbs in self.neighbors:
+            code = np.where(nbs >= 0, self.colors[nbs], EMPTY)
+            filled = code != EMPTY
+            self.num_neighbors += filled
+            self.adjacent[filled] |= (1 << code[filled]).astype(np.uint8)
+
+    def dump_grid(self):
+        print("\n------- dump grid: --------")
+        for i in range(self.num_rows, 0, -1):
+            idx = (i - 1) * self.num_cols
+            row = [str(self.get_node(j)) if j < self.num_elements else 'None'
+                   for j in range(idx, idx + self.num_cols)]
+            print(' '.join(row))
+
+    def dump_elements(self):
+        print("\n------- dump elements: --------")
+        for i in range(0, self.num_elements):
+            print("%2d: %s" % (i, self.get_node(i)))
+
+    def dump_neighbors(self):
+        print("\n------ dump neighbors: -------")
+        for i in range(0, self.num_elements):
+            self.get_node(i).dump_neighbors()
@@ -23,13 +23,13 @@ class DataMatrix:
         self.num_elements = 0
         self.m = [None] * (num_rows * num_cols)
 
-    def check_bounds(self, i, description="index"):
-        if i < 0 or i > self.num_rows:
+    def check_bounds(self, i, size, description="index"):
+        if i < 0 or i >= size:
             raise Exception("%s %d is out of bound" % (description, i))
 
     def get(self, i, j):
-        self.check_bounds(i, "row number")
-        self.check_bounds(j, "column number")
+        self.check_bounds(i, self.num_rows, "row number")
+        self.check_bounds(j, self.num_cols, "column number")
 
         idx = i * self.num_cols + j
         return self.get_element(idx)
@@ -5,12 +5,16 @@ import sys
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print("Usage: ", sys.argv[0], "<filename>")
+        print("Usage: ", sys.argv[0], "<filename> [--array]")
         sys.exit(1)
 
     filename = sys.argv[1]
 
-    cg = ColorGrid()
+    if "--array" in sys.argv[2:]:
+        from array_grid import ArrayColorGrid
+        cg = ArrayColorGrid()
+    else:
+        cg = ColorGrid()
     cg.init_from_file(filename)
 
     cg.dump_grid()
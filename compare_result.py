@@ -1,6 +1,35 @@
 #! /bin/python3
+#
+# Compare predicted paths with the ground truth.
+#
+# load_file() and compare_result() load both files into lists of tuples and compare
+# them in a Python loop. The command line tool instead streams the files: the ground
+# truth and any number of prediction files are read in chunks, in one pass, and every
+# chunk is parsed in bulk into (x, y, color) arrays (see observations.parse_values()).
+# Files can also be given as .npy arrays written by --encode, which are memory-mapped.
+#
+# For every prediction file it prints the number and percentage of correct lines as
+# before, and, with --stats:
+#
+# * the Manhattan distance between the predicted and the true cell, as a histogram;
+# * the cells with the most errors (wrong predictions while the robot was there).
+#
+# --confusion=<file> writes the per-cell confusion matrix, as lines
+# "<predict_file> <true x:y> <predicted x:y> <count>" (only the non-zero entries).
+#
+# When a prediction file has fewer or more lines than the ground truth, the common
+# lines are compared, and the missing lines count as wrong.
+#
+# Usage:
+#   python3 compare_result.py <test_file> <predict_file> [<predict_file> ...]
+#       [--stats] [--confusion=<file>] [--chunk-bytes=N]
+#   python3 compare_result.py --encode=<out.npy> <file>
 
 import sys
+import numpy as np
+
+# bits of x and y in the keys of the confusion matrix
+COORD_BITS = 15
 
 def load_file(filename):
     data = []
@@ -29,20 +58,201 @@ def compare_result(d1, d2):
 
     print("correct predict: %d" % correct)
     print("correct percentage: %.2f%%" % (correct *100 / total) )
-        
+
+
+def read_values(filename, chunk_bytes=None):
+    """
+    Generate (x, y, color) arrays for consecutive chunks of a file of "x:y color"
+    lines, or slices of a memory-mapped .npy file written by encode_file().
+    """
+    from observations import CHUNK_BYTES, parse_values, read_chunks
+
+    chunk_bytes = chunk_bytes or CHUNK_BYTES
+    if filename.endswith(".npy"):
+        values = np.load(filename, mmap_mode='r')
+        rows = max(1, chunk_bytes // 16)
+        for start in range(0, len(values), rows):
+            yield np.asarray(values[start:start + rows], dtype=np.int64)
+        return
+
+    line = 1
+    for data in read_chunks(filename, chunk_bytes):
+        values = parse_values(data, line)
+        line += len(values)
+        yield values
+
+
+def encode_file(filename, out, chunk_bytes=None):
+    """
+    Save the lines of a file as an (x, y, color) array in .npy format.
+    """
+    chunks = list(read_values(filename, chunk_bytes))
+    values = np.concatenate(chunks) if chunks else np.empty((0, 3), dtype=np.int64)
+    np.save(out, values.astype(np.int32))
+
+
+def cell_keys(values):
+    """
+    One integer per (x, y) of the rows of values.
+    """
+    if len(values) and values[:, :2].max() >= 1 << COORD_BITS:
+        raise Exception("coordinates must be less than %d" % (1 << COORD_BITS))
+
+    return (values[:, 0] << COORD_BITS) | values[:, 1]
+
+
+def split_keys(keys):
+    mask = (1 << COORD_BITS) - 1
+    return keys >> COORD_BITS, keys & mask
+
+
+class Evaluation:
+    """
+    Counts of one prediction file against the ground truth. The confusion matrix is
+    kept sparse, as sorted keys (true cell key << 2 * COORD_BITS | predicted cell key)
+    and their counts.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lines = 0
+        self.compared = 0
+        self.correct = 0
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def add(self, truth, predicted):
+        """
+        Count the rows of two (x, y, color) arrays of the same length.
+        """
+        self.compared += len(truth)
+        self.correct += int(np.count_nonzero((truth == predicted).all(axis=1)))
+
+        keys = (cell_keys(truth) << (2 * COORD_BITS)) | cell_keys(predicted)
+        keys, inverse = np.unique(np.concatenate((self.keys, keys)),
+                                  return_inverse=True)
+        weights = np.concatenate((self.counts, np.ones(len(truth), dtype=np.int64)))
+        self.keys = keys
+        self.counts = np.bincount(inverse.ravel(), weights=weights,
+                                  minlength=len(keys)).astype(np.int64)
+
+    def confusion(self):
+        """
+        (true x, true y, predicted x, predicted y, count) arrays of the non-zero
+        entries of the confusion matrix.
+        """
+        tx, ty = split_keys(self.keys >> (2 * COORD_BITS))
+        px, py = split_keys(self.keys & ((1 << (2 * COORD_BITS)) - 1))
+        return tx, ty, px, py, self.counts
+
+    def distance_histogram(self):
+        """
+        Number of lines by Manhattan distance between the predicted and the true cell.
+        """
+        tx, ty, px, py, counts = self.confusion()
+        distance = np.abs(tx - px) + np.abs(ty - py)
+        return np.bincount(distance, weights=counts).astype(np.int64)
+
+    def cell_errors(self):
+        """
+        (x, y, lines, wrong cells) of every true cell.
+        """
+        tx, ty, px, py, counts = self.confusion()
+        cells, inverse = np.unique(self.keys >> (2 * COORD_BITS), return_inverse=True)
+        wrong = (tx != px) | (ty != py)
+        lines = np.bincount(inverse, weights=counts).astype(np.int64)
+        errors = np.bincount(inverse, weights=counts * wrong).astype(np.int64)
+        x, y = split_keys(cells)
+        return x, y, lines, errors
+
+
+def evaluate(test_file, predict_files, chunk_bytes=None):
+    """
+    Compare every prediction file with the test file, reading all of them once, in
+    chunks. Returns (number of test lines, one Evaluation per prediction file).
+    """
+    evaluations = [Evaluation(f) for f in predict_files]
+    readers = [read_values(f, chunk_bytes) for f in predict_files]
+    # lines read from every prediction file but not compared yet
+    pending = [np.empty((0, 3), dtype=np.int64) for _ in predict_files]
+    test_lines = 0
+
+    for truth in read_values(test_file, chunk_bytes):
+        test_lines += len(truth)
+        for i, reader in enumerate(readers):
+            chunks = [pending[i]]
+            available = len(pending[i])
+            while available < len(truth):
+                chunk = next(reader, None)
+                if chunk is None:
+                    break
+                chunks.append(chunk)
+                available += len(chunk)
+
+            predicted = np.concatenate(chunks)
+            n = min(len(truth), len(predicted))
+            evaluations[i].add(truth[:n], predicted[:n])
+            pending[i] = predicted[n:]
+
+    # the lines of the prediction files after the end of the test file
+    for i, reader in enumerate(readers):
+        extra = len(pending[i]) + sum([len(chunk) for chunk in reader])
+        evaluations[i].lines = evaluations[i].compared + extra
+
+    return test_lines, evaluations
+
+
+def report(test_lines, ev, stats=False, top=10):
+    if ev.lines != test_lines:
+        print("data size different: %d test lines, %d predicted lines" %
+              (test_lines, ev.lines))
+
+    print("correct predict: %d" % ev.correct)
+    print("correct percentage: %.2f%%" % (ev.correct * 100 / max(test_lines, 1)))
+    if not stats:
+        return
+
+    hist = ev.distance_histogram()
+    for d in np.flatnonzero(hist).tolist():
+        print("distance %d: %d (%.2f%%)" %
+              (d, hist[d], hist[d] * 100 / max(ev.compared, 1)))
+
+    x, y, lines, errors = ev.cell_errors()
+    for i in np.argsort(-errors, kind='stable')[:top].tolist():
+        if errors[i] == 0:
+            break
+        print("cell %d:%d: %d wrong of %d (%.2f%%)" %
+              (x[i], y[i], errors[i], lines[i], errors[i] * 100 / lines[i]))
+
+
+def write_confusion(filename, evaluations):
+    with open(filename, 'w') as f:
+        for ev in evaluations:
+            for row in zip(*[a.tolist() for a in ev.confusion()]):
+                f.write("%s %d:%d %d:%d %d\n" % ((ev.filename,) + row))
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage:", sys.argv[0], "<test_file> <predict_file>")
-        sys.exit(1)
+    from utils import parse_options
 
-    test_file = sys.argv[1]
-    predict_file = sys.argv[2]
+    args, opts = parse_options(sys.argv[1:])
+    if opts.get('encode') and len(args) == 1:
+        encode_file(args[0], opts['encode'])
+        sys.exit(0)
 
-    tdata = load_file(test_file)
-    pdata = load_file(predict_file)
+    if len(args) < 2:
+        print("Usage:", sys.argv[0], "<test_file> <predict_file> [<predict_file> ...]",
+              "[--stats] [--confusion=<file>] [--chunk-bytes=N]")
+        print("      ", sys.argv[0], "--encode=<out.npy> <file>")
+        sys.exit(1)
 
-    compare_result(tdata, pdata)
+    chunk_bytes = int(opts['chunk-bytes']) if opts.get('chunk-bytes') else None
+    test_lines, evaluations = evaluate(args[0], args[1:], chunk_bytes)
 
+    for ev in evaluations:
+        if len(evaluations) > 1:
+            print("%s:" % ev.filename)
+        report(test_lines, ev, 'stats' in opts)
 
+    if opts.get('confusion'):
+        write_confusion(opts['confusion'], evaluations)
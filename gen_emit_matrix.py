@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
 
 import sys
-from utils import coord2id
+from utils import coord2id, parse_options
 from color_grid import ColorGrid, COLORS
+from instrument import from_options, optional_phase, timed
 
 
 class TrainEmitGrid:
 
-    def __init__(self, grid) -> None:
+    def __init__(self, grid, instrument=None) -> None:
         self.grid = grid
         self.num_cols = grid.num_cols
+        self.instrument = instrument
         self.data_rows = []
         self.emit = [None] * self.grid.num_elements
         self.prob = [None] * self.grid.num_elements
@@ -22,6 +24,7 @@ class TrainEmitGrid:
             self.prob[i] = {"r": 0, "g": 0, "b": 0, "y": 0}
             self.emit_adjacent[i] = {"near": 0, "away": 0, "self": 0}
 
+    @timed("load")
     def load(self, trainfile):
         with open(trainfile, 'r') as f:
             line = f.readline()
@@ -36,6 +39,10 @@ class TrainEmitGrid:
 
                 line = f.readline()
 
+        if self.instrument is not None:
+            self.instrument.count("rows", len(self.data_rows))
+
+    @timed("prob")
     def calc_emit_prob(self):
         total = self.stats_adjacent['self'] + \
             self.stats_adjacent['near'] + self.stats_adjacent['away']
@@ -54,6 +61,7 @@ class TrainEmitGrid:
                     self.prob[i][c] = self.stats_adjacent['away'] / \
                         (total * (len(COLORS) - 1 - len(node.adjacent_colors)))
 
+    @timed("output")
     def dump_emit_prob(self, header=False):
         if header:
             print("----- dump emit probability: -----")
@@ -70,12 +78,58 @@ class TrainEmitGrid:
             print(', '.join(elems))
         print(', '.join([format_str % 0] * len(COLORS)))
 
+    def emissions(self):
+        """
+        The emission matrix as an array, with the probabilities rounded like in
+        dump_emit_prob(), so that it decodes like the text file.
+        """
+        from hmm_model import text_rounded
+
+        em = [[t[color] for color in COLORS] for t in self.prob]
+        em.append([0] * len(COLORS))
+        return text_rounded(em)
+
+    @timed("output")
+    def write_binary(self, filename):
+        """
+        Write the emission matrix, the colors and the grid size to a binary model file,
+        see hmm_model.py. The probabilities are rounded like in dump_emit_prob().
+        """
+        import numpy as np
+        from hmm_model import write_model
+
+        write_model(filename, {
+            "em": self.emissions(),
+            "colors": np.frombuffer(''.join(COLORS).encode(), dtype=np.uint8),
+            "grid": np.array([self.grid.num_rows, self.grid.num_cols]),
+        })
+
+    @timed("count")
     def get_emit_stats(self):
         for i in range(0, len(self.data_rows)):
             row = self.data_rows[i]
             n, color = row
             self.emit[n][color] += 1
 
+        self.calc_emit_adjacency()
+
+    @timed("count")
+    def set_emit_counts(self, counts):
+        """
+        Use emission counts computed elsewhere (e.g. by hmm_train.py) instead of
+        counting data_rows: one row per cell, with the number of observations of
+        every color in COLORS order.
+        """
+        for i in range(0, len(self.emit)):
+            self.emit[i] = dict(zip(COLORS, [int(c) for c in counts[i]]))
+
+        self.calc_emit_adjacency()
+
+    def calc_emit_adjacency(self):
+        self.stats_adjacent = {"self": 0, "near": 0, "away": 0}
+        for i in range(0, len(self.emit)):
+            self.emit_adjacent[i] = {"near": 0, "away": 0, "self": 0}
+
         for i in range(0, len(self.emit)):
             node = self.grid.get_node(i)
             total = 0
@@ -131,17 +185,22 @@ class TrainEmitGrid:
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: ", sys.argv[0], "<grid.dat> <train.dat>")
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 2:
+        print("Usage: ", sys.argv[0], "<grid.dat> <train.dat> [--binary=<em.hmm>]",
+              "[--instrument=<file.jsonl>] [--trace-memory] [--profile=<file>]")
         sys.exit(1)
 
-    grid_filename = sys.argv[1]
-    train_filename = sys.argv[2]
+    grid_filename = args[0]
+    train_filename = args[1]
+
+    inst = from_options("gen_emit_matrix", opts)
 
     grid = ColorGrid()
-    grid.init_from_file(grid_filename)
+    with optional_phase(inst, "parse"):
+        grid.init_from_file(grid_filename)
 
-    traingrid = TrainEmitGrid(grid)
+    traingrid = TrainEmitGrid(grid, inst)
     traingrid.load(train_filename)
     # traingrid.dump_train_data()
 
@@ -150,4 +209,10 @@ if __name__ == '__main__':
     #traingrid.dump_emit_adjacency(True)
 
     traingrid.calc_emit_prob()
-    traingrid.dump_emit_prob(False)
+    if opts.get('binary'):
+        traingrid.write_binary(opts['binary'])
+    else:
+        traingrid.dump_emit_prob(False)
+
+    if inst is not None:
+        inst.finish()
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 
 import sys
-from utils import coord2id
+from utils import coord2id, parse_options
 from color_grid import ColorGrid, DIRECTIONS
+from instrument import from_options, optional_phase, timed
+
+# kinds of moves counted in TrainGrid.trans: stay, then the 4 directions
+MOVES = ['O'] + DIRECTIONS
 
 
 class TrainGrid:
 
-    def __init__(self, grid) -> None:
+    def __init__(self, grid, instrument=None) -> None:
         self.grid = grid
         self.num_cols = grid.num_cols
+        self.instrument = instrument
         self.data_rows = []
         self.trans = [None] * self.grid.num_elements
         self.prob = [None] * self.grid.num_elements
@@ -17,6 +22,7 @@ class TrainGrid:
             self.trans[i] = {"O": 0, "L": 0, "U": 0, "R": 0, "D": 0}
             self.prob[i] = {"O": 0, "L": 0.25, "U": 0.25, "R": 0.25, "D": 0.25}
 
+    @timed("load")
     def load(self, trainfile):
         with open(trainfile, 'r') as f:
             line = f.readline()
@@ -31,6 +37,10 @@ class TrainGrid:
 
                 line = f.readline()
 
+        if self.instrument is not None:
+            self.instrument.count("rows", len(self.data_rows))
+
+    @timed("prob")
     def calc_prob(self):
         for i in range(0, len(self.prob)):
             node = self.grid.get_node(i)
@@ -63,6 +73,7 @@ class TrainGrid:
             print('%s -> O:%7.4f, L:%7.4f, U:%7.4f, R:%7.4f, D:%7.4f' %
                   (str(node), p['O'], p['L'], p['U'], p['R'], p['D']))
 
+    @timed("count")
     def calc_trans(self):
         for i in range(1, len(self.data_rows)):
             move_from = self.data_rows[i - 1][0]
@@ -88,6 +99,24 @@ class TrainGrid:
 
             node[key] += 1
 
+        if self.instrument is not None:
+            self.instrument.count("moves", max(len(self.data_rows) - 1, 0))
+
+        self.finish_trans()
+
+    @timed("count")
+    def set_trans_counts(self, counts):
+        """
+        Use move counts computed elsewhere (e.g. by hmm_train.py) instead of counting
+        data_rows: one row per cell, with the number of moves of every kind in MOVES
+        order.
+        """
+        for i in range(0, len(self.trans)):
+            self.trans[i] = dict(zip(MOVES, [int(c) for c in counts[i]]))
+
+        self.finish_trans()
+
+    def finish_trans(self):
         # sum up all directions to get total
         for i in range(0, len(self.trans)):
             t = self.trans[i]
@@ -125,6 +154,7 @@ class TrainGrid:
             total += t['SUM']
         print("Total: %d" % total)
 
+    @timed("output")
     def dump_prob_full(self):
         format_str = "%7.4f"
         for i in range(0, self.grid.num_elements):
@@ -154,6 +184,75 @@ class TrainGrid:
         # N->i, probability 0.
         print(', '.join([format_str % 0] * (self.grid.num_elements + 1)))
 
+    @timed("output")
+    def dump_prob_sparse(self):
+        """
+        Print the non-zero entries of the matrix written by dump_prob_full(): a line
+        "sparse <number of states>", then one line per state (row) with its
+        transitions as "<to state>:<probability>" pairs, see load_sparse_matrix() in
+        hmm_viterbi_test.py. The output grows linearly with the number of cells.
+        """
+        format_str = "%d:%.4f"
+        print("sparse %d" % (self.grid.num_elements + 1))
+
+        row = []
+        for i, j, p in self.prob_edges():
+            if float("%.4f" % p) != 0:
+                row.append((j, p))
+
+            # i->N is the last transition of row i
+            if j == self.grid.num_elements:
+                print(', '.join([format_str % e for e in sorted(row)]))
+                row = []
+
+        # N->i, probability 0.
+        print('')
+
+    def prob_edges(self):
+        """
+        Generate the non-zero entries of the full transition matrix written by
+        dump_prob_full() as (i, j, prob) triples, following the grid neighbors.
+        """
+        end = self.grid.num_elements
+        for i in range(0, end):
+            node = self.grid.get_node(i)
+            yield (i, i, self.prob[i]['O'])
+
+            for d in DIRECTIONS:
+                nb = node.neighbors[d]
+                if nb and not nb.is_empty():
+                    yield (i, nb.id, self.prob[i][d])
+
+            # i->N, probability 1.
+            yield (i, end, 1)
+
+    def transitions(self):
+        """
+        The transition matrix as a SparseTransitions, with the probabilities rounded
+        like in dump_prob_full(), so that it decodes like the text file.
+        """
+        from hmm_model import text_rounded
+        from sparse_transitions import SparseTransitions
+
+        edges = list(self.prob_edges())
+        probs = text_rounded([p for _, _, p in edges])
+        return SparseTransitions.from_edges(
+            self.grid.num_elements + 1,
+            [(i, j, p) for (i, j, _), p in zip(edges, probs)])
+
+    @timed("output")
+    def write_binary(self, filename):
+        """
+        Write the transition matrix (sparse) and the grid size to a binary model file,
+        see hmm_model.py. The probabilities are rounded like in dump_prob_full().
+        """
+        import numpy as np
+        from hmm_model import transition_sections, write_model
+
+        sections = transition_sections(self.transitions())
+        sections["grid"] = np.array([self.grid.num_rows, self.grid.num_cols])
+        write_model(filename, sections)
+
     def dump_train_data(self):
         print("----- dump train data: ------")
         for e in self.data_rows:
@@ -161,17 +260,23 @@ class TrainGrid:
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: ", sys.argv[0], "<grid.dat> <train.dat>")
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 2:
+        print("Usage: ", sys.argv[0], "<grid.dat> <train.dat> [--sparse]",
+              "[--binary=<tm.hmm>] [--instrument=<file.jsonl>] [--trace-memory]",
+              "[--profile=<file>]")
         sys.exit(1)
 
-    grid_filename = sys.argv[1]
-    train_filename = sys.argv[2]
+    grid_filename = args[0]
+    train_filename = args[1]
+
+    inst = from_options("gen_trans_matrix", opts)
 
     grid = ColorGrid()
-    grid.init_from_file(grid_filename)
+    with optional_phase(inst, "parse"):
+        grid.init_from_file(grid_filename)
 
-    traingrid = TrainGrid(grid)
+    traingrid = TrainGrid(grid, inst)
     traingrid.load(train_filename)
     #traingrid.dump_train_data()
     traingrid.calc_trans()
@@ -179,4 +284,12 @@ if __name__ == '__main__':
 
     traingrid.calc_prob()
     #traingrid.dump_prob()
-    traingrid.dump_prob_full()
+    if opts.get('binary'):
+        traingrid.write_binary(opts['binary'])
+    elif 'sparse' in opts:
+        traingrid.dump_prob_sparse()
+    else:
+        traingrid.dump_prob_full()
+
+    if inst is not None:
+        inst.finish()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# Synthetic workloads of any size.
+#
+# The repository only has a 4x4 grid and 200 line data files. This script creates:
+#
+# * grid:   a random color grid with a fraction of empty cells, in the grid.dat
+#           format;
+# * init:   initial probabilities for a grid, 1 for every cell as in init_prob.dat;
+# * walk:   a random walk of the robot on a grid, with noisy color observations, in
+#           the format of the training files (e.g. robot_perception_train.dat);
+# * sample: state and observation sequences drawn from a trained model (init, tm and
+#           em, as given to hmm_viterbi_test.py), in the format of the test files.
+#
+# Both walk and sample write the true state of every observation, so their output can
+# be used for training, for decoding (only the colors are read) and as the ground
+# truth for compare_result.py.
+#
+# Usage:
+#   python3 gen_workload.py grid <rows> <cols> <grid.dat> [--empty=0.15]
+#   python3 gen_workload.py init <grid.dat> <init_prob.dat>
+#   python3 gen_workload.py walk <grid.dat> <length> <train.dat> [--noise=0.1]
+#   python3 gen_workload.py sample <grid.dat> <init_file> <tm_file> <em_file> <length>
+#                                  <test.dat>
+#
+# All of them take --seed=N to make the output reproducible.
+
+import sys
+import numpy as np
+from array_grid import EMPTY, ArrayColorGrid
+from color_grid import COLORS, EMPTY_COLOR
+from sparse_transitions import SparseTransitions
+from utils import id2coord
+
+
+def random_grid(num_rows, num_cols, empty=0.15, rng=None):
+    """
+    Color codes (index in COLORS, or EMPTY) of a random grid, one per cell.
+    """
+    rng = rng or np.random.default_rng()
+    cells = rng.integers(0, len(COLORS), num_rows * num_cols)
+    cells[rng.random(len(cells)) < empty] = EMPTY
+    return cells
+
+
+def write_grid(filename, num_rows, num_cols, cells):
+    # EMPTY (-1) picks the last symbol
+    symbols = np.array(list(COLORS) + [EMPTY_COLOR])
+    with open(filename, 'w') as f:
+        f.write("%d,%d\n" % (num_rows, num_cols))
+        for r in range(0, num_rows):
+            row = cells[r * num_cols:(r + 1) * num_cols]
+            f.write(' '.join(symbols[row]) + '\n')
+
+
+def write_init(filename, num_cells):
+    """
+    Initial probabilities like init_prob.dat: 1 for every cell, 0 for the ending state.
+    """
+    with open(filename, 'w') as f:
+        f.write(', '.join(['1'] * num_cells + ['0']) + '\n')
+
+
+def noisy_colors(colors, noise, rng):
+    """
+    Observed colors: the true color, or with probability `noise` another one.
+    """
+    colors = np.array(colors)
+    flip = rng.random(len(colors)) < noise
+    shift = rng.integers(1, len(COLORS), len(colors))
+    colors[flip] = (colors[flip] + shift[flip]) % len(COLORS)
+    return colors
+
+
+def random_walk(grid, length, noise=0.1, rng=None):
+    """
+    A walk of the robot on an ArrayColorGrid: at every step it stays or moves to a
+    non-empty neighbor, all with the same probability. Returns the cells and the
+    (noisy) observed colors.
+    """
+    rng = rng or np.random.default_rng()
+    filled = np.flatnonzero(grid.colors != EMPTY)
+    if len(filled) == 0:
+        raise Exception("the grid has no non-empty cell")
+
+    # stay, then the neighbors; moves to empty cells or off the grid become stays
+    moves = np.vstack((np.arange(grid.num_elements), grid.neighbors))
+    blocked = (moves < 0) | (grid.colors[moves] == EMPTY)
+    moves[blocked] = np.broadcast_to(moves[0], moves.shape)[blocked]
+
+    cells = np.empty(length, dtype=np.int64)
+    choices = rng.integers(0, len(moves), length)
+    cell = rng.choice(filled)
+    for t in range(0, length):
+        # a blocked move is a stay, so staying is more likely next to empty cells,
+        # as in TrainGrid.calc_prob()
+        cell = moves[choices[t], cell]
+        cells[t] = cell
+
+    return cells, noisy_colors(grid.colors[cells], noise, rng)
+
+
+def sample_sequence(init_probs, trans, em, length, rng=None):
+    """
+    Draw a state sequence and its observations from a model. trans is a
+    SparseTransitions; the transitions to the ending state are left out.
+    """
+    rng = rng or np.random.default_rng()
+    end = trans.num_states - 1
+    em = np.asarray(em, dtype=np.float64)[:end]
+
+    start = np.asarray(init_probs, dtype=np.float64)[:end] * (em.sum(axis=1) > 0)
+    if start.sum() <= 0:
+        raise Exception("no state can start a sequence")
+
+    # cumulative transition probabilities within every row, without the ending state
+    keep = trans.indices != end
+    targets = trans.indices[keep]
+    ptr = np.searchsorted(trans.rows()[keep], np.arange(0, end + 1))
+    total = np.concatenate(([0], np.cumsum(trans.data[keep])))
+    cum = total[1:] - np.repeat(total[ptr[:-1]], np.diff(ptr))
+
+    states = np.empty(length, dtype=np.int64)
+    state = rng.choice(end, p=start / start.sum())
+    u = rng.random(length)
+    for t in range(0, length):
+        states[t] = state
+        lo, hi = ptr[state], ptr[state + 1]
+        if hi == lo:
+            raise Exception("state %d has no transition" % state)
+        j = np.searchsorted(cum[lo:hi], u[t] * cum[hi - 1], side='right')
+        state = targets[lo + min(j, hi - lo - 1)]
+
+    # observations, by inverse transform sampling of the emission rows
+    em_cum = np.cumsum(em[states], axis=1)
+    u = rng.random(length) * em_cum[:, -1]
+    colors = (em_cum < u[:, None]).sum(axis=1)
+    return states, np.minimum(colors, len(COLORS) - 1)
+
+
+def write_observations(filename, cells, colors, num_cols):
+    """
+    Write "x:y color" lines, the format of the training and the test files.
+    """
+    with open(filename, 'w') as f:
+        for cell, color in zip(cells.tolist(), colors.tolist()):
+            x, y = id2coord(cell, num_cols)
+            f.write("%d:%d %s\n" % (x, y, COLORS[color]))
+
+
+if __name__ == '__main__':
+    from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                  load_model_section, load_tm_file)
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    commands = {"grid": 4, "init": 3, "walk": 4, "sample": 7}
+    if len(args) < 1 or commands.get(args[0]) != len(args):
+        print("Usage: %s grid <rows> <cols> <grid.dat> [--empty=0.15]\n"
+              "       %s init <grid.dat> <init_prob.dat>\n"
+              "       %s walk <grid.dat> <length> <train.dat> [--noise=0.1]\n"
+              "       %s sample <grid.dat> <init_file> <tm_file> <em_file> <length> "
+              "<test.dat>\n"
+              "       [--seed=N]" % ((sys.argv[0],) * 4))
+        sys.exit(1)
+
+    rng = np.random.default_rng(int(opts['seed']) if opts.get('seed') else None)
+
+    if args[0] == "grid":
+        num_rows, num_cols = int(args[1]), int(args[2])
+        cells = random_grid(num_rows, num_cols, float(opts.get('empty') or 0.15), rng)
+        write_grid(args[3], num_rows, num_cols, cells)
+
+    elif args[0] == "init":
+        grid = ArrayColorGrid()
+        grid.init_from_file(args[1])
+        write_init(args[2], grid.num_elements)
+
+    elif args[0] == "walk":
+        grid = ArrayColorGrid()
+        grid.init_from_file(args[1])
+        cells, colors = random_walk(grid, int(args[2]),
+                                    float(opts.get('noise') or 0.1), rng)
+        write_observations(args[3], cells, colors, grid.num_cols)
+
+    else:
+        grid = ArrayColorGrid()
+        grid.init_from_file(args[1])
+        init_prob = load_model_section(args[2], "init", load_init_prob_file)
+        tm = load_model_section(args[3], "tm", load_tm_file)
+        em = load_model_section(args[4], "em", load_matrix)
+        if not isinstance(tm, SparseTransitions):
+            tm = SparseTransitions.from_matrix(tm)
+
+        states, colors = sample_sequence(init_prob, tm, em, int(args[5]), rng)
+        write_observations(args[6], states, colors, grid.num_cols)
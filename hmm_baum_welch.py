@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#
+# Baum-Welch (EM) training from unlabeled observation logs.
+#
+# gen_trans_matrix.py and gen_emit_matrix.py count labeled data, i.e. logs with the
+# true x:y position of every observation. Baum-Welch only needs the colors: starting
+# from a model (e.g. the matrices written by those scripts), every iteration
+#
+# 1) E-step: runs the forward-backward algorithm over every sequence and sums the
+#    expected number of times every transition is taken and every color is emitted
+#    from every state. The sequences are split over a pool of worker processes, and
+#    every step is one array operation over the states (or the transitions);
+# 2) M-step: re-estimates the transition and emission probabilities from the expected
+#    counts.
+#
+# Only the non-zero transitions of the starting matrix are re-estimated, so the
+# transitions stay restricted to the grid neighbors and the matrix stays sparse (see
+# sparse_transitions.py). The moves to the ending state keep their probability 1, and
+# the initial probabilities are not changed.
+#
+# The model uses the conventions of hmm_viterbi.py: a state emits before it moves, and
+# every sequence ends with a move to the ending state. The forward and backward
+# variables are rescaled at every step, so long sequences do not underflow.
+#
+# The iterations stop when the total log-likelihood improves by less than --tol
+# (relative), or after --iterations. With --checkpoint=<file.hmm>, the model is saved
+# (in the format of hmm_model.py) after every iteration, and a run that finds the file
+# continues from it.
+#
+# Usage:
+#   python3 hmm_baum_welch.py <num_states> <init_file> <tm_file> <em_file>
+#       <observation_file> [<observation_file> ...] --tm-out=<file> --em-out=<file>
+#       [--iterations=20] [--tol=1e-4] [--workers=N] [--checkpoint=<file.hmm>]
+#       [--sparse]
+
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool
+from hmm_viterbi_np import emission_table
+from sparse_transitions import SparseTransitions
+
+ITERATIONS = 20
+TOLERANCE = 1e-4
+
+# observation sequences of a worker process, set by init_worker()
+worker_obs = None
+
+
+def expected_counts(init_probs, trans, em, obs):
+    """
+    Forward-backward over one (integer encoded) sequence. Returns (log P(obs), the
+    expected number of times every transition is taken (one per CSR entry of trans),
+    the expected emission counts (states x symbols)), or None if P(obs) is 0.
+    """
+    n, end = trans.num_states, trans.num_states - 1
+    em_t = emission_table(em, n)
+    rows, cols, data = trans.rows(), trans.indices, trans.data
+    T = len(obs)
+
+    # alpha[t] = P(o_0..o_t-1, s_t = i), scaled to sum to 1; c[t] is the scale factor
+    # from step t to t + 1
+    alpha = np.empty((T, n))
+    c = np.empty(T)
+    a = np.asarray(init_probs, dtype=np.float64)[:n]
+    a = a / a.sum()
+    for t in range(0, T):
+        alpha[t] = a
+        nxt = trans.forward(a * em_t[obs[t]])
+        c[t] = nxt[end] if t == T - 1 else nxt[:end].sum()
+        if c[t] <= 0:
+            return None
+
+        a = nxt / c[t]
+        a[end] = 0
+
+    # beta[t] = P(o_t..o_T-1, end | s_t = i), scaled by the c of the same steps
+    xi = np.zeros(len(data))
+    beta = np.zeros(n)
+    beta[end] = 1
+    gamma = np.empty((T, n))
+    for t in range(T - 1, -1, -1):
+        if t < T - 1:
+            src = alpha[t] * em_t[obs[t]]
+            xi += src[rows] * data * beta[cols] / c[t]
+
+        beta = em_t[obs[t]] * np.bincount(rows, weights=data * beta[cols],
+                                          minlength=n) / c[t]
+        gamma[t] = alpha[t] * beta
+
+    em_counts = np.zeros((n, em_t.shape[0]))
+    for s in range(0, em_t.shape[0]):
+        em_counts[:, s] = gamma[obs == s].sum(axis=0)
+
+    return np.log(c).sum(), xi, em_counts
+
+
+def sum_counts(init_probs, trans, em, obs_list):
+    """
+    The sum of expected_counts() over sequences. Returns (log-likelihood, xi,
+    em_counts, number of sequences with probability 0, which are left out).
+    """
+    loglik, skipped = 0.0, 0
+    xi = np.zeros(trans.nnz)
+    em_counts = np.zeros((trans.num_states, np.shape(em)[1]))
+
+    for obs in obs_list:
+        if len(obs) == 0:
+            continue
+
+        counts = expected_counts(init_probs, trans, em, obs)
+        if counts is None:
+            skipped += 1
+            continue
+
+        loglik += counts[0]
+        xi += counts[1]
+        em_counts += counts[2]
+
+    return loglik, xi, em_counts, skipped
+
+
+def init_worker(obs_list):
+    global worker_obs
+    worker_obs = obs_list
+
+
+def sum_counts_task(task):
+    init_probs, trans, em, indices = task
+    return sum_counts(init_probs, trans, em, [worker_obs[i] for i in indices])
+
+
+def maximize(trans, em, xi, em_counts):
+    """
+    M-step: the new transitions and emissions. Transitions to the ending state, and
+    the rows of states that were never visited, are kept.
+    """
+    end = trans.num_states - 1
+    rows = trans.rows()
+    inner = trans.indices != end
+
+    row_sum = np.bincount(rows[inner], weights=xi[inner], minlength=trans.num_states)
+    update = inner & (row_sum[rows] > 0)
+    data = np.array(trans.data)
+    data[update] = xi[update] / row_sum[rows[update]]
+
+    em = np.array(em, dtype=np.float64)
+    total = em_counts.sum(axis=1)
+    visited = total > 0
+    em[visited] = em_counts[visited] / total[visited, None]
+
+    return SparseTransitions(trans.num_states, trans.indptr, trans.indices, data), em
+
+
+def save_checkpoint(filename, init_probs, trans, em, history):
+    from hmm_model import transition_sections, write_model
+
+    sections = {"init": np.asarray(init_probs, dtype=np.float64)}
+    sections.update(transition_sections(trans))
+    sections["em"] = em
+    sections["loglik"] = np.array(history, dtype=np.float64)
+
+    tmp = filename + ".tmp"
+    write_model(tmp, sections)
+    os.replace(tmp, filename)
+
+
+def load_checkpoint(filename):
+    """
+    (init_probs, trans, em, log-likelihood history) saved by save_checkpoint().
+    """
+    from hmm_model import ModelFile
+
+    model = ModelFile(filename)
+    trans = model.transitions()
+    trans = SparseTransitions(trans.num_states, np.array(trans.indptr),
+                              np.array(trans.indices), np.array(trans.data))
+    return (np.array(model.init_probs()), trans, np.array(model.emissions()),
+            model["loglik"].tolist())
+
+
+def baum_welch(init_probs, trans, em, obs_list, iterations=ITERATIONS,
+               tol=TOLERANCE, workers=None, checkpoint=None, history=None,
+               report=None):
+    """
+    Run Baum-Welch from the model (init_probs, trans, em). trans is a
+    SparseTransitions, and only its non-zero entries are re-estimated.
+
+    * args:
+      obs_list: (integer encoded) observation sequences
+       workers: number of worker processes (1 to run in this process)
+    checkpoint: file to save the model to after every iteration
+       history: log-likelihoods of earlier iterations (when resuming)
+        report: called with (iteration, log-likelihood, skipped) after every E-step
+
+    Returns (trans, em, history); history[i] is the log-likelihood of the model
+    before iteration i + 1.
+    """
+    history = list(history or [])
+    pool = None
+    if workers != 1:
+        workers = workers or os.cpu_count() or 1
+        pool = Pool(workers, initializer=init_worker, initargs=(obs_list,))
+        batches = np.array_split(np.arange(len(obs_list)), workers)
+
+    try:
+        for _ in range(0, iterations):
+            if pool is None:
+                loglik, xi, em_counts, skipped = sum_counts(init_probs, trans, em,
+                                                            obs_list)
+            else:
+                results = pool.map(sum_counts_task,
+                                   [(init_probs, trans, em, b) for b in batches])
+                loglik = sum([r[0] for r in results])
+                xi = sum([r[1] for r in results])
+                em_counts = sum([r[2] for r in results])
+                skipped = sum([r[3] for r in results])
+
+            if report:
+                report(len(history), loglik, skipped)
+
+            converged = (len(history) > 0 and
+                         loglik - history[-1] <= tol * abs(history[-1]))
+            history.append(loglik)
+            if converged:
+                break
+
+            trans, em = maximize(trans, em, xi, em_counts)
+            if checkpoint:
+                save_checkpoint(checkpoint, init_probs, trans, em, history)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return trans, em, history
+
+
+if __name__ == '__main__':
+    from hmm_model import dump_sparse_text, dump_text
+    from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                  load_model_section, load_tm_file)
+    from observations import load_observations
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 5 or not opts.get('tm-out') or not opts.get('em-out'):
+        print("Usage:", sys.argv[0], "<num_states> <init_file> <tm_file> <em_file>",
+              "<observation_file> [<observation_file> ...] --tm-out=<file>",
+              "--em-out=<file> [--iterations=20] [--tol=1e-4] [--workers=N]",
+              "[--checkpoint=<file.hmm>] [--sparse]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    checkpoint = opts.get('checkpoint')
+    history = []
+    if checkpoint and os.path.exists(checkpoint):
+        init_prob, trans, em, history = load_checkpoint(checkpoint)
+        print("resuming from %s after %d iterations" % (checkpoint, len(history)))
+    else:
+        init_prob = load_model_section(args[1], "init", load_init_prob_file)
+        init_prob = np.asarray(init_prob, dtype=np.float64)[:num_states]
+        tm = load_model_section(args[2], "tm", load_tm_file)
+        if not isinstance(tm, SparseTransitions):
+            tm = SparseTransitions.from_matrix(tm, num_states)
+        trans = tm
+        em = np.asarray(load_model_section(args[3], "em", load_matrix),
+                        dtype=np.float64)[:num_states]
+
+    obs_list = [load_observations(f) for f in args[4:]]
+
+    def report(iteration, loglik, skipped):
+        print("iteration %d: log-likelihood %.6f%s" %
+              (iteration, loglik,
+               ", %d sequences with probability 0 left out" % skipped
+               if skipped else ""), flush=True)
+
+    iterations = int(opts.get('iterations') or ITERATIONS)
+    workers = int(opts['workers']) if opts.get('workers') else None
+    trans, em, history = baum_welch(init_prob, trans, em, obs_list,
+                                    max(iterations - len(history), 0),
+                                    float(opts.get('tol') or TOLERANCE), workers,
+                                    checkpoint, history, report)
+
+    if 'sparse' in opts:
+        dump_sparse_text(opts['tm-out'], trans)
+    else:
+        dump_text(opts['tm-out'], trans.todense())
+    dump_text(opts['em-out'], em)
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+#
+# Benchmark of the decoders and the trainers on synthetic workloads.
+#
+# For every grid size, a random grid and a random walk training log are created with
+# gen_workload.py, and every trainer is run on the log. The model trained by
+# hmm_train.py is then used to sample observation sequences of every length, which
+# every decoder decodes. For every (path, grid size, length) it reports:
+#
+# * the latency of one run (mean and percentiles), in milliseconds;
+# * the throughput, in observations (decoders) or training lines (trainers) per
+#   second;
+# * the peak memory of one run, measured with tracemalloc in a separate run (for the
+#   parallel paths, only the memory of the parent process is seen);
+# * for the decoders, the fraction of states decoded correctly.
+#
+# Every decoder runs once on the first sequence before it is timed, so that the time
+# to build the cached model tables (see model_cache.py) is not counted in the
+# latency. The pure Python decoder is skipped when states^2 * length exceeds
+# --python-limit, and the dense engines when the number of states exceeds
+# --dense-limit.
+#
+# The "beam" and "threshold" paths are the "sparse" engine with beam pruning (a
+# width of BEAM states, or a log probability THRESHOLD below the best state): next
+# to "sparse", they show from which grid size pruning pays off, and their accuracy
+# what it costs.
+#
+# "pool" (hmm_viterbi_pool.py) and "parallel" (hmm_viterbi_parallel.py) decode on
+# --workers processes; the time of "pool" includes writing the sequences to files
+# and reading the traces back, and both include starting the pool. "incremental"
+# (hmm_train.py --counts) loads the saved counts of the first half of the log and
+# adds the second half; the counts are saved before it is timed.
+#
+# The results are saved as JSON. With --compare=<old.json>, the latencies are also
+# compared with those of an earlier run.
+#
+# Usage:
+#   python3 hmm_benchmark.py <results.json> [--sizes=4x4,20x20,50x50]
+#       [--lengths=100,1000] [--runs=5] [--train=20000] [--paths=p1,p2,...]
+#       [--workers=N] [--seed=N] [--python-limit=N] [--dense-limit=N]
+#       [--compare=<old.json>]
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+import numpy as np
+from array_grid import ArrayColorGrid
+from color_grid import COLORS, ColorGrid
+from gen_emit_matrix import TrainEmitGrid
+from gen_trans_matrix import TrainGrid
+from gen_workload import (random_grid, random_walk, sample_sequence, write_grid,
+                          write_observations)
+from hmm_train import TrainCounts, train, train_parallel
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_stream import StreamingViterbi
+from model_cache import identity_cache, model_cache
+from sparse_transitions import SparseTransitions
+
+PYTHON_LIMIT = 2e8
+DENSE_LIMIT = 2000
+# settings of the "beam" and "threshold" paths (see hmm_viterbi_beam.py)
+BEAM = 50
+THRESHOLD = 10.0
+
+
+def train_gen_scripts(grid_file, train_file, workers):
+    grid = ColorGrid()
+    grid.init_from_file(grid_file)
+
+    traingrid = TrainGrid(grid)
+    traingrid.load(train_file)
+    traingrid.calc_trans()
+    traingrid.calc_prob()
+
+    emitgrid = TrainEmitGrid(grid)
+    emitgrid.load(train_file)
+    emitgrid.get_emit_stats()
+    emitgrid.calc_emit_prob()
+
+
+def train_single_pass(grid_file, train_file, workers):
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_file)
+    train(grid, [train_file])
+
+
+def train_sharded(grid_file, train_file, workers):
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_file)
+    train_parallel(grid, [train_file], workers=workers)
+
+
+def split_log(train_file):
+    """
+    The files of the first and the second half of a log, next to it.
+    """
+    with open(train_file, 'r') as f:
+        lines = f.readlines()
+
+    names = [train_file + ".first", train_file + ".second"]
+    for name, part in zip(names, (lines[:len(lines) // 2], lines[len(lines) // 2:])):
+        with open(name, 'w') as f:
+            f.writelines(part)
+    return names
+
+
+def prepare_incremental(grid_file, train_file):
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_file)
+    first, _ = split_log(train_file)
+    counts = TrainCounts(grid.num_elements, grid.num_cols)
+    counts.add_file(first)
+    counts.save(train_file + ".counts.npz")
+
+
+def train_incremental(grid_file, train_file, workers):
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_file)
+    counts = TrainCounts.load(train_file + ".counts.npz")
+    train(grid, [train_file + ".second"], counts)
+
+
+TRAINERS = {
+    "gen_scripts": train_gen_scripts,
+    "single_pass": train_single_pass,
+    "sharded": train_sharded,
+    "incremental": train_incremental,
+}
+# name -> setup run once before a trainer is timed
+PREPARE = {
+    "incremental": prepare_incremental,
+}
+
+
+def decode_with(engine, memory="full", beam=None, threshold=None):
+    def decode(model, seqs):
+        n, init_probs, tm, em, trans = model
+        if engine == "sparse":
+            tm = trans
+
+        traces = []
+        for seq in seqs:
+            va = ViterbiAlgorithm(n, init_probs, tm, em, seq, engine, memory,
+                                  beam=beam, threshold=threshold)
+            va.predict()
+            traces.append(va.backtrace(len(seq) - 1))
+        return traces
+
+    return decode
+
+
+def decode_stream(model, seqs):
+    trans, em = model[4], model[3]
+    return [list(StreamingViterbi(model[1], trans, em).decode(seq)) for seq in seqs]
+
+
+def decode_batch(model, seqs):
+    n, init_probs, _, em, trans = model
+    return ViterbiAlgorithm.decode_batch(n, init_probs, trans, em, seqs, "sparse")
+
+
+def decode_pool(model, seqs, workers=None):
+    from compare_result import read_values
+    from hmm_viterbi_pool import decode_files
+
+    n, init_probs, _, em, trans = model
+    with tempfile.TemporaryDirectory() as tmp:
+        obs_files = []
+        for i, seq in enumerate(seqs):
+            obs_files.append(os.path.join(tmp, "seq%d.dat" % i))
+            with open(obs_files[-1], 'w') as f:
+                f.writelines([c + '\n' for c in seq])
+
+        out_dir = os.path.join(tmp, "out")
+        os.makedirs(out_dir)
+        traces = []
+        # printed with n columns, so that the state is x - 1
+        for _, out_file, _ in decode_files(init_probs, trans, em, obs_files, out_dir,
+                                           workers, n):
+            values = list(read_values(out_file))
+            traces.append((np.concatenate(values)[:, 0] - 1).tolist()
+                          if values else [])
+    return traces
+
+
+def decode_parallel(model, seqs, workers=None):
+    from hmm_viterbi_np import encode_observations
+    from hmm_viterbi_parallel import viterbi_parallel
+
+    _, init_probs, _, em, trans = model
+    return [viterbi_parallel(init_probs, trans, em, encode_observations(seq),
+                             workers=workers) for seq in seqs]
+
+
+# name -> (decode function, needs the dense matrix)
+DECODERS = {
+    "python": (decode_with("python"), True),
+    "numpy": (decode_with("numpy"), True),
+    "sparse": (decode_with("sparse"), False),
+    "sparse-compact": (decode_with("sparse", "compact"), False),
+    "sparse-checkpoint": (decode_with("sparse", "checkpoint"), False),
+    "stream": (decode_stream, False),
+    "batch": (decode_batch, False),
+    "pool": (decode_pool, False),
+    "parallel": (decode_parallel, False),
+    "beam": (decode_with("sparse", beam=BEAM), False),
+    "threshold": (decode_with("sparse", threshold=THRESHOLD), False),
+}
+# decoders that take the number of worker processes
+WORKER_DECODERS = ("pool", "parallel")
+
+
+def summary(seconds, items, peak):
+    """
+    A result record for the run times `seconds` of runs of `items` items each.
+    """
+    ms = np.array(seconds) * 1e3
+    return {
+        "runs": len(seconds),
+        "latency_ms": {
+            "mean": float(ms.mean()),
+            "p50": float(np.percentile(ms, 50)),
+            "p90": float(np.percentile(ms, 90)),
+            "p99": float(np.percentile(ms, 99)),
+            "max": float(ms.max()),
+        },
+        "throughput": items * len(seconds) / max(sum(seconds), 1e-9),
+        "peak_mb": peak / 1e6,
+    }
+
+
+def peak_memory(f, *args):
+    tracemalloc.start()
+    try:
+        f(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_trainers(paths, grid_file, train_file, num_lines, runs, workers):
+    results = []
+    for name, f in TRAINERS.items():
+        if name not in paths:
+            continue
+        if name in PREPARE:
+            PREPARE[name](grid_file, train_file)
+
+        seconds = []
+        for _ in range(0, runs):
+            start = time.perf_counter()
+            f(grid_file, train_file, workers)
+            seconds.append(time.perf_counter() - start)
+
+        r = {"kind": "train", "path": name, "length": num_lines}
+        r.update(summary(seconds, num_lines, peak_memory(f, grid_file, train_file,
+                                                         workers)))
+        results.append(r)
+
+    return results
+
+
+def bench_decoders(paths, model, samples, opts):
+    n = model[0]
+    seqs = [[COLORS[c] for c in colors] for _, colors in samples]
+    truth = [states.tolist() for states, _ in samples]
+    length = len(seqs[0])
+
+    results = []
+    for name, (f, dense) in DECODERS.items():
+        if name not in paths:
+            continue
+        if dense and n > opts["dense_limit"]:
+            continue
+        if name == "python" and n * n * length > opts["python_limit"]:
+            continue
+        if name in WORKER_DECODERS:
+            f = partial(f, workers=opts["workers"])
+
+        f(model, seqs[:1])
+        if name == "batch":
+            # one run decodes all sequences
+            start = time.perf_counter()
+            traces = f(model, seqs)
+            seconds = [time.perf_counter() - start]
+            items = length * len(seqs)
+        else:
+            traces, seconds = [], []
+            for seq in seqs:
+                start = time.perf_counter()
+                traces += f(model, [seq])
+                seconds.append(time.perf_counter() - start)
+            items = length
+
+        correct = sum([np.count_nonzero(np.array(t) == s)
+                       for t, s in zip(traces, truth)])
+        r = {"kind": "decode", "path": name, "length": length}
+        r.update(summary(seconds, items, peak_memory(f, model, seqs[:1])))
+        r["accuracy"] = correct / (length * len(seqs))
+        results.append(r)
+
+    return results
+
+
+def build_model(traingrid, emitgrid, dense):
+    """
+    (n, init_probs, tm, em, trans) of a trained grid; tm is the dense matrix, or None
+    if it is not needed.
+    """
+    trans = SparseTransitions.from_train_grid(traingrid)
+    n = trans.num_states
+    em = [[t[c] for c in COLORS] for t in emitgrid.prob] + [[0] * len(COLORS)]
+    init_probs = [1] * (n - 1) + [0]
+    tm = trans.todense() if dense else None
+    return n, init_probs, tm, np.array(em), trans
+
+
+def run(sizes, lengths, paths, opts):
+    rng = np.random.default_rng(opts["seed"])
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_rows, num_cols in sizes:
+            grid_file = os.path.join(tmp, "grid.dat")
+            train_file = os.path.join(tmp, "train.dat")
+            write_grid(grid_file, num_rows, num_cols,
+                       random_grid(num_rows, num_cols, rng=rng))
+
+            grid = ArrayColorGrid()
+            grid.init_from_file(grid_file)
+            cells, colors = random_walk(grid, opts["train"], rng=rng)
+            write_observations(train_file, cells, colors, num_cols)
+
+            size = {"grid": "%dx%d" % (num_rows, num_cols),
+                    "states": grid.num_elements + 1}
+            for r in bench_trainers(paths, grid_file, train_file, opts["train"],
+                                    opts["runs"], opts["workers"]):
+                r.update(size)
+                results.append(r)
+                report(r)
+
+            n = grid.num_elements + 1
+            model = build_model(*train(grid, [train_file]), n <= opts["dense_limit"])
+            for length in lengths:
+                samples = [sample_sequence(model[1], model[4], model[3], length, rng)
+                           for _ in range(0, opts["runs"])]
+                for r in bench_decoders(paths, model, samples, opts):
+                    r.update(size)
+                    results.append(r)
+                    report(r)
+
+            model_cache.clear()
+            identity_cache.clear()
+
+    return results
+
+
+def report(r):
+    print("%-6s %-18s %9s %7d states %8d long: p50 %10.3f ms, p99 %10.3f ms, "
+          "%12.0f/s, peak %9.3f MB%s" %
+          (r["kind"], r["path"], r["grid"], r["states"], r["length"],
+           r["latency_ms"]["p50"], r["latency_ms"]["p99"], r["throughput"],
+           r["peak_mb"],
+           ", accuracy %.2f%%" % (r["accuracy"] * 100) if "accuracy" in r else ""),
+          flush=True)
+
+
+def result_key(r):
+    return (r["kind"], r["path"], r["grid"], r["length"])
+
+
+def compare(old_results, results):
+    """
+    Print the p50 latency of every result next to the same result of an older run.
+    """
+    old = {result_key(r): r for r in old_results}
+    print("\n%-6s %-18s %9s %8s %14s %14s %8s" %
+          ("kind", "path", "grid", "length", "old p50 (ms)", "new p50 (ms)", "speedup"))
+    for r in results:
+        o = old.get(result_key(r))
+        if o is None:
+            continue
+
+        a, b = o["latency_ms"]["p50"], r["latency_ms"]["p50"]
+        print("%-6s %-18s %9s %8d %14.3f %14.3f %7.2fx" %
+              (r["kind"], r["path"], r["grid"], r["length"], a, b, a / max(b, 1e-9)))
+
+
+if __name__ == '__main__':
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage:", sys.argv[0], "<results.json> [--sizes=4x4,20x20,50x50]",
+              "[--lengths=100,1000] [--runs=5] [--train=20000] [--paths=p1,p2,...]",
+              "[--workers=N] [--seed=N] [--python-limit=N] [--dense-limit=N]",
+              "[--compare=<old.json>]")
+        print("paths:", ', '.join(list(TRAINERS) + list(DECODERS)))
+        sys.exit(1)
+
+    sizes = [tuple([int(x) for x in s.split('x')])
+             for s in opts.get('sizes', '4x4,20x20,50x50').split(',')]
+    lengths = [int(x) for x in opts.get('lengths', '100,1000').split(',')]
+    paths = opts.get('paths') or ','.join(list(TRAINERS) + list(DECODERS))
+    paths = paths.split(',')
+    for path in paths:
+        if path not in TRAINERS and path not in DECODERS:
+            raise Exception("unknown path %s" % path)
+
+    settings = {
+        "runs": int(opts.get('runs') or 5),
+        "train": int(opts.get('train') or 20000),
+        "workers": int(opts['workers']) if opts.get('workers') else None,
+        "seed": int(opts['seed']) if opts.get('seed') else 1,
+        "python_limit": float(opts.get('python-limit') or PYTHON_LIMIT),
+        "dense_limit": int(opts.get('dense-limit') or DENSE_LIMIT),
+    }
+
+    results = run(sizes, lengths, paths, settings)
+
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "sizes": ["%dx%d" % s for s in sizes],
+        "lengths": lengths,
+        "paths": paths,
+        "settings": settings,
+    }
+    with open(args[0], 'w') as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+
+    if opts.get('compare'):
+        with open(opts['compare'], 'r') as f:
+            compare(json.load(f)["results"], results)
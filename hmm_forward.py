@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Forward algorithm: the log-likelihood log P(seq) of observation sequences.
+#
+# ViterbiAlgorithm finds the single most likely path; the forward algorithm sums the
+# probabilities of all paths instead, which tells how well a sequence fits the model
+# as a whole, e.g. to flag robot logs that do not fit it (anomalies).
+#
+# The model is the same as for hmm_viterbi_test.py (see the comments at the top of
+# hmm_viterbi.py). The sequence ends with a move to the ending state N, so
+#
+#   P(seq) = sum over all paths of init[s0] * em[s0][o0] * tm[s0][s1] * ...
+#                                       * em[s(T-1)][o(T-1)] * tm[s(T-1)][N]
+#
+# The initial probabilities are normalized to sum to 1, as init_prob.dat only holds
+# weights.
+#
+# The forward variables are rescaled to sum to 1 after every step and the log of the
+# scale factors is accumulated, so long sequences do not underflow. Every step is one
+# array operation over all states (through the transitions objects of
+# hmm_viterbi_np.py, so the sparse form is supported), and many sequences are scored
+# together in one batch, as in viterbi_batch().
+#
+# Usage:
+#   python3 hmm_forward.py <num_states> <init_file> <tm_file> <em_file>
+#                          <observation_file> [<observation_file> ...]
+#                          [--engine=numpy|sparse]
+
+import sys
+import numpy as np
+from hmm_viterbi_np import emission_table, make_transitions
+
+
+def forward_batch(init_probs, trans, em, obs_list):
+    """
+    log P(obs) of every (integer encoded) observation sequence in obs_list, as an
+    array. Sequences with probability 0 get -inf, and empty sequences 0.
+    """
+    num_states = trans.num_states
+    em_t = emission_table(em, num_states)
+
+    init = np.asarray(init_probs, dtype=np.float64)[:num_states]
+    init = init / init.sum()
+
+    lengths = np.array([len(obs) for obs in obs_list], dtype=np.int64)
+    order = np.argsort(-lengths, kind='stable')
+    lengths = lengths[order]
+    max_len = int(lengths[0]) if len(lengths) else 0
+
+    padded = np.zeros((len(obs_list), max_len), dtype=np.uint8)
+    for row, i in enumerate(order):
+        padded[row, :lengths[row]] = obs_list[i]
+
+    # number of sequences still running at each step
+    running = np.searchsorted(-lengths, -np.arange(0, max_len), side='left')
+
+    alpha = np.empty((len(obs_list), num_states))
+    alpha[:] = init
+    scale = np.zeros(len(obs_list))
+    logp = np.zeros(len(obs_list))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(0, max_len):
+            b = running[k]
+            a = trans.forward(alpha[:b] * em_t[padded[:b, k]])
+
+            # sequences that end here: move to the ending state
+            last = lengths[:b] == k + 1
+            logp[:b][last] = np.log(a[last, -1]) + scale[:b][last]
+
+            c = a[:, :-1].sum(axis=1)
+            alpha[:b] = np.where(c[:, None] > 0, a / c[:, None], 0)
+            scale[:b] += np.log(c)
+
+    result = np.empty(len(obs_list))
+    result[order] = logp
+    return result
+
+
+def forward(init_probs, trans, em, obs):
+    """
+    log P(obs) of one (integer encoded) observation sequence.
+    """
+    return float(forward_batch(init_probs, trans, em, [obs])[0])
+
+
+if __name__ == '__main__':
+    from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                  load_model_section, load_tm_file)
+    from observations import load_observations
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 5:
+        print("Usage:", sys.argv[0],
+              "<num_states> <init_file> <tm_file> <em_file>",
+              "<observation_file> [<observation_file> ...] [--engine=numpy|sparse]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    init_prob = load_model_section(args[1], "init", load_init_prob_file)
+    tm = load_model_section(args[2], "tm", load_tm_file)
+    em = load_model_section(args[3], "em", load_matrix)
+    trans = make_transitions(tm, num_states, opts.get('engine') == 'sparse')
+
+    seqs = [load_observations(f) for f in args[4:]]
+    logps = forward_batch(init_prob, trans, em, seqs)
+
+    for f, seq, logp in zip(args[4:], seqs, logps):
+        print("%s: log P = %.6f, per observation = %.6f" %
+              (f, logp, logp / max(len(seq), 1)))
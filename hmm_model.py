@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+#
+# Binary, memory-mappable container for HMM models.
+#
+# The text files read by hmm_viterbi_test.py (init_prob.dat, tm.dat, em.dat) are
+# parsed number by number, which for large grids dominates the start-up time. A
+# model file holds the same data as little-endian binary arrays:
+#
+#   header:   magic "HMMMODEL", format version, number of sections, CRC32 of the
+#             section table
+#   sections: name, dtype, shape, offset, size and CRC32 of each array
+#   data:     the arrays, each aligned to 64 bytes
+#
+# Known sections:
+#   init          initial probabilities (N)
+#   tm            dense transition matrix (N x N), or
+#   tm.<array>    a SparseTransitions (see SparseTransitions.ARRAYS)
+#   em            emission matrix (N x number of colors)
+#   colors        the color alphabet, one byte per color, in column order of em
+#   grid          number of rows and columns of the color grid
+#
+# A model file may hold only some of the sections, e.g. gen_trans_matrix.py writes
+# only the transitions. ModelFile maps the file and creates the arrays lazily, on
+# first access, without copying them. The CRC32 of a section is checked when it is
+# first accessed, unless the file is opened with verify=False.
+#
+# Usage:
+#   python3 hmm_model.py pack <out.hmm> [--init=f] [--tm=f] [--em=f] [--sparse]
+#   python3 hmm_model.py unpack <model.hmm> <out_dir> [--dense]
+#   python3 hmm_model.py info <model.hmm>
+#
+# where each f is either a text file or a model file. unpack writes sparse
+# transitions in the sparse text format of hmm_train.py (--sparse), unless --dense
+# is given.
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+from sparse_transitions import SparseTransitions
+
+MAGIC = b"HMMMODEL"
+VERSION = 1
+ALIGN = 64
+
+HEADER = struct.Struct("<8sIII")
+SECTION = struct.Struct("<16s4sIQQQQI")
+
+
+def is_model_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def text_rounded(a, format_str="%.4f"):
+    """
+    Round the values of an array the way they are rounded when written to the text
+    files, so that a model file and its text files decode to the same paths.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    return np.array([float(format_str % x) for x in a.ravel()]).reshape(a.shape)
+
+
+def write_model(filename, sections):
+    """
+    Write a model file from a dict of section name -> array.
+    """
+    arrays = []
+    for name, a in sections.items():
+        a = np.asarray(a)
+        arrays.append((name, np.ascontiguousarray(a, a.dtype.newbyteorder('<'))))
+
+    offset = HEADER.size + SECTION.size * len(arrays)
+
+    table, offsets = b'', []
+    for name, a in arrays:
+        offset = -(-offset // ALIGN) * ALIGN
+        shape = tuple(a.shape) + (0,) * (2 - a.ndim)
+        table += SECTION.pack(name.encode(), a.dtype.str.encode(), a.ndim, shape[0],
+                              shape[1], offset, a.nbytes, zlib.crc32(a.tobytes()))
+        offsets.append(offset)
+        offset += a.nbytes
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(arrays), zlib.crc32(table)))
+        f.write(table)
+        for (_, a), offset in zip(arrays, offsets):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(a.tobytes())
+
+
+class ModelFile:
+    """
+    A memory-mapped model file. Sections are read with model[name], or with the
+    helpers init_probs(), transitions(), emissions(). With verify, an Exception is
+    raised when a section is read whose CRC32 does not match.
+    """
+
+    def __init__(self, filename, verify=True):
+        self.filename = filename
+        self.verify_sections = verify
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, crc = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise Exception("%s is not a model file" % filename)
+        if version != VERSION:
+            raise Exception("%s: unsupported model file version %d" %
+                            (filename, version))
+
+        table = self.mm[HEADER.size:HEADER.size + SECTION.size * count]
+        if zlib.crc32(table) != crc:
+            raise Exception("%s: corrupted section table" % filename)
+
+        self.sections = {}
+        for i in range(0, count):
+            name, dtype, ndim, s0, s1, offset, nbytes, crc = SECTION.unpack_from(
+                table, i * SECTION.size)
+            dtype = dtype.rstrip(b'\0').decode()
+            shape = (s0, s1)[:ndim]
+            if offset + nbytes > len(self.mm) or \
+                    nbytes != int(np.prod(shape)) * np.dtype(dtype).itemsize:
+                raise Exception("%s: corrupted section table" % filename)
+            self.sections[name.rstrip(b'\0').decode()] = (dtype, shape, offset,
+                                                          nbytes, crc)
+
+        self.arrays = {}
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            dtype, shape, offset, nbytes, _ = self.sections[name]
+            if self.verify_sections:
+                self.verify_section(name)
+            a = np.frombuffer(self.mm, dtype=dtype, count=int(np.prod(shape)),
+                              offset=offset)
+            self.arrays[name] = a.reshape(shape)
+
+        return self.arrays[name]
+
+    def verify_section(self, name):
+        """
+        Check the CRC32 of a section; raises an Exception on a mismatch.
+        """
+        _, _, offset, nbytes, crc = self.sections[name]
+        with memoryview(self.mm) as view:
+            if zlib.crc32(view[offset:offset + nbytes]) != crc:
+                raise Exception("%s: corrupted section %s" % (self.filename, name))
+
+    def verify(self):
+        """
+        Check the CRC32 of every section; raises an Exception on a mismatch.
+        """
+        for name in self.sections:
+            self.verify_section(name)
+
+    def init_probs(self):
+        return self["init"]
+
+    def emissions(self):
+        return self["em"]
+
+    def colors(self):
+        return self["colors"].tobytes().decode()
+
+    def grid_size(self):
+        return tuple(int(x) for x in self["grid"])
+
+    def has_sparse_transitions(self):
+        return "tm.indptr" in self
+
+    def transitions(self):
+        """
+        The transition matrix: a SparseTransitions for sparse model files (backed by
+        the mapped file), otherwise the dense matrix.
+        """
+        if self.has_sparse_transitions():
+            return SparseTransitions.from_arrays(
+                {name: self["tm." + name] for name in SparseTransitions.ARRAYS})
+
+        return self["tm"]
+
+    def dense_transitions(self):
+        if self.has_sparse_transitions():
+            return self.transitions().todense()
+
+        return self["tm"]
+
+
+def transition_sections(tm):
+    """
+    Sections for a transition matrix: a SparseTransitions, or a dense matrix.
+    """
+    if isinstance(tm, SparseTransitions):
+        return {"tm." + name: a for name, a in tm.arrays().items()}
+
+    return {"tm": np.asarray(tm, dtype=np.float64)}
+
+
+def dump_text(filename, m, format_str="%7.4f"):
+    with open(filename, 'w') as f:
+        for row in np.atleast_2d(m):
+            f.write(', '.join([format_str % e for e in row]) + '\n')
+
+
+def dump_sparse_text(filename, trans, format_str="%d:%.4f"):
+    """
+    Write a SparseTransitions in the text format of TrainGrid.dump_prob_sparse().
+    """
+    with open(filename, 'w') as f:
+        f.write("sparse %d\n" % trans.num_states)
+        for i in range(0, trans.num_states):
+            lo, hi = trans.indptr[i], trans.indptr[i + 1]
+            row = [(j, p) for j, p in zip(trans.indices[lo:hi].tolist(),
+                                          trans.data[lo:hi].tolist())
+                   if float("%.4f" % p) != 0]
+            f.write(', '.join([format_str % e for e in row]) + '\n')
+
+
+if __name__ == '__main__':
+    from hmm_viterbi_test import load_init_prob_file, load_matrix, load_tm_file
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    usage = ("Usage: %s pack <out.hmm> [--init=f] [--tm=f] [--em=f] [--sparse]\n"
+             "       %s unpack <model.hmm> <out_dir> [--dense]\n"
+             "       %s info <model.hmm>" % ((sys.argv[0],) * 3))
+
+    if len(args) < 2 or args[0] not in ("pack", "unpack", "info"):
+        print(usage)
+        sys.exit(1)
+
+    if args[0] == "pack":
+        sections = {}
+        for section in ("init", "tm", "em"):
+            if not opts.get(section):
+                continue
+
+            if is_model_file(opts[section]):
+                src = ModelFile(opts[section])
+                for name in src.sections:
+                    if name == section or name.startswith(section + "."):
+                        sections[name] = src[name]
+                for name in ("colors", "grid"):
+                    if name in src:
+                        sections[name] = src[name]
+            elif section == "init":
+                sections[section] = np.array(load_init_prob_file(opts[section]))
+            elif section == "tm":
+                sections.update(transition_sections(load_tm_file(opts[section])))
+            else:
+                sections[section] = np.array(load_matrix(opts[section]))
+
+        if "sparse" in opts and "tm" in sections:
+            tm = SparseTransitions.from_matrix(sections.pop("tm"))
+            sections.update(transition_sections(tm))
+
+        write_model(args[1], sections)
+
+    elif args[0] == "unpack":
+        model = ModelFile(args[1])
+        os.makedirs(args[2], exist_ok=True)
+        if "init" in model:
+            dump_text(os.path.join(args[2], "init_prob.dat"), model.init_probs(),
+                      "%g")
+        if model.has_sparse_transitions() and "dense" not in opts:
+            dump_sparse_text(os.path.join(args[2], "tm.dat"), model.transitions())
+        elif "tm" in model or model.has_sparse_transitions():
+            dump_text(os.path.join(args[2], "tm.dat"), model.dense_transitions())
+        if "em" in model:
+            dump_text(os.path.join(args[2], "em.dat"), model.emissions())
+
+    else:
+        model = ModelFile(args[1])
+        model.verify()
+        for name, (dtype, shape, offset, nbytes, _) in model.sections.items():
+            print("%-16s %-4s %-14s offset: %10d, bytes: %10d" %
+                  (name, dtype, str(shape), offset, nbytes))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# End-to-end pipeline: training, decoding and comparison in one process.
+#
+# `make compare` runs gen_emit_matrix.py, gen_trans_matrix.py, hmm_viterbi_test.py
+# and compare_result.py one after the other, and every step parses the text file
+# written by the previous one (em.dat, tm.dat, predicted.dat). Here the ColorGrid,
+# the trained matrices and the decoded trace stay in memory from one stage to the
+# next:
+#
+#   grid     load the ColorGrid
+#   train    count the training log in one pass (see hmm_train.py) and compute the
+#            probabilities
+#   model    the matrices, rounded like in the text files (TrainGrid.transitions(),
+#            TrainEmitGrid.emissions()), so the paths are the same as with the files
+#   decode   decode the test log with ViterbiAlgorithm
+#   compare  compare the trace with the test log (see compare_result.py)
+#
+# The comparison is printed like compare_result.py, and the time of every stage on
+# stderr. The intermediate files are only written when asked for (--tm, --em,
+# --predicted), with the same content as the Makefile's. Modules are imported by the
+# stage that needs them.
+#
+# Usage:
+#   python3 hmm_pipeline.py <grid.dat> <train.dat> <init_file> <test.dat>
+#       [--engine=python|numpy|sparse] [--tm=<tm.dat>] [--em=<em.dat>] [--sparse]
+#       [--predicted=<predicted.dat>] [--stats] [--instrument=<file.jsonl>]
+#
+# --sparse writes tm.dat in the sparse form of TrainGrid.dump_prob_sparse().
+
+import sys
+from instrument import Instrumentation, JsonLinesSink
+
+
+def load_grid(filename):
+    from color_grid import ColorGrid
+
+    grid = ColorGrid()
+    grid.init_from_file(filename)
+    return grid
+
+
+def write_text(filename, dump, *args):
+    """
+    Write what dump(*args) prints to filename.
+    """
+    from contextlib import redirect_stdout
+
+    with open(filename, 'w') as f, redirect_stdout(f):
+        dump(*args)
+
+
+def trace_values(trace, obs, num_cols):
+    """
+    The (x, y, color) rows of the lines dump_trace() prints, see
+    compare_result.read_values().
+    """
+    import numpy as np
+
+    trace = np.asarray(trace, dtype=np.int64)
+    return np.stack((trace % num_cols + 1, trace // num_cols + 1,
+                     np.asarray(obs, dtype=np.int64)), axis=1)
+
+
+def run(grid_file, train_file, init_file, test_file, engine="sparse", tm_file=None,
+        em_file=None, sparse=False, predicted_file=None, stats=False, inst=None):
+    """
+    Run all the stages, as phases of the Instrumentation inst.
+    """
+    with inst.phase("grid"):
+        grid = load_grid(grid_file)
+        num_states = grid.num_elements + 1
+
+    with inst.phase("train"):
+        from hmm_train import train
+        traingrid, emitgrid = train(grid, [train_file])
+
+    with inst.phase("model"):
+        from hmm_viterbi_test import load_init_prob_file, load_model_section
+        init_prob = load_model_section(init_file, "init", load_init_prob_file)
+        tm = traingrid.transitions()
+        em = emitgrid.emissions()
+        if engine == "python":
+            tm = tm.todense()
+
+    if tm_file or em_file:
+        with inst.phase("write model"):
+            if tm_file:
+                write_text(tm_file, traingrid.dump_prob_sparse if sparse
+                           else traingrid.dump_prob_full)
+            if em_file:
+                write_text(em_file, emitgrid.dump_emit_prob, False)
+
+    with inst.phase("decode"):
+        from hmm_viterbi import ViterbiAlgorithm
+        from observations import load_observations, symbol_list
+        obs = load_observations(test_file, cache=False)
+        seq = symbol_list(obs) if engine == "python" else obs
+
+        va = ViterbiAlgorithm(num_states, init_prob, tm, em, seq, engine)
+        va.predict()
+        trace = va.backtrace(len(seq) - 1) if len(seq) else []
+
+    if predicted_file:
+        with inst.phase("write trace"):
+            from hmm_viterbi_test import dump_trace
+            write_text(predicted_file, dump_trace, trace, seq, grid.num_cols)
+
+    with inst.phase("compare"):
+        import numpy as np
+        from compare_result import Evaluation, read_values, report
+        truth = list(read_values(test_file))
+        truth = np.concatenate(truth) if truth else np.empty((0, 3), dtype=np.int64)
+
+        ev = Evaluation(predicted_file or "predicted")
+        ev.add(truth, trace_values(trace, obs, grid.num_cols))
+        ev.lines = ev.compared
+        report(len(truth), ev, stats)
+
+
+if __name__ == '__main__':
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 4:
+        print("Usage:", sys.argv[0], "<grid.dat> <train.dat> <init_file> <test.dat>",
+              "[--engine=python|numpy|sparse] [--tm=<tm.dat>] [--em=<em.dat>]",
+              "[--sparse] [--predicted=<predicted.dat>] [--stats]",
+              "[--instrument=<file.jsonl>]")
+        sys.exit(1)
+
+    sink = JsonLinesSink(opts['instrument']) if opts.get('instrument') else None
+    inst = Instrumentation("hmm_pipeline", sink)
+    with inst.phase("total"):
+        run(args[0], args[1], args[2], args[3], opts.get('engine', 'sparse'),
+            opts.get('tm'), opts.get('em'), 'sparse' in opts, opts.get('predicted'),
+            'stats' in opts, inst)
+
+    for name, p in inst.finish()["phases"].items():
+        print("%-12s %8.3f s" % (name, p["seconds"]), file=sys.stderr)
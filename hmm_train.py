@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#
+# Single-pass training of the transition and emission matrices.
+#
+# gen_trans_matrix.py and gen_emit_matrix.py each read the whole training file into
+# a list of (cell, color) rows, and count the rows with dict increments. Here the
+# file is read once, in chunks of about CHUNK_BYTES, and each chunk is parsed in bulk
+# into integer arrays of cells and colors, which are counted with np.bincount. Only
+# the counts are kept, so the memory used does not depend on the length of the file.
+#
+# The counts are then handed to TrainGrid and TrainEmitGrid, which compute the
+# probabilities the same way as the two scripts, so the output is the same. The
+# grid is loaded as an ArrayColorGrid (see array_grid.py), which is much faster and
+# smaller than a ColorGrid for large maps.
+#
+# The counts can be saved to a small file (--counts), and new training logs added to
+# them later: only the new logs are read, and the result is the same as training
+# from scratch on all the logs, one after the other. When several training files are
+# given, they are also counted as one log, in the given order.
+#
+# With --workers, the training files are cut into shards (about SHARDS_PER_WORKER
+# per worker, at line boundaries) that a pool of processes counts in parallel. The
+# counts of consecutive shards are merged by adding them, plus the move from the
+# last cell of one shard to the first cell of the next, so the result is the same
+# as a serial run.
+#
+# Usage:
+#   python3 hmm_train.py <grid.dat> <train.dat> [<train.dat> ...]
+#                        [--counts=<counts.npz>] [--tm=<tm.dat>] [--em=<em.dat>]
+#                        [--workers=N] [--sparse]
+#
+# --sparse writes the transition matrix in the sparse form of
+# TrainGrid.dump_prob_sparse().
+
+import os
+import sys
+from contextlib import redirect_stdout
+from multiprocessing import Pool
+import numpy as np
+from array_grid import ArrayColorGrid
+from color_grid import COLORS
+from gen_emit_matrix import TrainEmitGrid
+from gen_trans_matrix import MOVES, TrainGrid
+from observations import parse_values, read_chunks
+
+CHUNK_BYTES = 1 << 24
+SHARDS_PER_WORKER = 4
+
+
+def parse_rows(data, num_cols):
+    """
+    Parse the lines "x:y color" in data (bytes) into an array of cell ids and an
+    array of color indexes (in COLORS order), see observations.parse_values().
+    """
+    values = parse_values(data)
+    cells = (values[:, 1] - 1) * num_cols + (values[:, 0] - 1)
+    return cells, values[:, 2]
+
+
+def read_rows(filename, num_cols, chunk_bytes=CHUNK_BYTES, start=0, end=None):
+    """
+    Generate (cells, colors) arrays for consecutive chunks of a training file, see
+    observations.read_chunks().
+    """
+    for data in read_chunks(filename, chunk_bytes, start, end):
+        yield parse_rows(data, num_cols)
+
+
+def shard_ranges(filenames, num_shards):
+    """
+    Cut the files into about num_shards (filename, start, end) byte ranges of about
+    the same size, in order.
+    """
+    sizes = [os.path.getsize(filename) for filename in filenames]
+    shard_bytes = max(1, -(-sum(sizes) // num_shards))
+
+    shards = []
+    for filename, size in zip(filenames, sizes):
+        for start in range(0, size, shard_bytes):
+            shards.append((filename, start, min(start + shard_bytes, size)))
+
+    return shards
+
+
+def move_codes(move_from, move_to, num_cols):
+    """
+    The index in MOVES of every move, checked in the same order as
+    TrainGrid.calc_trans().
+    """
+    diff = move_to - move_from
+    codes = np.select([diff == 0, diff == -1, diff == num_cols, diff == 1,
+                       diff == -num_cols], range(0, len(MOVES)), -1)
+
+    bad = np.flatnonzero(codes < 0)
+    if len(bad) > 0:
+        raise Exception("invalid move from cell %d to cell %d" %
+                        (move_from[bad[0]], move_to[bad[0]]))
+
+    return codes
+
+
+class TrainCounts:
+    """
+    The counts of a training log that the probabilities are computed from:
+
+    * trans[i][m]: number of moves of kind MOVES[m] out of cell i;
+    * emit[i][c]: number of times color COLORS[c] was observed in cell i;
+    * first_cell, last_cell: the first and last cell of the log (-1 if empty), so
+      that more rows can be added to it.
+    """
+
+    def __init__(self, num_cells, num_cols):
+        self.num_cells = num_cells
+        self.num_cols = num_cols
+        self.trans = np.zeros((num_cells, len(MOVES)), dtype=np.int64)
+        self.emit = np.zeros((num_cells, len(COLORS)), dtype=np.int64)
+        self.first_cell = -1
+        self.last_cell = -1
+
+    def add(self, cells, colors):
+        """
+        Count the next rows of the log, given as arrays of cells and colors.
+        """
+        if len(cells) == 0:
+            return
+
+        bad = np.flatnonzero((cells < 0) | (cells >= self.num_cells))
+        if len(bad) > 0:
+            raise Exception("cell %d is out of the grid" % cells[bad[0]])
+
+        self.emit += np.bincount(cells * len(COLORS) + colors,
+                                 minlength=self.emit.size).reshape(self.emit.shape)
+
+        if self.last_cell >= 0:
+            path = np.concatenate(([self.last_cell], cells))
+        else:
+            path = cells
+            self.first_cell = int(cells[0])
+
+        codes = move_codes(path[:-1], path[1:], self.num_cols)
+        self.trans += np.bincount(path[:-1] * len(MOVES) + codes,
+                                  minlength=self.trans.size).reshape(self.trans.shape)
+        self.last_cell = int(cells[-1])
+
+    def add_file(self, filename, chunk_bytes=CHUNK_BYTES, start=0, end=None):
+        for cells, colors in read_rows(filename, self.num_cols, chunk_bytes, start,
+                                       end):
+            self.add(cells, colors)
+
+    def merge(self, other):
+        """
+        Add the counts of a log that follows this one.
+        """
+        if (self.num_cells, self.num_cols) != (other.num_cells, other.num_cols):
+            raise Exception("cannot merge counts of different grids")
+        if other.first_cell < 0:
+            return
+
+        self.trans += other.trans
+        self.emit += other.emit
+
+        if self.last_cell >= 0:
+            code = move_codes(np.array([self.last_cell]),
+                              np.array([other.first_cell]), self.num_cols)[0]
+            self.trans[self.last_cell][code] += 1
+        else:
+            self.first_cell = other.first_cell
+
+        self.last_cell = other.last_cell
+
+    def save(self, filename):
+        """
+        Save the counts to filename (numpy .npz format). The file is replaced only
+        once it is completely written.
+        """
+        tmp = filename + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, trans=self.trans, emit=self.emit,
+                     ends=np.array([self.first_cell, self.last_cell]),
+                     shape=np.array([self.num_cells, self.num_cols]))
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            num_cells, num_cols = [int(x) for x in f["shape"]]
+            counts = cls(num_cells, num_cols)
+            counts.trans[...] = f["trans"]
+            counts.emit[...] = f["emit"]
+            counts.first_cell, counts.last_cell = [int(x) for x in f["ends"]]
+
+        return counts
+
+    def check_grid(self, grid):
+        if (self.num_cells, self.num_cols) != (grid.num_elements, grid.num_cols):
+            raise Exception("counts of a %d cells, %d columns grid do not match the "
+                            "grid (%d cells, %d columns)" %
+                            (self.num_cells, self.num_cols, grid.num_elements,
+                             grid.num_cols))
+
+    def train(self, grid):
+        """
+        The TrainGrid and TrainEmitGrid with the probabilities of these counts. This
+        only depends on the size of the grid, not on the number of rows counted.
+        """
+        self.check_grid(grid)
+
+        traingrid = TrainGrid(grid)
+        traingrid.set_trans_counts(self.trans)
+        traingrid.calc_prob()
+
+        emitgrid = TrainEmitGrid(grid)
+        emitgrid.set_emit_counts(self.emit)
+        emitgrid.calc_emit_prob()
+
+        return traingrid, emitgrid
+
+
+def train(grid, trainfiles, counts=None):
+    """
+    Train both matrices from one pass over the training files, which are counted as
+    one log, on top of the TrainCounts `counts` if given. Returns the TrainGrid and
+    the TrainEmitGrid, ready for dump_prob_full() and dump_emit_prob().
+    """
+    if counts is None:
+        counts = TrainCounts(grid.num_elements, grid.num_cols)
+    counts.check_grid(grid)
+
+    for trainfile in trainfiles:
+        counts.add_file(trainfile)
+
+    return counts.train(grid)
+
+
+def count_shard(task):
+    """
+    Count one shard. Runs in a worker process.
+    """
+    num_cells, num_cols, filename, start, end = task
+    counts = TrainCounts(num_cells, num_cols)
+    counts.add_file(filename, start=start, end=end)
+    return counts
+
+
+def train_parallel(grid, trainfiles, counts=None, workers=None):
+    """
+    Same as train(), but the training files are counted in shards by a pool of
+    `workers` processes.
+    """
+    if counts is None:
+        counts = TrainCounts(grid.num_elements, grid.num_cols)
+    counts.check_grid(grid)
+
+    workers = workers or os.cpu_count() or 1
+    with Pool(workers) as pool:
+        shards = shard_ranges(trainfiles, workers * SHARDS_PER_WORKER)
+        tasks = [(counts.num_cells, counts.num_cols) + shard for shard in shards]
+        for shard_counts in pool.imap(count_shard, tasks):
+            counts.merge(shard_counts)
+
+    return counts.train(grid)
+
+
+if __name__ == '__main__':
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 2 or not (opts.get('tm') or opts.get('em') or opts.get('counts')):
+        print("Usage:", sys.argv[0], "<grid.dat> <train.dat> [<train.dat> ...]",
+              "[--counts=<counts.npz>] [--tm=<tm.dat>] [--em=<em.dat>]",
+              "[--workers=N] [--sparse]")
+        sys.exit(1)
+
+    grid = ArrayColorGrid()
+    grid.init_from_file(args[0])
+
+    if opts.get('counts') and os.path.exists(opts['counts']):
+        counts = TrainCounts.load(opts['counts'])
+    else:
+        counts = TrainCounts(grid.num_elements, grid.num_cols)
+
+    if 'workers' in opts:
+        workers = int(opts['workers']) if opts['workers'] else None
+        traingrid, emitgrid = train_parallel(grid, args[1:], counts, workers)
+    else:
+        traingrid, emitgrid = train(grid, args[1:], counts)
+    if opts.get('counts'):
+        counts.save(opts['counts'])
+
+    if opts.get('tm'):
+        with open(opts['tm'], 'w') as f, redirect_stdout(f):
+            if 'sparse' in opts:
+                traingrid.dump_prob_sparse()
+            else:
+                traingrid.dump_prob_full()
+    if opts.get('em'):
+        with open(opts['em'], 'w') as f, redirect_stdout(f):
+            emitgrid.dump_emit_prob(False)
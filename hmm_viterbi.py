@@ -16,9 +16,26 @@
 #    transition probability from state N to state N is 0.
 # 3) The emission probabiliy for state N is always 0, which means the ending state
 #    never emits anything.
+#
+# Besides the reference implementation in pure Python ("python" engine), a vectorized
+# engine ("numpy" engine, see hmm_viterbi_np.py) can be selected. It returns the same
+# paths, but reports delta as log probabilities, which do not underflow on long
+# sequences. The "sparse" engine is the same, but only visits the non-zero transitions
+# (see sparse_transitions.py), which on a grid is O(N) per step instead of O(N^2).
+#
+# For long sequences, the vectorized engines can limit the memory they use: "compact"
+# keeps the backpointers but only the last delta row, and "checkpoint" keeps about
+# sqrt(len(seq)) delta rows and recomputes the backpointers in backtrace().
+#
+# With a beam width and/or a log probability threshold, the vectorized engines only
+# keep the most likely states of every step (see hmm_viterbi_beam.py); the path may
+# then differ from the exact one. kbest(k) returns the k most likely state sequences
+# instead of only the best one.
 
 import sys
 from color_grid import ob2id
+from instrument import optional_phase, timed
+from model_cache import model_tables
 
 
 class ViterbiAlgorithm:
@@ -28,18 +45,49 @@ class ViterbiAlgorithm:
 
     * args:
       n: number of states
-     tm: transition matrix
+     tm: transition matrix, or a SparseTransitions object for the "sparse" engine
      em: emission matrix
     seq: sequence of observations
+ engine: "python" (default), "numpy" or "sparse"
+ memory: "full" (default), "compact" or "checkpoint"; the latter two need a vectorized
+         engine
+instrument: an instrument.Instrumentation to record phases and counters, or None
+   beam: keep only this many states after every step (approximate), or None
+threshold: drop the states whose log probability is more than this below the best
+         state of the step (approximate), or None
     """
 
-    def __init__(self, n, init_probs, tm, em, seq):
+    ENGINES = ("python", "numpy", "sparse")
+    MEMORY_MODES = ("full", "compact", "checkpoint")
+
+    def __init__(self, n, init_probs, tm, em, seq, engine="python", memory="full",
+                 instrument=None, beam=None, threshold=None):
+        if engine not in self.ENGINES:
+            raise Exception("unknown engine %s" % engine)
+        if memory not in self.MEMORY_MODES:
+            raise Exception("unknown memory mode %s" % memory)
+        if engine == "python" and memory != "full":
+            raise Exception("memory mode %s needs a vectorized engine" % memory)
+        if beam is not None or threshold is not None:
+            if engine == "python":
+                raise Exception("beam pruning needs a vectorized engine")
+            if memory != "full":
+                raise Exception("memory mode %s cannot be used with beam pruning" %
+                                memory)
+
         self.num_states = n
         self.tm = tm
         self.em = em
         self.seq = seq
+        self.engine = engine
+        self.memory = memory
         self.delta = [init_probs]
         self.prevs = None
+        self.checkpoints = None
+        self.instrument = instrument
+        self.beam = beam
+        self.threshold = threshold
+        self.pruned = None
 
     def dump_delta(self):
         for i in range(0, len(self.delta)):
@@ -62,23 +110,31 @@ class ViterbiAlgorithm:
     def get_tx_prob(self, i, j):
         return self.tm[i][j]
 
+    @timed("predict")
     def predict(self):
+        if self.engine != "python":
+            return self.predict_numpy()
+
         self.prevs = []
         seq = self.seq
+        with optional_phase(self.instrument, "model"):
+            em_cols, tm_cols = model_tables(self.num_states, self.tm, self.em,
+                                            "python")
 
         for k in range(0, len(seq)):
-            ob = seq[k]
+            em_col = em_cols[ob2id(seq[k])]
+            src = [d * e for d, e in zip(self.delta[k], em_col)]
 
             ds, ps = [], []
-            for id2 in range(0, self.num_states):
-                m, prev = 0, 0
-                for id1 in range(0, self.num_states):
-                    em_prob = self.get_em_prob(id1, ob)
-                    tx_prob = self.get_tx_prob(id1, id2)
-                    val = self.delta[k][id1] * em_prob * tx_prob
-
-                    if val > m:
-                        m, prev = val, id1
+            for tm_col in tm_cols:
+                # val = delta[k][id1] * em[id1][ob] * tm[id1][id2], for all id1; the
+                # first (lowest) id1 with the largest non-zero val wins
+                vals = [v * t for v, t in zip(src, tm_col)]
+                m = max(vals)
+                if m > 0:
+                    prev = vals.index(m)
+                else:
+                    m, prev = 0, 0
 
                 ps.append(prev)
                 ds.append(m)
@@ -89,18 +145,135 @@ class ViterbiAlgorithm:
             # delta[k+1]
             self.delta.append(ds)
 
+        if self.instrument is not None:
+            self.count_states(self.num_states * self.num_states)
+
+    def predict_numpy(self):
+        """
+        Vectorized version of predict(). Afterwards, self.delta holds log
+        probabilities and self.prevs is a 2-D array, both with the same layout as the
+        lists built by predict(). In the "compact" and "checkpoint" memory modes,
+        self.delta only holds the last row, and in the "checkpoint" mode there are no
+        self.prevs.
+        """
+        from hmm_viterbi_np import CheckpointedViterbi, encode_observations, viterbi
+
+        if self.beam is not None or self.threshold is not None:
+            return self.predict_pruned()
+
+        with optional_phase(self.instrument, "model"):
+            trans = model_tables(self.num_states, self.tm, self.em, self.engine)
+            obs = encode_observations(self.seq)
+
+        if self.memory == "checkpoint":
+            self.checkpoints = CheckpointedViterbi(self.delta[0], trans, self.em, obs)
+            self.delta = self.checkpoints.delta[None]
+        else:
+            self.delta, self.prevs = viterbi(self.delta[0], trans, self.em, obs,
+                                             self.memory == "full")
+
+        if self.instrument is not None:
+            if hasattr(trans, 'pred_idx'):
+                # sparse: the predecessors of every state, and the ending state
+                self.count_states(trans.pred_idx.size + trans.num_states)
+            else:
+                self.count_states(trans.num_states * trans.num_states)
+
+    def predict_pruned(self):
+        """
+        Beam-pruned version of predict_numpy(), see hmm_viterbi_beam.py. Afterwards,
+        self.delta only holds the last row (-inf for the pruned states), and
+        self.pruned is the BeamViterbi that backtrace() uses.
+        """
+        from hmm_viterbi_beam import BeamViterbi
+        from hmm_viterbi_np import encode_observations
+
+        with optional_phase(self.instrument, "model"):
+            # the surviving states are expanded through their non-zero transitions
+            trans = model_tables(self.num_states, self.tm, self.em, "sparse")
+            obs = encode_observations(self.seq)
+
+        self.pruned = BeamViterbi(self.delta[0], trans, self.em, obs, self.beam,
+                                  self.threshold)
+        self.delta = self.pruned.delta()[None]
+
+        if self.instrument is not None:
+            steps = len(self.seq)
+            self.instrument.count("steps", steps)
+            self.instrument.count("transitions", self.pruned.expanded)
+            self.instrument.count("live_states", self.pruned.live)
+            self.instrument.count("pruned_states",
+                                  steps * self.num_states - self.pruned.live)
+
+    def count_states(self, transitions_per_step):
+        """
+        Add the counters of the last predict() to the instrumentation: steps,
+        candidate transitions evaluated, and (with all delta rows kept) the states
+        with a non-zero (live) or zero (pruned) probability over all steps.
+        """
+        steps = len(self.seq)
+        self.instrument.count("steps", steps)
+        self.instrument.count("transitions", steps * transitions_per_step)
+        if self.memory != "full":
+            return
+
+        if self.engine == "python":
+            live = sum([len(row) - row.count(0) for row in self.delta[1:]])
+        else:
+            import numpy as np
+            live = int(np.isfinite(self.delta[1:]).sum())
+
+        self.instrument.count("live_states", live)
+        self.instrument.count("pruned_states", steps * self.num_states - live)
+
+    @timed("kbest")
+    def kbest(self, k):
+        """
+        The k most likely state sequences (list Viterbi), as (log probability, trace)
+        pairs, best first. The first trace is the one of backtrace(len(seq) - 1). Runs
+        its own recursion, with the "numpy" tables for the "python" engine, so
+        predict() is not needed.
+        """
+        from hmm_viterbi_np import encode_observations, kbest_viterbi
+
+        engine = "numpy" if self.engine == "python" else self.engine
+        with optional_phase(self.instrument, "model"):
+            trans = model_tables(self.num_states, self.tm, self.em, engine)
+
+        return kbest_viterbi(self.delta[0], trans, self.em,
+                             encode_observations(self.seq), k)
+
+    @staticmethod
+    def decode_batch(n, init_probs, tm, em, seqs, engine="numpy"):
+        """
+        Decode many observation sequences in one vectorized pass, instead of creating a
+        ViterbiAlgorithm per sequence. Returns one trace per sequence, the same as
+        backtrace(len(seq) - 1) would give. The engine is "numpy" or "sparse".
+        """
+        from hmm_viterbi_np import encode_observations, viterbi_batch
+
+        trans = model_tables(n, tm, em, engine)
+        obs_list = [encode_observations(seq) for seq in seqs]
+        return viterbi_batch(init_probs, trans, em, obs_list)
+
+    @timed("backtrace")
     def backtrace(self, k):
         """
         The backtracing starts from delta(k, N+1), where 0 <= k < len(seq), and state "N+1"
         is the ending state.
         """
+        if self.checkpoints is not None:
+            return self.checkpoints.backtrace(k)
+        if self.pruned is not None:
+            return self.pruned.backtrace(k)
+
         trace = []
 
-        prev_state = self.prevs[k][-1]
+        prev_state = int(self.prevs[k][-1])
         trace.append(prev_state)
 
         for i in range(k - 1, -1, -1):
-            prev_state = self.prevs[i][prev_state]
+            prev_state = int(self.prevs[i][prev_state])
             trace.append(prev_state)
 
         trace.reverse()
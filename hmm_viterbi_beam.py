@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+#
+# Beam-pruned (approximate) Viterbi decoding.
+#
+# On a large grid, the robot can only be near the cells whose colors it has seen, so
+# after a few steps almost all of delta is negligible, but the exact engines still
+# carry every state forward. BeamViterbi keeps only the states that survive pruning,
+# and expands them through their non-zero transitions (stay and the grid neighbors,
+# see sparse_transitions.py). A state survives if
+#
+# 1) it is one of the `beam` most likely states of the step, and/or
+# 2) its log probability is at most `threshold` below the best state of the step.
+#
+# Every step costs a few numpy calls on arrays of the size of the beam, against one
+# pass over all the states for the exact engines, so pruning pays off from a few
+# hundred states on (see the "beam" and "threshold" paths of hmm_benchmark.py). A
+# fixed beam width loses the best path when more states than the width are about as
+# likely, e.g. in the first steps with uniform initial probabilities; a threshold
+# keeps them all.
+#
+# The surviving states are kept in the same order and with the same products and tie
+# breaks as in the exact engines, so without pruning (or when the best path never
+# leaves the beam) the path is the same as backtrace(). If all survivors turn out to be
+# impossible (e.g. they cannot emit the next color), the path is lost and, like for an
+# impossible sequence in the exact engines, backtrace() returns state 0.
+#
+# Run as a script, it decodes observation files with the exact "sparse" engine and
+# with every beam setting, and reports how often the pruned path differs from the
+# exact one, how much less likely it is, and the time used. With --window=L the files
+# are cut into sequences of L observations, for more samples from one file.
+#
+# Usage:
+#   python3 hmm_viterbi_beam.py <num_states> <init_file> <tm_file> <em_file>
+#       <observation_file> [<observation_file> ...] [--beams=10,50,100]
+#       [--thresholds=5,10,20] [--window=L]
+
+import math
+import sys
+import time
+import numpy as np
+from hmm_viterbi_np import LN2, emission_table, rescale
+
+
+class BeamViterbi:
+    """
+    * args:
+     init_probs: initial probabilities
+          trans: SparseTransitions (see hmm_viterbi_np.make_transitions)
+             em: emission matrix
+            obs: observation symbol ids
+           beam: maximum number of states kept after every step, or None
+      threshold: maximum log probability below the best state, or None
+    """
+
+    def __init__(self, init_probs, trans, em, obs, beam=None, threshold=None):
+        if beam is not None and beam < 1:
+            raise Exception("beam width %d must be at least 1" % beam)
+
+        self.num_states = trans.num_states
+        self.beam = beam
+        self.threshold = threshold
+        end = trans.num_states - 1
+        em_t = emission_table(em, trans.num_states)
+        _, end_probs = trans.column(end)
+        succ_idx = trans.successors()
+        pred_idx, pred_probs = trans.pred_idx, trans.pred_probs
+
+        # steps[t] = (states at time t + 1 in increasing order, their predecessors)
+        self.steps = []
+        self.end_prevs = np.zeros(len(obs), dtype=np.int64)
+        self.expanded = 0
+        self.live = 0
+
+        vals = np.asarray(init_probs, dtype=np.float64)[:end]
+        states = np.flatnonzero(vals)
+        states, vals = self.prune(states, vals[states])
+        vals, scale = rescale(vals) if len(vals) else (vals, 0.0)
+        # log probability of the path of backtrace(len(obs) - 1)
+        self.score = -np.inf
+        # scratch rows of the surviving states and of the states they reach, all 0
+        # between the steps
+        src_row = np.zeros(trans.num_states)
+        reached = np.zeros(trans.num_states, dtype=bool)
+
+        for t in range(0, len(obs)):
+            src = vals * em_t[obs[t]][states]
+            self.live += len(states)
+
+            # the move to the ending state
+            if len(src):
+                e = src * end_probs[states]
+                i = int(np.argmax(e))
+                if e[i] > 0:
+                    self.end_prevs[t] = states[i]
+                    if t == len(obs) - 1:
+                        self.score = float(np.log(e[i]) + scale)
+
+            # the states reachable from the survivors, maximized over their
+            # predecessors like SparseTransitions.step(); the pruned predecessors
+            # are 0 in src_row
+            src_row[states] = src
+            reached[succ_idx[states]] = True
+            reached[end] = False
+            targets = np.flatnonzero(reached)
+            reached[targets] = False
+            cand = src_row[pred_idx[targets]] * pred_probs[targets]
+            src_row[states] = 0
+            self.expanded += cand.size
+
+            slot = np.argmax(cand, axis=-1)
+            best = cand[np.arange(len(targets)), slot]
+            keep = best > 0
+            states, vals = self.prune(targets[keep], best[keep],
+                                      pred_idx[targets, slot][keep])
+            if len(vals):
+                # same as rescale(), without the batch handling
+                e = math.frexp(vals.max())[1]
+                vals = np.ldexp(vals, -e)
+                scale = scale + e * LN2
+
+        self.last_states = states
+        self.last_vals = vals
+        self.scale = scale
+
+    def prune(self, states, vals, prevs=None):
+        """
+        The states that survive, in increasing order, and their probabilities. The
+        predecessors of the survivors are stored as a step.
+        """
+        if self.threshold is not None and len(vals):
+            keep = vals >= vals.max() * np.exp(-self.threshold)
+            states, vals = states[keep], vals[keep]
+            if prevs is not None:
+                prevs = prevs[keep]
+
+        if self.beam is not None and len(vals) > self.beam:
+            top = np.sort(np.argpartition(-vals, self.beam - 1)[:self.beam])
+            states, vals = states[top], vals[top]
+            if prevs is not None:
+                prevs = prevs[top]
+
+        if prevs is not None:
+            self.steps.append((states, prevs))
+
+        return states, vals
+
+    def delta(self):
+        """
+        Log probabilities of all states after the last step; -inf for pruned states.
+        """
+        delta = np.full(self.num_states, -np.inf)
+        with np.errstate(divide='ignore'):
+            delta[self.last_states] = np.log(self.last_vals) + self.scale
+
+        return delta
+
+    def backtrace(self, k):
+        """
+        Same as ViterbiAlgorithm.backtrace(k), over the surviving states. A state
+        that was pruned has predecessor 0.
+        """
+        state = int(self.end_prevs[k])
+        trace = [state]
+
+        for i in range(k - 1, -1, -1):
+            states, prevs = self.steps[i]
+            pos = np.searchsorted(states, state)
+            if pos < len(states) and states[pos] == state:
+                state = int(prevs[pos])
+            else:
+                state = 0
+            trace.append(state)
+
+        trace.reverse()
+        return trace
+
+
+def split_windows(seq, window):
+    if not window:
+        return [seq]
+
+    return [seq[i:i + window] for i in range(0, len(seq), window)]
+
+
+def decode(num_states, init_prob, tm, em, seq, beam=None, threshold=None):
+    """
+    Decode seq with the "sparse" engine, pruned if beam or threshold is given.
+    Returns (trace, log probability of the trace, seconds).
+    """
+    from hmm_viterbi import ViterbiAlgorithm
+
+    start = time.perf_counter()
+    va = ViterbiAlgorithm(num_states, init_prob, tm, em, seq, "sparse", beam=beam,
+                          threshold=threshold)
+    va.predict()
+    trace = va.backtrace(len(seq) - 1)
+    seconds = time.perf_counter() - start
+
+    score = va.pruned.score if va.pruned is not None else float(va.delta[-1][-1])
+    return trace, score, seconds
+
+
+def report(num_states, init_prob, tm, em, seqs, settings):
+    """
+    Print, for every (beam, threshold) setting, how often its paths differ from the
+    exact ones.
+    """
+    exact = [decode(num_states, init_prob, tm, em, seq) for seq in seqs]
+    exact_seconds = sum([r[2] for r in exact])
+    num_obs = sum([len(seq) for seq in seqs])
+    print("exact: %d sequences, %d observations, %.3f s" %
+          (len(seqs), num_obs, exact_seconds))
+
+    for beam, threshold in settings:
+        results = [decode(num_states, init_prob, tm, em, seq, beam, threshold)
+                   for seq in seqs]
+        differ = sum([r[0] != e[0] for r, e in zip(results, exact)])
+        states = sum([np.count_nonzero(np.array(r[0]) != np.array(e[0]))
+                      for r, e in zip(results, exact)])
+        # pruned paths that were lost have no finite log probability
+        gap = [e[1] - r[1] for r, e in zip(results, exact) if np.isfinite(r[1])]
+        lost = len(seqs) - len(gap)
+        seconds = sum([r[2] for r in results])
+        print("beam %6s threshold %6s: %5.1f%% of paths differ (%d lost), "
+              "%6.2f%% of states, log P gap mean %.4f max %.4f, %.3f s (%.2fx)" %
+              (beam or '-', threshold or '-', 100.0 * differ / len(seqs), lost,
+               100.0 * states / max(num_obs, 1), np.mean(gap) if gap else 0,
+               np.max(gap) if gap else 0, seconds,
+               exact_seconds / max(seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                  load_model_section, load_tm_file)
+    from observations import load_observations
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 5:
+        print("Usage:", sys.argv[0], "<num_states> <init_file> <tm_file> <em_file>",
+              "<observation_file> [<observation_file> ...] [--beams=10,50,100]",
+              "[--thresholds=5,10,20] [--window=L]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    init_prob = load_model_section(args[1], "init", load_init_prob_file)
+    tm = load_model_section(args[2], "tm", load_tm_file)
+    em = load_model_section(args[3], "em", load_matrix)
+
+    window = int(opts['window']) if opts.get('window') else None
+    seqs = []
+    for f in args[4:]:
+        seqs += split_windows(load_observations(f), window)
+    seqs = [seq for seq in seqs if len(seq)]
+
+    beams = [int(x) for x in opts.get('beams', '10,50,100').split(',') if x]
+    thresholds = [float(x) for x in opts.get('thresholds', '5,10,20').split(',') if x]
+    settings = [(b, None) for b in beams] + [(None, t) for t in thresholds]
+    report(num_states, init_prob, tm, em, seqs, settings)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+# Report the peak memory and the time used by ViterbiAlgorithm to decode one
+# observation file, for the Python engine (lists of delta and prevs) and for the
+# memory modes of the vectorized engines.
+#
+# Every mode first decodes the first observation untraced, so that the lazy imports
+# of the engine and the cached model tables (see model_cache.py) are not charged to
+# it: the peak is the memory of the decode itself, above what was allocated before.
+#
+
+import sys
+import time
+import tracemalloc
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                              load_observation_sequence)
+from utils import parse_options
+
+MODES = {
+    "lists": ("python", "full"),
+    "full": ("numpy", "full"),
+    "compact": ("numpy", "compact"),
+    "checkpoint": ("numpy", "checkpoint"),
+}
+
+
+def measure(num_states, init_prob, tm, em, seq, engine, memory):
+    """
+    Decode seq and return (peak memory in bytes, seconds, trace).
+    """
+    def decode(seq):
+        va = ViterbiAlgorithm(num_states, init_prob, tm, em, seq, engine, memory)
+        va.predict()
+        return va.backtrace(len(seq) - 1)
+
+    decode(seq[:1])
+
+    # tracing may already be on (e.g. for an Instrumentation with memory)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+
+    trace = decode(seq)
+
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    if not tracing:
+        tracemalloc.stop()
+    return peak - baseline, seconds, trace
+
+
+if __name__ == '__main__':
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 5:
+        print("Usage:", sys.argv[0],
+              "<num_states> <init_file> <tm_file> <em_file> <observation_file>",
+              "[--modes=lists,full,compact,checkpoint] [--engine=numpy|sparse]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    init_prob = load_init_prob_file(args[1])
+    tm = load_matrix(args[2])
+    em = load_matrix(args[3])
+    seq = load_observation_sequence(args[4])
+    modes = opts.get('modes', ','.join(MODES)).split(',')
+
+    reference = None
+    print("steps: %d, states: %d" % (len(seq), num_states))
+    for mode in modes:
+        engine, memory = MODES[mode]
+        if engine != "python":
+            engine = opts.get('engine', engine)
+
+        peak, seconds, trace = measure(num_states, init_prob, tm, em, seq, engine,
+                                       memory)
+        if reference is None:
+            reference = trace
+
+        print("%-10s peak: %10.3f MB, time: %8.3f s, same path: %s" %
+              (mode, peak / 1e6, seconds, trace == reference))
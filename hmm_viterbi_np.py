@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+#
+# Vectorized engine for the Viterbi Algorithm.
+#
+# The engine follows the same conventions as hmm_viterbi.py (see the comments at the
+# top of that file), but turns each time step into a single array operation instead of
+# a Python loop over all (id1, id2) pairs.
+#
+# Numerical notes:
+# 1) The products are evaluated in the same order as in ViterbiAlgorithm.predict,
+#    i.e. (delta[k][id1] * em[id1][ob]) * tm[id1][id2]. Adding logarithms instead
+#    rounds differently, and on ties that are only one ulp apart (test3.dat has one)
+#    the other predecessor would be picked.
+# 2) To avoid underflow on long sequences, every delta row is rescaled by a power of
+#    two. This is exact in floating point, so the comparisons, and therefore the
+#    paths, are the same as without scaling. The scale factors are accumulated in log
+#    space, so delta can be reported as log probabilities.
+# 3) Ties are broken like in ViterbiAlgorithm.predict: the predecessor with the lowest
+#    state number wins, and a state that cannot be reached at all gets predecessor 0.
+#
+# Backpointers are kept in the smallest unsigned integer type that can hold a state
+# number (see index_dtype()). For very long sequences, CheckpointedViterbi keeps only
+# every sqrt(T)-th delta row and recomputes the backpointers segment by segment during
+# the backtrace.
+
+import math
+import numpy as np
+from color_grid import OB2ID
+from sparse_transitions import SparseTransitions
+
+LN2 = np.log(2.0)
+
+
+def log_array(m):
+    """
+    Convert a matrix (or vector) of probabilities into log space. Zero probabilities
+    become -inf.
+    """
+    with np.errstate(divide='ignore'):
+        return np.log(np.asarray(m, dtype=np.float64))
+
+
+def encode_observations(seq):
+    """
+    Map a sequence of observed symbols (e.g. ['g', 'b', 'r']) to an array of symbol
+    ids, using the same mapping as ob2id(). Sequences that are already integer encoded
+    are returned unchanged.
+    """
+    if isinstance(seq, np.ndarray) and seq.dtype.kind in 'iu':
+        return seq
+
+    return np.array([OB2ID[ob] for ob in seq], dtype=np.uint8)
+
+
+def index_dtype(num_states):
+    """
+    The smallest unsigned integer type that can hold the state numbers 0..num_states-1.
+    """
+    if num_states <= 1 << 8:
+        return np.uint8
+    if num_states <= 1 << 16:
+        return np.uint16
+
+    return np.uint32
+
+
+def emission_table(em, num_states):
+    """
+    The emission matrix transposed (symbol first), so that em_t[ob] is the contiguous
+    column of emission probabilities for symbol ob.
+    """
+    return np.ascontiguousarray(np.asarray(em, dtype=np.float64)[:num_states].T)
+
+
+def rescale_exp(row):
+    """
+    Scale a row (or the rows of a batch) of probabilities by a power of two, so that
+    its maximum lies in [0.5, 1). Returns the scaled row and the exponent of the
+    factor that was divided out. Rows that are all zero are left alone.
+    """
+    m = row.max(axis=-1)
+    _, e = np.frexp(m)
+    e = np.where(m > 0, e, 0)
+    return np.ldexp(row, -e[..., None]), e
+
+
+def rescale(row):
+    """
+    Same as rescale_exp(), but returns the log of the factor.
+    """
+    row, e = rescale_exp(row)
+    return row, e * LN2
+
+
+class DenseTransitions:
+    """
+    Dense transition matrix.
+
+    The matrix is stored transposed (target state first), so that the maximization
+    over the predecessor states runs along the last, contiguous axis.
+    """
+
+    def __init__(self, tm, n=None):
+        tm = np.asarray(tm, dtype=np.float64)
+        if n is not None:
+            tm = tm[:n, :n]
+
+        self.num_states = tm.shape[0]
+        self.tm_t = np.ascontiguousarray(tm.T)
+
+    def arrays(self):
+        """
+        The arrays that make up this object, see from_arrays().
+        """
+        return {"tm_t": self.tm_t}
+
+    def todense(self):
+        return self.tm_t.T.copy()
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild the object from arrays(), without copying them (e.g. from shared or
+        memory-mapped arrays).
+        """
+        trans = cls.__new__(cls)
+        trans.tm_t = arrays["tm_t"]
+        trans.num_states = trans.tm_t.shape[0]
+        return trans
+
+    def column(self, j):
+        """
+        The states that can move to state j, and their transition probabilities.
+        """
+        return np.arange(self.num_states), self.tm_t[j]
+
+    def step(self, src):
+        """
+        One step of the recursion. src[..., id1] is delta[k][id1] * em[id1][ob].
+
+        Returns (delta[k+1], prevs[k]), where the leading axes of src (if any) are
+        treated as a batch.
+        """
+        cand = src[..., None, :] * self.tm_t
+        prev = np.argmax(cand, axis=-1)
+        best = np.take_along_axis(cand, prev[..., None], axis=-1)[..., 0]
+        return best, prev
+
+    def forward(self, src):
+        """
+        Sum-product version of step(), for the forward algorithm: returns the sum over
+        id1 of src[..., id1] * tm[id1][id2], for every id2.
+        """
+        return src @ self.tm_t.T
+
+
+def make_transitions(tm, n=None, sparse=False):
+    """
+    Wrap a transition matrix into a transitions object. Objects that already are
+    transitions (e.g. a SparseTransitions) are returned unchanged.
+    """
+    if isinstance(tm, (DenseTransitions, SparseTransitions)):
+        return tm
+
+    if sparse:
+        return SparseTransitions.from_matrix(tm, n)
+
+    return DenseTransitions(tm, n)
+
+
+def viterbi(init_probs, trans, em, obs, keep_delta=True):
+    """
+    Run the Viterbi recursion over a whole (integer encoded) observation sequence.
+
+    * args:
+      init_probs: initial probabilities, delta[0]
+           trans: transitions object, e.g. DenseTransitions
+              em: emission matrix, one row per state
+             obs: observation symbol ids
+      keep_delta: keep all delta rows, or only the last one
+
+    Returns (delta, prevs) as 2-D arrays, with the same layout as the lists kept by
+    ViterbiAlgorithm: delta has len(obs) + 1 rows of log probabilities (or just the
+    last one) and prevs has len(obs) rows.
+    """
+    num_states = trans.num_states
+    em_t = emission_table(em, num_states)
+
+    rows = len(obs) + 1 if keep_delta else 1
+    delta = np.empty((rows, num_states))
+    scales = np.zeros(rows)
+    prevs = np.empty((len(obs), num_states), dtype=index_dtype(num_states))
+
+    d = np.asarray(init_probs, dtype=np.float64)[:num_states]
+    scale = 0
+    if keep_delta:
+        delta[0] = d
+
+    for k in range(0, len(obs)):
+        ds, prevs[k] = trans.step(d * em_t[obs[k]])
+        d, s = rescale(ds)
+        scale += s
+        if keep_delta:
+            delta[k + 1], scales[k + 1] = d, scale
+
+    if not keep_delta:
+        delta[0], scales[0] = d, scale
+
+    delta = log_array(delta)
+    delta += scales[:, None]
+    return delta, prevs
+
+
+def backtrace(prevs, k, end=-1):
+    """
+    Same as ViterbiAlgorithm.backtrace(k), on an array of backpointers. The trace
+    leads to the ending state, or to the state `end` at time k + 1.
+    """
+    state = int(prevs[k][end])
+    trace = [state]
+
+    for i in range(k - 1, -1, -1):
+        state = int(prevs[i][state])
+        trace.append(state)
+
+    trace.reverse()
+    return trace
+
+
+class CheckpointedViterbi:
+    """
+    Viterbi recursion that keeps only every `interval`-th delta row (by default about
+    sqrt(len(obs)) of them) and no backpointers. backtrace() recomputes the
+    backpointers of one segment at a time, so the memory used is O(sqrt(T) * N)
+    instead of O(T * N), at the cost of running the recursion a second time.
+    """
+
+    def __init__(self, init_probs, trans, em, obs, interval=None):
+        self.trans = trans
+        self.em_t = emission_table(em, trans.num_states)
+        self.obs = obs
+        self.interval = interval or max(1, math.isqrt(max(len(obs) - 1, 0)) + 1)
+        self.checkpoints = []
+
+        d = np.asarray(init_probs, dtype=np.float64)[:trans.num_states]
+        scale = 0
+        for k in range(0, len(obs)):
+            if k % self.interval == 0:
+                self.checkpoints.append(d)
+
+            d, s = rescale(trans.step(d * self.em_t[obs[k]])[0])
+            scale += s
+
+        # last delta row, as log probabilities
+        self.delta = log_array(d) + scale
+
+    def segment_prevs(self, c):
+        """
+        Recompute the backpointers of the steps in segment c.
+        """
+        start = c * self.interval
+        stop = min(start + self.interval, len(self.obs))
+        prevs = np.empty((stop - start, self.trans.num_states),
+                         dtype=index_dtype(self.trans.num_states))
+
+        d = self.checkpoints[c]
+        for k in range(start, stop):
+            ds, prevs[k - start] = self.trans.step(d * self.em_t[self.obs[k]])
+            d, _ = rescale(ds)
+
+        return prevs
+
+    def backtrace(self, k):
+        """
+        Same as ViterbiAlgorithm.backtrace(k).
+        """
+        c = k // self.interval
+        prevs = self.segment_prevs(c)
+        state = int(prevs[k - c * self.interval][-1])
+        trace = [state]
+
+        for i in range(k - 1, -1, -1):
+            if i < c * self.interval:
+                c -= 1
+                prevs = self.segment_prevs(c)
+
+            state = int(prevs[i - c * self.interval][state])
+            trace.append(state)
+
+        trace.reverse()
+        return trace
+
+
+def viterbi_batch(init_probs, trans, em, obs_list):
+    """
+    Decode many (integer encoded) observation sequences of different lengths together.
+
+    The sequences are sorted by length, so that at step k the sequences that are still
+    running form the first rows of the batch, and each step is a single array
+    operation over all of them. The observations, backpointers and traces are only
+    kept for the steps of every sequence, without padding to the longest one.
+
+    Returns one trace per sequence, equal to ViterbiAlgorithm.backtrace(len(seq) - 1).
+    """
+    num_states = trans.num_states
+    em_t = emission_table(em, num_states)
+
+    lengths = np.array([len(obs) for obs in obs_list], dtype=np.int64)
+    order = np.argsort(-lengths, kind='stable')
+    lengths = lengths[order]
+    max_len = int(lengths[0]) if len(lengths) else 0
+
+    # the observations one after the other, in the sorted order
+    starts = np.cumsum(lengths) - lengths
+    flat = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    for row, i in enumerate(order):
+        flat[starts[row]:starts[row] + lengths[row]] = obs_list[i]
+
+    # number of sequences still running at each step
+    running = np.searchsorted(-lengths, -np.arange(0, max_len), side='left')
+
+    delta = np.empty((len(obs_list), num_states))
+    delta[:] = np.asarray(init_probs, dtype=np.float64)[:num_states]
+    # backpointers of the running sequences only, so that a long sequence does not
+    # make the short ones of the batch pay for its length
+    prevs = []
+
+    for k in range(0, max_len):
+        b = running[k]
+        ds, p = trans.step(delta[:b] * em_t[flat[starts[:b] + k]])
+        prevs.append(p.astype(index_dtype(num_states)))
+        delta[:b], _ = rescale(ds)
+
+    # the traces, like the observations
+    traces = np.zeros(int(lengths.sum()), dtype=np.intp)
+    state = np.full(len(obs_list), num_states - 1, dtype=np.intp)
+    for k in range(max_len - 1, -1, -1):
+        b = running[k]
+        state[:b] = prevs[k][np.arange(b), state[:b]]
+        traces[starts[:b] + k] = state[:b]
+
+    result = [None] * len(obs_list)
+    for row, i in enumerate(order):
+        result[i] = traces[starts[row]:starts[row] + lengths[row]].tolist()
+
+    return result
+
+
+def predecessor_table(trans):
+    """
+    (pred_idx, pred_probs) of all states but the ending one, like
+    SparseTransitions.build_predecessors(); for dense transitions every state is a
+    predecessor.
+    """
+    if hasattr(trans, 'pred_idx'):
+        return trans.pred_idx, trans.pred_probs
+
+    end = trans.num_states - 1
+    return (np.broadcast_to(np.arange(trans.num_states), (end, trans.num_states)),
+            trans.tm_t[:end])
+
+
+def top_k(cand, k):
+    """
+    The k largest entries of every row of cand (non-negative), largest first, and
+    their positions. Equal entries are taken from left to right, like np.argmax(), so
+    the first one is the one predict() would pick. Entries of 0 get position 0.
+    """
+    # the k-th largest value of every row; all larger entries, then as many entries
+    # equal to it as needed, leftmost first
+    kth = np.partition(cand, cand.shape[-1] - k, axis=-1)[:, -k:].min(axis=-1)
+    larger = cand > kth[:, None]
+    equal = cand == kth[:, None]
+    need = k - larger.sum(axis=-1, keepdims=True)
+    chosen = larger | (equal & (np.cumsum(equal, axis=-1) <= need))
+
+    arg = np.argsort(~chosen, axis=-1, kind='stable')[:, :k]
+    best = np.take_along_axis(cand, arg, axis=-1)
+    order = np.argsort(-best, axis=-1, kind='stable')
+    best = np.take_along_axis(best, order, axis=-1)
+    arg = np.take_along_axis(arg, order, axis=-1)
+
+    arg[best <= 0] = 0
+    return best, arg
+
+
+def kbest_viterbi(init_probs, trans, em, obs, k):
+    """
+    List Viterbi: the k most likely state sequences of an (integer encoded)
+    observation sequence.
+
+    Instead of the best path into every state, every step keeps the k best ones,
+    together with the (state, rank) of the path they extend. Every step selects from
+    k times as many candidates as viterbi(), in linear time (see top_k()), so the
+    cost is about k times that of one decode. The rows are rescaled like in
+    viterbi(), so the best path is the one of backtrace().
+
+    Returns up to k (log probability, trace) pairs, best first; there are fewer when
+    fewer than k paths have a non-zero probability.
+    """
+    num_states, end = trans.num_states, trans.num_states - 1
+    em_t = emission_table(em, num_states)
+    pred_idx, pred_probs = predecessor_table(trans)
+
+    # d[i, r]: probability of the r-th best path into state i, before it emits
+    d = np.zeros((num_states, k))
+    d[:, 0] = np.asarray(init_probs, dtype=np.float64)[:num_states]
+    d[end] = 0
+    scale = 0
+    # back[t][j, r] = state * k + rank at time t of the r-th best path into j at t + 1
+    back = np.empty((max(len(obs) - 1, 0), end, k), dtype=np.int64)
+
+    for t in range(0, len(obs) - 1):
+        src = d * em_t[obs[t]][:, None]
+        cand = src[pred_idx] * pred_probs[..., None]
+        best, arg = top_k(cand.reshape(end, -1), k)
+        back[t] = pred_idx[np.arange(end)[:, None], arg // k] * k + arg % k
+
+        flat, s = rescale(best.ravel())
+        d[:end] = flat.reshape(end, k)
+        scale += s
+
+    if len(obs) == 0:
+        return []
+
+    # the move to the ending state
+    _, end_probs = trans.column(end)
+    cand = d * em_t[obs[-1]][:, None] * np.asarray(end_probs)[:, None]
+    best, arg = top_k(cand.reshape(1, -1), k)
+
+    paths = []
+    for p, f in zip(best[0].tolist(), arg[0].tolist()):
+        if p <= 0:
+            break
+
+        trace = [f // k]
+        for t in range(len(obs) - 2, -1, -1):
+            f = int(back[t][trace[-1], f % k])
+            trace.append(f // k)
+
+        trace.reverse()
+        paths.append((math.log(p) + scale, trace))
+
+    return paths
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+#
+# Parallel-in-time Viterbi decoding of one long observation sequence.
+#
+# The recursion of ViterbiAlgorithm.predict is sequential over the time steps, but it
+# is a product in the (max, *) semiring: the delta row at the end of a chunk of steps
+# is the delta row at its start times the chunk's "transfer matrix", whose entry
+# [i][j] is the probability of the best path from state i at the start of the chunk
+# to state j at its end. The decoding therefore runs in four phases:
+#
+# 1) (parallel) the transfer matrix of every chunk is computed, starting from every
+#    state at once;
+# 2) the delta rows at the chunk boundaries are obtained by scanning the initial
+#    probabilities through the transfer matrices, which is cheap (one vector-matrix
+#    product per chunk);
+# 3) (parallel) every chunk runs the usual recursion from its boundary row, and maps
+#    each state at its end to the state its best path starts from; following these
+#    maps backwards from the ending state gives the state at every chunk boundary;
+# 4) (parallel) every chunk runs the recursion again and backtraces from its known
+#    end state.
+#
+# Phase 1 costs about N times a sequential decode of the chunk (N = number of
+# states), so this only pays off for the sparse engine on many more cores than chunks;
+# on a few cores it is much slower than hmm_viterbi_np.viterbi().
+#
+# Within a row of a transfer matrix, the probabilities of the paths to different end
+# states easily differ by more than the range of a double (e.g. 1e-400 against 1),
+# while the best path of the whole sequence may well go through such a small entry.
+# Phases 1 and 2 are therefore computed in log space, where nothing underflows.
+#
+# The boundary rows are sums of the logs of the factors that sequential decoding
+# multiplies, so they differ from the sequential rows by rounding: at most about
+# eps * (number of steps) * (largest log probability in the transfer matrices), in
+# relative terms. A decision can only come out differently if its best and second
+# best candidates are that close. Phase 4 therefore checks the decisions along the
+# path; if one of them is such a near-tie, the chunks up to the last near-tie are
+# decoded again sequentially, from the initial probabilities. The result is always
+# the same path as sequential decoding.
+#
+# The model is shared with the worker processes as in hmm_viterbi_pool.py.
+
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool
+import hmm_viterbi_pool
+from hmm_viterbi_np import (DenseTransitions, backtrace, emission_table,
+                            encode_observations, index_dtype, log_array,
+                            make_transitions, rescale_exp, viterbi)
+from hmm_viterbi_pool import SharedModel, init_worker
+
+# number of candidate values computed at once in phase 1
+BLOCK_ELEMENTS = 1 << 16
+
+# relative rounding error per step of a delta row
+STEP_ERROR = 8 * np.finfo(np.float64).eps
+
+
+def log_tables(trans):
+    """
+    The transitions in the layout of SparseTransitions.step(), with log
+    probabilities: (predecessors and their log probabilities for all states but the
+    ending one, log probabilities into the ending state). A dense matrix lists all
+    states as predecessors.
+    """
+    if isinstance(trans, DenseTransitions):
+        n = trans.num_states
+        pred_idx = np.broadcast_to(np.arange(n), (n - 1, n))
+        return pred_idx, log_array(trans.tm_t[:-1]), log_array(trans.tm_t[-1])
+
+    return (trans.pred_idx, log_array(trans.pred_probs),
+            log_array(trans.end_probs))
+
+
+def log_step(tables, src):
+    """
+    One max-product step in log space: src[..., id1] is log(delta[k][id1] *
+    em[id1][ob]), and the result is log(delta[k+1]) for every id2.
+    """
+    pred_idx, pred_log, end_log = tables
+    best = (src[..., pred_idx] + pred_log).max(axis=-1)
+    end = (src + end_log).max(axis=-1)
+    return np.concatenate((best, end[..., None]), axis=-1)
+
+
+def chunk_transfer(obs):
+    """
+    Phase 1: the transfer matrix of a chunk, as log probabilities (-inf where there
+    is no path).
+    """
+    _, _, trans, em = hmm_viterbi_pool.worker_model
+    n = trans.num_states
+    em_log = log_array(emission_table(em, n))
+    tables = log_tables(trans)
+    block = max(1, BLOCK_ELEMENTS // tables[0].size)
+
+    p = np.empty((n, n))
+    for r in range(0, n, block):
+        d = log_array(np.eye(n)[r:r + block])
+        for ob in obs:
+            d = log_step(tables, d + em_log[ob])
+        p[r:r + block] = d
+
+    return p
+
+
+def maxplus_scan(init_probs, transfers):
+    """
+    Phase 2: the delta rows at the start of every chunk, as log probabilities with
+    their maximum at 0.
+    """
+    d = log_array(np.asarray(init_probs, dtype=np.float64))
+    d -= d.max()
+    rows = [d]
+
+    for p in transfers[:-1]:
+        d = (d[:, None] + p).max(axis=0)
+        if np.isfinite(d.max()):
+            d -= d.max()
+        rows.append(d)
+
+    return rows
+
+
+def scan_tolerance(num_steps, transfers, rows):
+    """
+    Bound of the relative difference between the boundary rows and the delta rows of
+    sequential decoding, see above.
+    """
+    magnitude = 1.0
+    for a in list(transfers) + list(rows):
+        finite = a[np.isfinite(a)]
+        if len(finite):
+            magnitude = max(magnitude, float(np.abs(finite).max()))
+
+    return 4 * np.finfo(np.float64).eps * (num_steps + 2 * len(rows)) * magnitude
+
+
+def chunk_prevs(d, obs):
+    """
+    Run the recursion over a chunk from the delta row d. Returns the backpointers and
+    the rows delta[k] * em[:, ob] of every step.
+    """
+    _, _, trans, em = hmm_viterbi_pool.worker_model
+    em_t = emission_table(em, trans.num_states)
+    prevs = np.empty((len(obs), trans.num_states),
+                     dtype=index_dtype(trans.num_states))
+    srcs = np.empty((len(obs), trans.num_states))
+
+    for k in range(0, len(obs)):
+        srcs[k] = d * em_t[obs[k]]
+        ds, prevs[k] = trans.step(srcs[k])
+        d, _ = rescale_exp(ds)
+
+    return prevs, srcs
+
+
+def chunk_entry_map(task):
+    """
+    Phase 3: for every state at the end of the chunk, the state at its start.
+    """
+    d, obs = task
+    prevs, _ = chunk_prevs(d, obs)
+    states = np.arange(prevs.shape[1])
+    for k in range(len(obs) - 1, -1, -1):
+        states = prevs[k][states]
+
+    return states
+
+
+def chunk_path(task):
+    """
+    Phase 4: the states of the chunk, given the state right after its end, and
+    whether any decision along them is a near-tie.
+    """
+    d, obs, state, tolerance = task
+    trans = hmm_viterbi_pool.worker_model[2]
+    prevs, srcs = chunk_prevs(d, obs)
+
+    path = []
+    near_tie = False
+    for k in range(len(obs) - 1, -1, -1):
+        sources, probs = trans.column(state)
+        cand = np.sort(srcs[k][sources] * probs)
+        if len(cand) > 1 and cand[-1] > 0:
+            near_tie |= cand[-1] - cand[-2] <= tolerance * cand[-1]
+
+        state = int(prevs[k][state])
+        path.append(state)
+
+    path.reverse()
+    return path, bool(near_tie)
+
+
+def viterbi_parallel(init_probs, trans, em, obs, chunks=None, workers=None):
+    """
+    Decode one (integer encoded) observation sequence with `chunks` chunks on a pool
+    of `workers` processes. Returns the same trace as backtrace(len(obs) - 1).
+    """
+    if len(obs) == 0:
+        return []
+
+    workers = workers or os.cpu_count() or 1
+    chunks = min(chunks or workers, len(obs))
+    model = SharedModel.from_model(init_probs, trans, em)
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(model.spec,)) as pool:
+            bounds = np.linspace(0, len(obs), chunks + 1).astype(int)
+            parts = [obs[bounds[c]:bounds[c + 1]] for c in range(0, chunks)]
+
+            transfers = pool.map(chunk_transfer, parts)
+            rows = maxplus_scan(init_probs, transfers)
+            # both candidates of a decision may be off by the scan error
+            tolerance = 2 * scan_tolerance(len(obs), transfers, rows) + \
+                STEP_ERROR * len(obs)
+            rows = [np.exp(d) for d in rows]
+
+            # state right after the end of each chunk; the last chunk ends in the
+            # ending state
+            maps = pool.map(chunk_entry_map, list(zip(rows[1:], parts[1:])))
+            ends = [trans.num_states - 1]
+            for m in reversed(maps):
+                ends.append(int(m[ends[-1]]))
+            ends.reverse()
+
+            results = pool.map(chunk_path, [(d, part, end, tolerance)
+                                            for d, part, end in zip(rows, parts, ends)])
+    finally:
+        model.unlink()
+
+    paths = [path for path, _ in results]
+    ties = [c for c, (_, near_tie) in enumerate(results) if near_tie]
+    if ties:
+        c = ties[-1]
+        _, prevs = viterbi(init_probs, trans, em, obs[:bounds[c + 1]], False)
+        paths[:c + 1] = [backtrace(prevs, bounds[c + 1] - 1, ends[c])]
+
+    return [state for path in paths for state in path]
+
+
+if __name__ == '__main__':
+    from hmm_viterbi_test import (NUM_COLS, dump_trace, load_init_prob_file,
+                                  load_matrix, load_observation_sequence,
+                                  load_tm_file)
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 5:
+        print("Usage:", sys.argv[0],
+              "<num_states> <init_file> <tm_file> <em_file> <observation_file>",
+              "[--workers=N] [--chunks=N] [--engine=numpy|sparse] [--cols=N]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    init_prob = load_init_prob_file(args[1])[:num_states]
+    tm = load_tm_file(args[2])
+    em = np.asarray(load_matrix(args[3]))[:num_states]
+    seq = load_observation_sequence(args[4])
+    workers = int(opts['workers']) if opts.get('workers') else None
+    chunks = int(opts['chunks']) if opts.get('chunks') else None
+    num_cols = int(opts['cols']) if opts.get('cols') else NUM_COLS
+
+    trans = make_transitions(tm, num_states, opts.get('engine') == 'sparse')
+    trace = viterbi_parallel(init_prob, trans, em, encode_observations(seq), chunks,
+                             workers)
+    dump_trace(trace, seq, num_cols)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+# Decode many observation files with a pool of worker processes.
+#
+# The model (initial probabilities, transitions and emissions) is loaded once by the
+# parent process and copied into one block of multiprocessing.shared_memory. The
+# workers attach to that block and use the arrays in place, so the model is neither
+# re-parsed nor copied per worker or per file.
+#
+# Each observation file <dir>/<name> is decoded into <out_dir>/<name>, in the same
+# "x:y color" format as hmm_viterbi_test.py. Files are handed out in input order and
+# reported in input order.
+
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool, shared_memory
+from hmm_viterbi_np import (DenseTransitions, backtrace, encode_observations,
+                            make_transitions, viterbi)
+from hmm_viterbi_test import NUM_COLS, format_trace
+from observations import load_observations
+from sparse_transitions import SparseTransitions
+
+TRANSITION_KINDS = {"dense": DenseTransitions, "sparse": SparseTransitions}
+
+
+class SharedModel:
+    """
+    A set of named numpy arrays placed in one shared memory block.
+
+    The process that creates the SharedModel owns the block and must call unlink()
+    when done. Other processes call SharedModel.attach(spec) with the picklable
+    `spec` of the owner to get the arrays without copying them.
+    """
+
+    ALIGN = 64
+
+    def __init__(self, arrays, kind):
+        layout, size = [], 0
+        for name, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            layout.append((name, size, a.shape, a.dtype.str))
+            size += -(-a.nbytes // self.ALIGN) * self.ALIGN
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.spec = (self.shm.name, kind, layout)
+        self.arrays = self.views(self.shm, layout)
+        for name, a in arrays.items():
+            self.arrays[name][...] = a
+
+    @staticmethod
+    def views(shm, layout):
+        arrays = {}
+        for name, offset, shape, dtype in layout:
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                                      offset=offset)
+        return arrays
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attach to the block described by `spec`. Returns (shm, kind, arrays); keep a
+        reference to shm for as long as the arrays are used.
+        """
+        name, kind, layout = spec
+        shm = shared_memory.SharedMemory(name=name)
+        return shm, kind, cls.views(shm, layout)
+
+    @classmethod
+    def from_model(cls, init_probs, trans, em):
+        arrays = {"init": np.asarray(init_probs, dtype=np.float64),
+                  "em": np.asarray(em, dtype=np.float64)}
+        for name, a in trans.arrays().items():
+            arrays["tm." + name] = a
+
+        kind = "sparse" if isinstance(trans, SparseTransitions) else "dense"
+        return cls(arrays, kind)
+
+    def close(self):
+        self.arrays = None
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+
+# model of a worker process, set by init_worker()
+worker_model = None
+
+
+def init_worker(spec):
+    global worker_model
+
+    shm, kind, arrays = SharedModel.attach(spec)
+    trans = TRANSITION_KINDS[kind].from_arrays(
+        {name[3:]: a for name, a in arrays.items() if name.startswith("tm.")})
+    worker_model = (shm, arrays["init"], trans, arrays["em"])
+
+
+def decode_file(task):
+    """
+    Decode one observation file and write the trace. Runs in a worker process.
+    """
+    obs_file, out_file, num_cols = task
+    _, init_probs, trans, em = worker_model
+
+    seq = load_observations(obs_file)
+    if len(seq) == 0:
+        lines = []
+    else:
+        _, prevs = viterbi(init_probs, trans, em, encode_observations(seq), False)
+        lines = format_trace(backtrace(prevs, len(seq) - 1), seq, num_cols)
+
+    with open(out_file, 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+    return obs_file, out_file, len(seq)
+
+
+def decode_files(init_probs, trans, em, obs_files, out_dir, workers=None,
+                 num_cols=NUM_COLS):
+    """
+    Decode obs_files into out_dir with a pool of worker processes. Yields
+    (obs_file, out_file, num_observations) in input order. num_cols is the number of
+    columns of the grid, to print the states as x:y.
+    """
+    names = [os.path.basename(f) for f in obs_files]
+    if len(set(names)) != len(names):
+        raise Exception("observation files must have different names")
+
+    tasks = [(f, os.path.join(out_dir, name), num_cols)
+             for f, name in zip(obs_files, names)]
+    model = SharedModel.from_model(init_probs, trans, em)
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(model.spec,)) as pool:
+            for result in pool.imap(decode_file, tasks):
+                yield result
+    finally:
+        model.unlink()
+
+
+if __name__ == '__main__':
+    import time
+    from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                  load_tm_file)
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 6:
+        print("Usage:", sys.argv[0],
+              "<num_states> <init_file> <tm_file> <em_file> <out_dir>",
+              "<observation_file> [<observation_file> ...]",
+              "[--workers=N] [--engine=numpy|sparse] [--cols=N]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    init_prob = load_init_prob_file(args[1])
+    tm = load_tm_file(args[2])
+    em = load_matrix(args[3])
+    out_dir = args[4]
+    obs_files = args[5:]
+    workers = int(opts['workers']) if opts.get('workers') else None
+    num_cols = int(opts['cols']) if opts.get('cols') else NUM_COLS
+
+    trans = make_transitions(tm, num_states, opts.get('engine') == 'sparse')
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    total = 0
+    for obs_file, out_file, n in decode_files(init_prob[:num_states], trans,
+                                              np.asarray(em)[:num_states],
+                                              obs_files, out_dir, workers,
+                                              num_cols):
+        print("%s -> %s: %d observations" % (obs_file, out_file, n))
+        total += n
+
+    seconds = time.perf_counter() - start
+    print("decoded %d files, %d observations in %.3f s" %
+          (len(obs_files), total, seconds))
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+#
+# Decoding service.
+#
+# Decoding with hmm_viterbi_test.py starts Python and parses the model for every
+# observation file. The server loads the model once and decodes the observation
+# sequences it receives on a Unix or TCP socket:
+#
+# * a request is one line with the observed colors, separated by blanks
+#   (e.g. "g b r"); the reply is the trace, one "x:y color" line per observation as
+#   printed by hmm_viterbi_test.py, followed by an empty line. Errors are replied as
+#   "error: <message>" and an empty line;
+# * the line "stats" is replied with the counters of the server, as one line of JSON
+#   and an empty line.
+#
+# Requests that arrive together (from any connection) are decoded as one batch (see
+# hmm_viterbi_np.viterbi_batch): a batch is started as soon as it has --max-batch
+# requests or --max-batch-obs observations, or --max-delay-ms after its first
+# request. A request that does not fit in the batch waits for the next one, so a
+# request longer than --max-batch-obs is decoded alone. The batches are decoded one
+# at a time in a worker thread, so the server keeps reading requests meanwhile.
+#
+# At most --max-pending requests wait for a batch; beyond that the server stops
+# reading from the connections until there is room again (backpressure), and
+# sequences longer than --max-length are rejected. Request lines are only buffered up
+# to a few bytes per observation of --max-length: longer lines are skipped and
+# replied with an error.
+#
+# Usage:
+#   python3 hmm_viterbi_server.py serve <num_states> <init_file> <tm_file> <em_file>
+#       --listen=unix:<path>|<host>:<port> [--engine=numpy|sparse] [--cols=N]
+#       [--max-batch=64] [--max-batch-obs=N] [--max-delay-ms=2] [--max-pending=1024]
+#       [--max-length=N]
+#   python3 hmm_viterbi_server.py client <address> <observation_file>
+#   python3 hmm_viterbi_server.py load <address> [--requests=1000] [--concurrency=16]
+#       [--length=100] [--seed=N]
+#
+# client prints the trace of an observation file, like hmm_viterbi_test.py. load
+# sends random sequences from several connections at once and prints the latency and
+# the throughput it sees, and the counters of the server.
+
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from color_grid import COLORS, NUM_COLS, OB2ID
+
+MAX_BATCH = 64
+MAX_BATCH_OBS = 1 << 16
+MAX_DELAY = 0.002
+MAX_PENDING = 1024
+MAX_LENGTH = 1 << 20
+# bytes of a request line per observation (a color and blanks), and for the rest
+LINE_BYTES = 4
+LINE_SLACK = 1024
+# number of recent latencies the percentiles are computed from
+LATENCY_WINDOW = 10000
+
+
+def parse_address(address):
+    """
+    ("unix", path) or ("tcp", (host, port)) of "unix:<path>" or "<host>:<port>".
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise Exception("invalid address %s" % address)
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+async def open_connection(address):
+    kind, where = parse_address(address)
+    if kind == "unix":
+        return await asyncio.open_unix_connection(where)
+
+    return await asyncio.open_connection(*where)
+
+
+class DecodeServer:
+    """
+    * args:
+      init_probs: initial probabilities
+           trans: transitions object (see hmm_viterbi_np.make_transitions)
+              em: emission matrix
+        num_cols: number of columns of the grid, to print the states as x:y
+       max_batch: maximum number of requests decoded together
+   max_batch_obs: maximum number of observations decoded together
+       max_delay: seconds a request waits for more requests to batch with
+     max_pending: maximum number of requests waiting for a batch
+      max_length: maximum number of observations of a request
+    """
+
+    def __init__(self, init_probs, trans, em, num_cols=NUM_COLS, max_batch=MAX_BATCH,
+                 max_delay=MAX_DELAY, max_pending=MAX_PENDING, max_length=MAX_LENGTH,
+                 max_batch_obs=MAX_BATCH_OBS):
+        self.init_probs = np.asarray(init_probs, dtype=np.float64)
+        self.trans = trans
+        self.em = em
+        self.num_cols = num_cols
+        self.max_batch = max_batch
+        self.max_batch_obs = max_batch_obs
+        self.max_delay = max_delay
+        self.max_length = max_length
+        # longer lines are not buffered but skipped, see read_request()
+        self.line_limit = LINE_BYTES * max_length + LINE_SLACK
+        self.queue = asyncio.Queue(max_pending)
+        # one batch at a time, outside of the event loop
+        self.executor = ThreadPoolExecutor(1)
+
+        self.started = time.time()
+        self.counters = {"connections": 0, "requests": 0, "errors": 0,
+                         "observations": 0, "batches": 0, "busy_seconds": 0.0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def stats(self):
+        uptime = max(time.time() - self.started, 1e-9)
+        c = dict(self.counters)
+        c["uptime_seconds"] = uptime
+        c["pending"] = self.queue.qsize()
+        c["mean_batch"] = c["requests"] / max(c["batches"], 1)
+        c["requests_per_second"] = c["requests"] / uptime
+        c["observations_per_second"] = c["observations"] / uptime
+        if self.latencies:
+            ms = np.array(self.latencies) * 1e3
+            c["latency_ms"] = {"p50": float(np.percentile(ms, 50)),
+                               "p90": float(np.percentile(ms, 90)),
+                               "p99": float(np.percentile(ms, 99)),
+                               "max": float(ms.max())}
+        return c
+
+    def decode(self, batch):
+        from hmm_viterbi_np import viterbi_batch
+
+        return viterbi_batch(self.init_probs, self.trans, self.em,
+                             [obs for obs, _, _ in batch])
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        # the request that did not fit in the last batch
+        carry = None
+        while True:
+            batch = [carry or await self.queue.get()]
+            carry = None
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch and size < self.max_batch_obs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + len(item[0]) > self.max_batch_obs:
+                    carry = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            start = time.perf_counter()
+            try:
+                traces = await loop.run_in_executor(self.executor, self.decode, batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+
+            self.counters["busy_seconds"] += time.perf_counter() - start
+            self.counters["batches"] += 1
+            for (_, future, _), trace in zip(batch, traces):
+                if not future.cancelled():
+                    future.set_result(trace)
+
+    def format_reply(self, trace, obs):
+        lines = []
+        for state, ob in zip(trace, obs.tolist()):
+            # same as utils.id2coord()
+            lines.append("%d:%d %s\n" % (state % self.num_cols + 1,
+                                         state // self.num_cols + 1, COLORS[ob]))
+        return ''.join(lines)
+
+    async def request(self, text):
+        """
+        The reply to one request line (without the final empty line).
+        """
+        if text == "stats":
+            return json.dumps(self.stats(), sort_keys=True) + '\n'
+
+        tokens = text.split()
+        if len(tokens) > self.max_length:
+            raise Exception("%d observations, at most %d are accepted" %
+                            (len(tokens), self.max_length))
+        try:
+            obs = np.array([OB2ID[t] for t in tokens], dtype=np.uint8)
+        except KeyError as e:
+            raise Exception("unknown observation %s" % e.args[0])
+        if len(obs) == 0:
+            return ''
+
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        # waits while max_pending requests are queued: backpressure
+        await self.queue.put((obs, future, start))
+        trace = await future
+
+        self.latencies.append(time.perf_counter() - start)
+        self.counters["requests"] += 1
+        self.counters["observations"] += len(obs)
+        return self.format_reply(trace, obs)
+
+    async def read_request(self, reader):
+        """
+        The next request line like reader.readline(), or None if it is longer than
+        the line limit: it is then read up to its end and dropped, so the next
+        request is read from the start of its line.
+        """
+        try:
+            return await reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+
+        while True:
+            await reader.readexactly(consumed)
+            try:
+                await reader.readuntil(b'\n')
+                return None
+            except asyncio.IncompleteReadError:
+                return None
+            except asyncio.LimitOverrunError as e:
+                consumed = e.consumed
+
+    async def handle(self, reader, writer):
+        self.counters["connections"] += 1
+        try:
+            while True:
+                line = await self.read_request(reader)
+                if line == b'':
+                    break
+
+                try:
+                    if line is None:
+                        raise Exception("request longer than %d bytes, at most %d "
+                                        "observations are accepted" %
+                                        (self.line_limit, self.max_length))
+                    reply = await self.request(line.decode().strip())
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    reply = "error: %s\n" % e
+
+                writer.write((reply + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, address):
+        kind, where = parse_address(address)
+        if kind == "unix":
+            server = await asyncio.start_unix_server(self.handle, where,
+                                                     limit=self.line_limit)
+        else:
+            server = await asyncio.start_server(self.handle, *where,
+                                                limit=self.line_limit)
+
+        batches = asyncio.ensure_future(self.run_batches())
+        print("listening on %s" % address, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batches.cancel()
+            self.executor.shutdown()
+
+
+async def decode_remote(reader, writer, seq):
+    """
+    Send one request (a list of symbols) on a connection and return the reply lines.
+    """
+    writer.write((' '.join(seq) + '\n').encode())
+    await writer.drain()
+
+    lines = []
+    while True:
+        line = (await reader.readline()).decode()
+        if line in ('\n', ''):
+            break
+        lines.append(line.rstrip('\n'))
+
+    if lines and lines[0].startswith("error: "):
+        raise Exception(lines[0][len("error: "):])
+    return lines
+
+
+async def client(address, seq):
+    reader, writer = await open_connection(address)
+    try:
+        return await decode_remote(reader, writer, seq)
+    finally:
+        writer.close()
+
+
+async def load(address, requests, concurrency, length, rng):
+    """
+    Send `requests` random sequences of `length` colors over `concurrency`
+    connections. Returns (latencies in seconds, seconds, server counters).
+    """
+    seqs = [[COLORS[c] for c in rng.integers(0, len(COLORS), length)]
+            for _ in range(0, min(requests, 64))]
+    latencies = []
+    remaining = [requests]
+
+    async def connection():
+        reader, writer = await open_connection(address)
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = time.perf_counter()
+                await decode_remote(reader, writer, seqs[remaining[0] % len(seqs)])
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[connection() for _ in range(0, concurrency)])
+    seconds = time.perf_counter() - start
+
+    stats = json.loads((await client(address, ["stats"]))[0])
+    return latencies, seconds, stats
+
+
+if __name__ == '__main__':
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    commands = {"serve": 5, "client": 3, "load": 2}
+    if len(args) < 1 or commands.get(args[0]) != len(args) or \
+            (args[0] == "serve" and not opts.get('listen')):
+        print("Usage: %s serve <num_states> <init_file> <tm_file> <em_file>\n"
+              "           --listen=unix:<path>|<host>:<port> [--engine=numpy|sparse]\n"
+              "           [--cols=N] [--max-batch=64] [--max-batch-obs=N]\n"
+              "           [--max-delay-ms=2] [--max-pending=1024] [--max-length=N]\n"
+              "       %s client <address> <observation_file>\n"
+              "       %s load <address> [--requests=1000] [--concurrency=16]\n"
+              "           [--length=100] [--seed=N]" % ((sys.argv[0],) * 3))
+        sys.exit(1)
+
+    if args[0] == "serve":
+        from hmm_viterbi_np import make_transitions
+        from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                      load_model_section, load_tm_file)
+
+        num_states = int(args[1])
+        init_prob = load_model_section(args[2], "init", load_init_prob_file)
+        tm = load_model_section(args[3], "tm", load_tm_file)
+        em = load_model_section(args[4], "em", load_matrix)
+        trans = make_transitions(tm, num_states, opts.get('engine') == 'sparse')
+
+        server = DecodeServer(
+            np.asarray(init_prob, dtype=np.float64)[:num_states], trans,
+            np.asarray(em, dtype=np.float64)[:num_states],
+            int(opts['cols']) if opts.get('cols') else NUM_COLS,
+            int(opts.get('max-batch') or MAX_BATCH),
+            float(opts.get('max-delay-ms') or MAX_DELAY * 1e3) / 1e3,
+            int(opts.get('max-pending') or MAX_PENDING),
+            int(opts.get('max-length') or MAX_LENGTH),
+            int(opts.get('max-batch-obs') or MAX_BATCH_OBS))
+        try:
+            asyncio.run(server.serve(opts['listen']))
+        except KeyboardInterrupt:
+            pass
+
+    elif args[0] == "client":
+        from hmm_viterbi_test import load_observation_sequence
+
+        for line in asyncio.run(client(args[1], load_observation_sequence(args[2]))):
+            print(line)
+
+    else:
+        rng = np.random.default_rng(int(opts['seed']) if opts.get('seed') else None)
+        requests = int(opts.get('requests') or 1000)
+        length = int(opts.get('length') or 100)
+        latencies, seconds, stats = asyncio.run(
+            load(args[1], requests, int(opts.get('concurrency') or 16), length, rng))
+
+        ms = np.array(latencies) * 1e3
+        print("%d requests of %d observations in %.3f s: %.1f requests/s, "
+              "%.0f observations/s" %
+              (len(latencies), length, seconds, len(latencies) / seconds,
+               len(latencies) * length / seconds))
+        print("latency: p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, max %.3f ms" %
+              (np.percentile(ms, 50), np.percentile(ms, 90), np.percentile(ms, 99),
+               ms.max()))
+        print("server: %s" % json.dumps(stats, sort_keys=True))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+#
+# Resumable decoding sessions.
+#
+# A robot reports its observations in bursts. Running predict() on the whole sequence
+# again after every burst costs O(T^2) over a session. A ViterbiSession is a
+# ViterbiAlgorithm that keeps the last delta row and the backpointers (in the compact
+# integer type of hmm_viterbi_np.index_dtype()), so that:
+#
+# 1) extend(seq) appends observations and continues the recursion where it stopped;
+# 2) backtrace(k) works for any k, as after predict() on the whole sequence, and the
+#    paths are the same;
+# 3) save() writes the session to a file (numpy .npz format), and load() resumes it,
+#    e.g. after it was evicted from memory. The model is not saved, only a digest of
+#    it, which load() checks.
+#
+# Usage:
+#   python3 hmm_viterbi_session.py <num_states> <init_file> <tm_file> <em_file>
+#       <session.npz> <observation_file> [--engine=numpy|sparse] [--cols=N]
+#
+# appends the observations to the session in <session.npz> (a new one if the file
+# does not exist), saves it, and prints the best path of the whole session so far.
+
+import hashlib
+import os
+import sys
+import numpy as np
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_np import (emission_table, encode_observations, index_dtype,
+                            log_array, rescale)
+from instrument import optional_phase, timed
+from model_cache import model_tables
+
+
+def model_digest(trans, em_t):
+    """
+    A digest of the tables a session decodes with.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for name, a in sorted(trans.arrays().items()):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    h.update(em_t.tobytes())
+    return h.hexdigest()
+
+
+def symbol_ids(seq):
+    """
+    The observations as an array of symbol ids (np.uint8).
+    """
+    return np.asarray(encode_observations(seq), dtype=np.uint8)
+
+
+class ViterbiSession(ViterbiAlgorithm):
+    """
+    * args:
+      n: number of states
+     tm: transition matrix, or a SparseTransitions object
+     em: emission matrix
+    seq: first observations (more can be added with extend()), as symbols or symbol
+         ids (e.g. from observations.load_observations())
+ engine: "numpy" (default) or "sparse"
+instrument: an instrument.Instrumentation to record phases and counters, or None
+
+    self.delta only holds the last row (log probabilities), like the "compact" memory
+    mode, self.prevs the backpointers of all steps so far, and self.seq the symbol
+    ids of all observations so far.
+    """
+
+    def __init__(self, n, init_probs, tm, em, seq=(), engine="numpy",
+                 instrument=None):
+        if engine == "python":
+            raise Exception("a session needs a vectorized engine")
+
+        super().__init__(n, init_probs, tm, em, symbol_ids(seq), engine, "compact",
+                         instrument)
+        with optional_phase(instrument, "model"):
+            self.trans = model_tables(n, tm, em, engine)
+            self.em_t = emission_table(em, n)
+            self.digest = model_digest(self.trans, self.em_t)
+
+        # the last delta row, scaled by exp(-scale)
+        self.row = np.asarray(init_probs, dtype=np.float64)[:n]
+        self.scale = 0.0
+        self.num_steps = 0
+        # grows by doubling; prevs is a view of the used rows
+        self.buffer = np.empty((0, n), dtype=index_dtype(n))
+        self.update_views()
+
+        if len(self.seq):
+            self.predict()
+
+    def update_views(self):
+        self.prevs = self.buffer[:self.num_steps]
+        self.delta = (log_array(self.row) + self.scale)[None]
+
+    def extend(self, seq):
+        """
+        Append observations and continue the recursion over them.
+        """
+        self.seq = np.concatenate((self.seq, symbol_ids(seq)))
+        self.predict()
+
+    @timed("predict")
+    def predict(self):
+        """
+        Run the recursion over the observations that were not decoded yet.
+        """
+        obs = self.seq[self.num_steps:]
+        needed = self.num_steps + len(obs)
+        if needed > len(self.buffer):
+            buffer = np.empty((max(needed, 2 * len(self.buffer)), self.num_states),
+                              dtype=self.buffer.dtype)
+            buffer[:self.num_steps] = self.buffer[:self.num_steps]
+            self.buffer = buffer
+
+        row, scale = self.row, self.scale
+        prevs = self.buffer[self.num_steps:needed]
+        for k in range(0, len(obs)):
+            ds, prevs[k] = self.trans.step(row * self.em_t[obs[k]])
+            row, s = rescale(ds)
+            scale += s
+
+        self.row, self.scale = row, float(scale)
+        self.num_steps = needed
+        self.update_views()
+
+        if self.instrument is not None:
+            self.instrument.count("steps", len(obs))
+
+    def save(self, filename):
+        """
+        Save the session to filename (numpy .npz format). The file is replaced only
+        once it is completely written.
+        """
+        tmp = filename + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, row=self.row, scale=np.array([self.scale]), prevs=self.prevs,
+                     obs=self.seq,
+                     model=np.array([self.engine, self.digest]))
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename, n, tm, em, instrument=None):
+        """
+        Resume a session saved by save(). (n, tm, em) must be the model it was
+        decoded with.
+        """
+        with np.load(filename) as f:
+            engine, digest = [str(x) for x in f["model"]]
+            session = cls(n, f["row"], tm, em, (), engine, instrument)
+            if session.digest != digest:
+                raise Exception("session %s was decoded with another model" %
+                                filename)
+
+            session.scale = float(f["scale"][0])
+            session.buffer = f["prevs"].astype(session.buffer.dtype)
+            session.num_steps = len(session.buffer)
+            session.seq = f["obs"]
+
+        session.update_views()
+        return session
+
+
+if __name__ == '__main__':
+    from hmm_viterbi_test import (NUM_COLS, dump_trace, load_init_prob_file,
+                                  load_matrix, load_model_section, load_tm_file)
+    from observations import load_observations
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 6:
+        print("Usage:", sys.argv[0], "<num_states> <init_file> <tm_file> <em_file>",
+              "<session.npz> <observation_file> [--engine=numpy|sparse] [--cols=N]")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    tm = load_model_section(args[2], "tm", load_tm_file)
+    em = load_model_section(args[3], "em", load_matrix)
+    num_cols = int(opts['cols']) if opts.get('cols') else NUM_COLS
+
+    if os.path.exists(args[4]):
+        session = ViterbiSession.load(args[4], num_states, tm, em)
+    else:
+        init_prob = load_model_section(args[1], "init", load_init_prob_file)
+        session = ViterbiSession(num_states, init_prob, tm, em, (),
+                                 opts.get('engine', 'numpy'))
+
+    session.extend(load_observations(args[5]))
+    session.save(args[4])
+
+    if len(session.seq):
+        dump_trace(session.backtrace(len(session.seq) - 1), session.seq, num_cols)
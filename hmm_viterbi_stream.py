@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#
+# Streaming (online) Viterbi decoding.
+#
+# ViterbiAlgorithm.predict needs the whole observation sequence up front and keeps a
+# full row of delta and prevs for every step. StreamingViterbi takes the observations
+# one at a time and keeps only the backpointers of the steps that are not decided yet:
+#
+# 1) As soon as all surviving paths share a common ancestor, the states up to that
+#    ancestor can no longer change, and they are emitted.
+# 2) With a fixed lag L, the state at time k - L is forced once
+#    observation k has arrived: it is taken from the currently best path, and all
+#    survivors that do not go through it are dropped, so that the emitted states
+#    always form one consistent path.
+#
+# The lag defaults to LAG observations, so that the memory used is bounded. With
+# lag=None (--lag=none) there is no lag, and the emitted states are the same as
+# backtrace(len(seq) - 1) after predict() on the whole sequence (for sequences with a
+# non-zero probability); so are they with the default lag, as long as the surviving
+# paths always merge within LAG observations, which they do on the grids by far.
+#
+# Both rules need the ancestor, at the oldest undecided time, of every state of the
+# last step. The backpointers of the undecided steps are kept as a queue of two
+# stacks: at the front, the composition of the backpointers from every step up to
+# the first step of the back; at the back, the backpointers themselves and their
+# composition. An ancestor is then one lookup in each composition, and every step is
+# composed into the front once, so each observation costs O(1) operations on rows of
+# N states, whatever the number of undecided steps.
+
+import sys
+import numpy as np
+from hmm_viterbi_np import (emission_table, encode_observations, index_dtype,
+                            make_transitions, rescale)
+
+# default lag (observations)
+LAG = 1000
+
+
+class StreamingViterbi:
+    """
+    * args:
+     init_probs: initial probabilities
+          trans: transitions object (see hmm_viterbi_np.make_transitions)
+             em: emission matrix
+            lag: maximum number of observations a state can stay undecided, or None
+                 for no limit
+    """
+
+    def __init__(self, init_probs, trans, em, lag=LAG):
+        self.trans = trans
+        self.lag = lag
+        num_states = trans.num_states
+        self.em_t = emission_table(em, num_states)
+        self.index_dtype = index_dtype(num_states)
+        self.delta = np.array(init_probs, dtype=np.float64)[:num_states]
+
+        # the states before num_final are decided; the undecided steps num_final ..
+        # num_obs - 1 are front (oldest last: front[-1][j] is the state at num_final
+        # of the path in state j at the first time of the back) and back (the
+        # backpointers of the latest steps, and back_map: the state at the first time
+        # of the back of the path in state j at time num_obs, or None for identity)
+        self.front = []
+        self.back = []
+        self.back_map = None
+        self.num_obs = 0
+        self.num_final = 0
+
+    def compose_front(self):
+        """
+        Move the back into the front.
+        """
+        f = self.back[-1]
+        self.front = [f]
+        for prevs in reversed(self.back[:-1]):
+            f = prevs[f]
+            self.front.append(f)
+
+        self.back = []
+        self.back_map = None
+
+    def ancestors(self, states):
+        """
+        The states at time num_final of the paths in `states` at time num_obs.
+        """
+        if self.num_final == self.num_obs:
+            return states
+        if not self.front:
+            self.compose_front()
+        if self.back_map is not None:
+            states = self.back_map[states]
+
+        return self.front[-1][states]
+
+    def pop(self):
+        """
+        Decide the state at time num_final, which ancestors() agree on.
+        """
+        self.front.pop()
+        self.num_final += 1
+
+    def find_merge(self, live):
+        """
+        Decide the states at the oldest undecided times, as long as all the surviving
+        states (`live`, at time num_obs) go through one state.
+        """
+        states = []
+        while len(live) and self.num_final <= self.num_obs:
+            anc = self.ancestors(live)
+            if (anc != anc[0]).any():
+                break
+
+            states.append(int(anc[0]))
+            if self.num_final == self.num_obs:
+                self.num_final += 1
+            else:
+                self.pop()
+
+        return states
+
+    def force_lag(self):
+        """
+        Decide the state at time num_final from the best path, and drop the survivors
+        at time num_obs that do not go through it.
+        """
+        anc = self.ancestors(np.arange(self.trans.num_states))
+        # the best path ends in the ending state
+        state = int(anc[-1])
+        self.delta[anc != state] = 0
+        self.pop()
+        return [state]
+
+    def push(self, ob):
+        """
+        Add one observation. Returns the states that became final, in time order,
+        continuing right after the states returned by the previous calls.
+        """
+        ob = encode_observations([ob])[0] if isinstance(ob, str) else ob
+        src = self.delta * self.em_t[ob]
+        states = self.find_merge(np.flatnonzero(src > 0))
+
+        ds, prevs = self.trans.step(src)
+        self.delta, _ = rescale(ds)
+        if self.num_final <= self.num_obs:
+            prevs = prevs.astype(self.index_dtype)
+            self.back.append(prevs)
+            self.back_map = prevs if self.back_map is None else self.back_map[prevs]
+        self.num_obs += 1
+
+        if self.lag is not None and self.num_obs - self.num_final > self.lag:
+            states += self.force_lag()
+
+        return states
+
+    def flush(self):
+        """
+        End of the stream: returns the states that are not final yet, along the best
+        path.
+        """
+        if self.num_final >= self.num_obs:
+            return []
+
+        # from the ending state at time num_obs back to the first time of the back
+        state = self.trans.num_states - 1
+        back = []
+        for prevs in reversed(self.back):
+            state = int(prevs[state])
+            back.append(state)
+
+        states = [int(f[state]) for f in reversed(self.front)] + back[::-1]
+        self.front, self.back, self.back_map = [], [], None
+        self.num_final = self.num_obs
+        return states
+
+    def decode(self, observations):
+        """
+        Generator over the decoded states of an iterable of observations. States are
+        yielded as soon as they are final.
+        """
+        for ob in observations:
+            for state in self.push(ob):
+                yield state
+
+        for state in self.flush():
+            yield state
+
+
+def read_observations(f):
+    """
+    Observations from a text stream, one per line, using the last token of each line
+    (the same format as load_observation_sequence()).
+    """
+    for line in f:
+        tokens = line.split()
+        if tokens:
+            yield tokens[-1]
+
+
+if __name__ == '__main__':
+    from collections import deque
+    from color_grid import NUM_COLS
+    from hmm_viterbi_test import (load_init_prob_file, load_matrix,
+                                  load_tm_file)
+    from utils import id2coord, parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 4:
+        print("Usage:", sys.argv[0],
+              "<num_states> <init_file> <tm_file> <em_file> [--lag=N|none]",
+              "[--engine=numpy|sparse] [--cols=N] < observations")
+        sys.exit(1)
+
+    num_states = int(args[0])
+    init_prob = load_init_prob_file(args[1])
+    tm = load_tm_file(args[2])
+    em = load_matrix(args[3])
+    lag = opts.get('lag') or LAG
+    lag = None if lag == 'none' else int(lag)
+    num_cols = int(opts['cols']) if opts.get('cols') else NUM_COLS
+    trans = make_transitions(tm, num_states, opts.get('engine') == 'sparse')
+
+    sv = StreamingViterbi(init_prob, trans, em, lag)
+    pending = deque()
+    for ob in read_observations(sys.stdin):
+        pending.append(ob)
+        for state in sv.push(ob):
+            x, y = id2coord(state, num_cols)
+            print("%d:%d %s" % (x, y, pending.popleft()), flush=True)
+
+    for state in sv.flush():
+        x, y = id2coord(state, num_cols)
+        print("%d:%d %s" % (x, y, pending.popleft()))
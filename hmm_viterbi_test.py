@@ -39,6 +39,57 @@ def load_matrix(filename):
     return m
 
 
+# first word of a sparse transition matrix file, see TrainGrid.dump_prob_sparse()
+SPARSE_MAGIC = "sparse"
+
+
+def load_sparse_matrix(filename):
+    """
+    Load a transition matrix written by TrainGrid.dump_prob_sparse() into a
+    SparseTransitions object. Use its todense() for the "python" engine.
+    """
+    from sparse_transitions import SparseTransitions
+
+    indptr, indices, data = [0], [], []
+    with open(filename, 'r') as f:
+        tokens = f.readline().split()
+        if len(tokens) != 2 or tokens[0] != SPARSE_MAGIC:
+            raise Exception("%s is not a sparse matrix file" % filename)
+        num_states = int(tokens[1])
+
+        for line in f:
+            for e in line.split(','):
+                if not e.strip():
+                    continue
+
+                j, p = e.split(':')
+                if float(p) != 0:
+                    indices.append(int(j))
+                    data.append(float(p))
+
+            indptr.append(len(indices))
+
+    if len(indptr) != num_states + 1:
+        raise Exception("%s: expected %d rows, found %d" %
+                        (filename, num_states, len(indptr) - 1))
+
+    return SparseTransitions(num_states, indptr, indices, data)
+
+
+def load_tm_file(filename):
+    """
+    Load a transition matrix, either dense (see load_matrix()) or sparse (see
+    load_sparse_matrix()).
+    """
+    with open(filename, 'r') as f:
+        sparse = f.readline().startswith(SPARSE_MAGIC)
+
+    if sparse:
+        return load_sparse_matrix(filename)
+
+    return load_matrix(filename)
+
+
 def dump_matrix(m, format_str="%7.4f"):
     for i in range(0, len(m)):
         row = m[i]
@@ -60,11 +111,45 @@ def load_observation_sequence(filename):
     return seq
 
 
-def dump_trace(trace, seq):
+def format_trace(trace, seq, num_cols=NUM_COLS):
+    if hasattr(seq, 'dtype'):
+        # symbol ids, see observations.load_observations()
+        from observations import symbol_list
+        seq = symbol_list(seq)
+
+    lines = []
     for i in range(0, len(trace)):
-        #print(trace[i])
-        x, y = id2coord(trace[i], NUM_COLS)
-        print("%d:%d %s" % (x, y, seq[i]))
+        x, y = id2coord(trace[i], num_cols)
+        lines.append("%d:%d %s" % (x, y, seq[i]))
+
+    return lines
+
+
+def dump_trace(trace, seq, num_cols=NUM_COLS):
+    for line in format_trace(trace, seq, num_cols):
+        print(line)
+
+
+# first bytes of a binary model file, see hmm_model.py
+MODEL_MAGIC = b"HMMMODEL"
+
+
+def load_model_section(filename, section, load_text, verify=True):
+    """
+    Load one section ("init", "tm" or "em") of the model from a binary model file, or
+    with load_text() if the file is a text file. The sections of a model file are
+    checked against their CRC32, unless verify is False.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MODEL_MAGIC)) != MODEL_MAGIC:
+            return load_text(filename)
+
+    from hmm_model import ModelFile
+    model = ModelFile(filename, verify)
+    if section == "tm":
+        return model.transitions()
+
+    return model[section]
 
 
 def load_init_prob_file(filename):
@@ -78,37 +163,74 @@ def load_init_prob_file(filename):
 
 
 import sys
-from utils import id2coord
+from instrument import from_options, optional_phase
+from utils import id2coord, parse_options
 
 if __name__ == '__main__':
-    if len(sys.argv) != 6:
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) != 5:
         print(
             "Usage:", sys.argv[0],
-            "<num_states> <init_file> <tm_file> <em_file> <observation_file>")
+            "<num_states> <init_file> <tm_file> <em_file> <observation_file>",
+            "[--engine=python|numpy|sparse] [--memory=full|compact|checkpoint]",
+            "[--cols=N] [--kbest=K] [--beam=W] [--threshold=T]",
+            "[--instrument=<file.jsonl>] [--trace-memory]",
+            "[--profile=<file>]")
         sys.exit(1)
 
-    num_states = int(sys.argv[1])
-    init_file = sys.argv[2]
-    tm_file = sys.argv[3]
-    em_file = sys.argv[4]
-    obs_file = sys.argv[5]
-
-    init_prob = load_init_prob_file(init_file)
+    num_states = int(args[0])
+    init_file = args[1]
+    tm_file = args[2]
+    em_file = args[3]
+    obs_file = args[4]
+    engine = opts.get('engine', 'python')
+    memory = opts.get('memory', 'full')
+    # number of columns of the grid, to print the states as x:y
+    num_cols = int(opts['cols']) if opts.get('cols') else NUM_COLS
+
+    inst = from_options("hmm_viterbi_test", opts)
+
+    with optional_phase(inst, "parse"):
+        init_prob = load_model_section(init_file, "init", load_init_prob_file)
+
+        tm = load_model_section(tm_file, "tm", load_tm_file)
+        # dump_matrix(tm)
+
+        em = load_model_section(em_file, "em", load_matrix)
+        # dump_matrix(em)
+
+        if engine == "python":
+            seq = load_observation_sequence(obs_file)
+        else:
+            from observations import load_observations
+            seq = load_observations(obs_file)
+        # print(len(seq))
+        # print(seq)
+
+    beam = int(opts['beam']) if opts.get('beam') else None
+    threshold = float(opts['threshold']) if opts.get('threshold') else None
+
+    va = ViterbiAlgorithm(num_states, init_prob, tm, em, seq, engine, memory, inst,
+                          beam, threshold)
+    if opts.get('kbest'):
+        # the k most likely paths, each after a line with its rank and log probability
+        paths = va.kbest(int(opts['kbest']))
+        with optional_phase(inst, "output"):
+            for i, (score, trace) in enumerate(paths):
+                print("# path %d: log P = %.6f" % (i + 1, score))
+                dump_trace(trace, seq, num_cols)
+
+        if inst is not None:
+            inst.finish()
+        sys.exit(0)
 
-    tm = load_matrix(tm_file)
-    # dump_matrix(tm)
-
-    em = load_matrix(em_file)
-    # dump_matrix(em)
-
-    seq = load_observation_sequence(obs_file)
-    # print(len(seq))
-    # print(seq)
-
-    va = ViterbiAlgorithm(num_states, init_prob, tm, em, seq)
     va.predict()
     #va.dump_delta()
     #va.dump_prevs()
 
     trace = va.backtrace(len(seq) - 1)
-    dump_trace(trace, seq)
\ No newline at end of file
+    with optional_phase(inst, "output"):
+        dump_trace(trace, seq, num_cols)
+
+    if inst is not None:
+        inst.finish()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Opt-in instrumentation of the decoder and the trainers.
+#
+# ViterbiAlgorithm, TrainGrid and TrainEmitGrid take an optional Instrumentation
+# object. When one is given, they record:
+#
+# * the wall time of every phase (e.g. "model", "predict", "backtrace" of the decoder,
+#   "load", "count", "prob" of the trainers), and how often it ran;
+# * counters, e.g. the number of steps, of candidate transitions evaluated and of
+#   states that were alive or pruned (probability 0) over all steps;
+# * optionally, the peak of the memory allocated during every phase (tracemalloc);
+# * optionally, a cProfile profile of all the phases.
+#
+# finish() hands the collected record (a dict) to the sink: any callable, e.g.
+# JsonLinesSink to append it to a JSON lines file, or a function of the caller.
+#
+# Without an Instrumentation object, the instrumented code only checks for None once
+# per phase, outside of the loops.
+
+import cProfile
+import functools
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class JsonLinesSink:
+    """
+    Appends every record as one line of JSON to a file ("-" for stderr).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, record):
+        line = json.dumps(record, sort_keys=True)
+        if self.filename == "-":
+            print(line, file=sys.stderr)
+            return
+
+        with open(self.filename, 'a') as f:
+            f.write(line + '\n')
+
+
+class Instrumentation:
+    """
+    * args:
+          name: name of the run, stored in the record
+          sink: callable that receives the record in finish()
+        memory: record the peak allocated memory of every phase
+       profile: file to dump a cProfile profile of the phases to, in finish()
+    """
+
+    def __init__(self, name="", sink=None, memory=False, profile=None):
+        self.name = name
+        self.sink = sink
+        self.memory = memory
+        self.profile_file = profile
+        self.profiler = cProfile.Profile() if profile else None
+        self.phases = {}
+        self.counters = {}
+        self.depth = 0
+        # peak memory of every open phase, up to the start of its open inner phase
+        self.peaks = []
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that times one run of a phase. Phases can be nested.
+        """
+        if self.profiler and self.depth == 0:
+            self.profiler.enable()
+        if self.memory:
+            # tracemalloc has one peak: keep the one of the outer phase before it is
+            # reset for this phase
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+            self.peaks.append(0)
+            tracemalloc.reset_peak()
+
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.depth -= 1
+            if self.profiler and self.depth == 0:
+                self.profiler.disable()
+
+            p = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            p["seconds"] += seconds
+            p["calls"] += 1
+            if self.memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                p["peak_bytes"] = max(p.get("peak_bytes", 0), peak)
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self):
+        return {"name": self.name, "time": time.time(), "phases": self.phases,
+                "counters": self.counters}
+
+    def finish(self):
+        """
+        Send the record to the sink and dump the profile. Returns the record.
+        """
+        record = self.record()
+        if self.sink:
+            self.sink(record)
+        if self.profiler:
+            self.profiler.dump_stats(self.profile_file)
+
+        return record
+
+
+def timed(phase):
+    """
+    Decorator for methods of objects with an `instrument` attribute: the method runs
+    as the given phase when instrument is not None.
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            if self.instrument is None:
+                return f(self, *args, **kwargs)
+
+            with self.instrument.phase(phase):
+                return f(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def optional_phase(instrument, name):
+    """
+    instrument.phase(name), or nothing if instrument is None.
+    """
+    if instrument is None:
+        yield
+    else:
+        with instrument.phase(name):
+            yield
+
+
+def from_options(name, opts):
+    """
+    An Instrumentation configured from command line options, or None:
+    --instrument=<file.jsonl> (or "-" for stderr), --trace-memory, --profile=<file>.
+    """
+    if not (opts.get('instrument') or opts.get('profile')):
+        return None
+
+    sink = JsonLinesSink(opts['instrument']) if opts.get('instrument') else None
+    return Instrumentation(name, sink, 'trace-memory' in opts, opts.get('profile'))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Cache of the per-model tables used by the Viterbi engines.
+#
+# Every ViterbiAlgorithm used to rebuild what it needs from tm and em on each decode,
+# and the Python engine looked up em[id1][ob2id(ob)] for every (id1, id2) pair of
+# every step. The tables built here are computed once per model and kept in a small
+# LRU cache, keyed by a fingerprint of the model (so equal models loaded twice share
+# them):
+#
+# * "python": the emission column of every observation symbol, and the columns of the
+#             transition matrix, as lists (of the dense matrix, for a transitions
+#             object);
+# * "numpy"/"sparse": the transitions object (see hmm_viterbi_np.make_transitions).
+#
+# The emission is deliberately not multiplied into the transition matrix ahead of
+# time: (delta * em) * tm and delta * (em * tm) round differently, and that would
+# change which predecessor wins a tie (test3.dat has such a tie).
+#
+# Computing the fingerprint reads the whole model, which costs about as much as
+# building the tables. It is therefore computed only the first time a (tm, em) pair
+# of objects is seen, and remembered by the identity of the objects: decoding again
+# with the same objects finds the tables without reading the matrices. The cache
+# keeps a reference to the objects, so that their ids are not reused. A model must
+# not be modified in place once it was decoded with, unless model_cache.clear() and
+# identity_cache.clear() are called.
+
+import hashlib
+from array import array
+from collections import OrderedDict
+
+MAX_MODELS = 8
+
+
+class LRUCache:
+    """
+    A dict with at most `maxsize` entries, dropping the least recently used one.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, build):
+        """
+        The entry for key, calling build() to create it if it is not cached.
+        """
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        value = build()
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+
+model_cache = LRUCache(MAX_MODELS)
+# (id(tm), id(em), n) -> (tm, em, fingerprint), and ("dense", id(trans)) ->
+# (trans, dense matrix) for the transitions objects decoded by the "python" engine
+identity_cache = LRUCache(MAX_MODELS)
+
+
+def matrix_bytes(m, n):
+    """
+    The first n rows of a matrix (list of lists, or numpy array) as float64 bytes.
+    """
+    if hasattr(m, 'tobytes'):
+        return m[:n].astype('float64').tobytes()
+
+    a = array('d')
+    for row in m[:n]:
+        a.extend(row)
+
+    return a.tobytes()
+
+
+def model_fingerprint(n, tm, em):
+    """
+    A digest of the first n rows of tm and em.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(b'%d;%d;%d;' % (n, len(tm[0]), len(em[0])))
+    h.update(matrix_bytes(tm, n))
+    h.update(matrix_bytes(em, n))
+    return h.hexdigest()
+
+
+def build_python_tables(n, tm, em):
+    if hasattr(tm, 'tolist'):
+        tm = tm.tolist()
+    if hasattr(em, 'tolist'):
+        em = em.tolist()
+
+    em_cols = [[em[i][s] for i in range(0, n)] for s in range(0, len(em[0]))]
+    tm_cols = [[tm[i][j] for i in range(0, n)] for j in range(0, n)]
+    return em_cols, tm_cols
+
+
+def model_tables(n, tm, em, engine):
+    """
+    The cached tables of the model (n, tm, em) for the given engine. A tm that is
+    already a transitions object is used as it is by the vectorized engines; the
+    "python" engine uses its dense matrix, built once per object.
+    """
+    if not hasattr(tm, '__getitem__'):
+        if engine != "python":
+            return tm
+
+        trans = tm
+        tm = identity_cache.get(("dense", id(trans)),
+                                lambda: (trans, trans.todense()))[1]
+
+    def build():
+        if engine == "python":
+            return build_python_tables(n, tm, em)
+
+        from hmm_viterbi_np import make_transitions
+        return make_transitions(tm, n, engine == "sparse")
+
+    fingerprint = identity_cache.get(
+        (id(tm), id(em), n), lambda: (tm, em, model_fingerprint(n, tm, em)))[2]
+    return model_cache.get((fingerprint, engine), build)
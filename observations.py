@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#
+# Bulk loading of observation logs.
+#
+# load_observation_sequence() in hmm_viterbi_test.py reads a log line by line and
+# keeps one Python string per observation. load_observations() reads the log in large
+# chunks, and turns every chunk into symbol ids (the index of the color in COLORS,
+# the same as ob2id()) with a few array operations: the symbol of a line is its last
+# non-blank character, so both "x:y color" lines and lines with only the color work.
+#
+# The result is cached in a sidecar file next to the log (<log>.obs): a header with
+# the size and the modification time of the log, then one byte per observation. As
+# long as the log has the same size and modification time, the cache is read instead
+# of the log. A cache that cannot be written (e.g. in a read-only directory) is
+# skipped.
+#
+# Gzip-compressed logs (recognized by their first bytes) are read the same way.
+#
+# parse_values() and read_chunks() parse whole "x:y color" lines in bulk, for the
+# trainer (hmm_train.py) and for comparing traces (compare_result.py).
+#
+# Usage:
+#   python3 observations.py <observation_file> [<observation_file> ...] [--no-cache]
+#
+# parses the files (or reads their caches), writes the caches, and prints the number
+# of observations of every file.
+
+import gzip
+import os
+import struct
+import sys
+import warnings
+import numpy as np
+from color_grid import COLORS
+
+CHUNK_BYTES = 1 << 22
+CACHE_SUFFIX = ".obs"
+CACHE_MAGIC = b"HMMOBS01"
+# magic, size and modification time (ns) of the log, number of observations
+CACHE_HEADER = struct.Struct("<8sQqQ")
+GZIP_MAGIC = b"\x1f\x8b"
+
+# byte -> symbol id, or INVALID
+INVALID = 255
+SYMBOLS = np.full(256, INVALID, dtype=np.uint8)
+for i, c in enumerate(COLORS):
+    SYMBOLS[ord(c)] = i
+
+BLANK = np.zeros(256, dtype=bool)
+BLANK[list(b' \t\r\n')] = True
+
+# "x:y c" -> "x y n", n being the index of color c in COLORS
+COLOR_DIGITS = bytes.maketrans(
+    b':' + ''.join(COLORS).encode(),
+    b' ' + ''.join([str(i) for i in range(0, len(COLORS))]).encode())
+
+
+def open_log(filename):
+    """
+    The log opened for reading bytes; gzip-compressed logs are decompressed.
+    """
+    with open(filename, 'rb') as f:
+        compressed = f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+    return gzip.open(filename, 'rb') if compressed else open(filename, 'rb')
+
+
+def parse_symbols(data, first_line=1):
+    """
+    The symbol ids of the lines in data (bytes of whole lines). Blank lines are
+    skipped. first_line is the line number of the first line, for errors.
+    """
+    b = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(b == ord('\n'))
+    if len(b) and b[-1] != ord('\n'):
+        ends = np.append(ends, len(b))
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+
+    # position of the last non-blank character up to every position
+    pos = np.where(BLANK[b], -1, np.arange(len(b), dtype=np.int64))
+    last = np.maximum.accumulate(pos) if len(pos) else pos
+    last = last[np.maximum(ends - 1, 0)] if len(ends) else last[:0]
+    filled = (last >= starts) & (ends > starts)
+    last = last[filled]
+
+    symbols = SYMBOLS[b[last]]
+    # the symbol must be one whole token
+    single = (last == starts[filled]) | BLANK[b[np.maximum(last - 1, 0)]]
+    bad = np.flatnonzero((symbols == INVALID) | ~single)
+    if len(bad):
+        line = int(np.flatnonzero(filled)[bad[0]]) + first_line
+        raise Exception("invalid observation on line %d" % line)
+
+    return symbols
+
+
+def parse_observations(filename, chunk_bytes=CHUNK_BYTES):
+    """
+    Parse a log into an array of symbol ids, without the cache.
+    """
+    chunks = []
+    line = 1
+    with open_log(filename) as f:
+        while True:
+            data = f.read(chunk_bytes)
+            if not data:
+                break
+
+            # complete the last line
+            if not data.endswith(b'\n'):
+                data += f.readline()
+            chunks.append(parse_symbols(data, line))
+            line += data.count(b'\n')
+
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint8)
+
+
+def parse_values(data, first_line=1):
+    """
+    Parse the lines "x:y color" in data (bytes) into an array with one row
+    (x, y, color index in COLORS order) per line. first_line is the line number of
+    the first line, for errors.
+    """
+    num_lines = data.count(b'\n') + (not data.endswith(b'\n'))
+    digits = data.translate(COLOR_DIGITS)
+    try:
+        with warnings.catch_warnings():
+            # depending on the version, numpy warns and stops, or raises, at the
+            # first field it cannot parse
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(digits, dtype=np.int64, sep=' ')
+    except ValueError:
+        values = None
+
+    if values is None or len(values) != 3 * num_lines:
+        for i, line in enumerate(digits.split(b'\n')):
+            tokens = line.split()
+            if len(tokens) != 3 or not all([t.isdigit() for t in tokens]):
+                break
+        raise Exception("malformed \"x:y color\" line %d" % (i + first_line))
+
+    return values.reshape(-1, 3)
+
+
+def read_chunks(filename, chunk_bytes=CHUNK_BYTES, start=0, end=None):
+    """
+    Generate consecutive chunks (bytes) of whole lines of a file. With start and end,
+    only the lines that start at a byte offset in [start, end) are read, which needs
+    a seekable file; otherwise pipes (e.g. /dev/stdin) work too.
+    """
+    with open(filename, 'rb') as f:
+        pos = 0
+        if start > 0:
+            # skip to the first line starting at or after start
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+
+        while end is None or pos < end:
+            size = chunk_bytes if end is None else min(chunk_bytes, end - pos)
+            data = f.read(size)
+            if not data:
+                break
+
+            # complete the last line
+            if not data.endswith(b'\n'):
+                data += f.readline()
+            pos += len(data)
+            if data.strip():
+                yield data
+
+
+def cache_file(filename):
+    return filename + CACHE_SUFFIX
+
+
+def read_cache(filename):
+    """
+    The cached symbols of a log, or None if there is no valid cache.
+    """
+    try:
+        st = os.stat(filename)
+        with open(cache_file(filename), 'rb') as f:
+            header = f.read(CACHE_HEADER.size)
+            if len(header) != CACHE_HEADER.size:
+                return None
+
+            magic, size, mtime, count = CACHE_HEADER.unpack(header)
+            if (magic, size, mtime) != (CACHE_MAGIC, st.st_size, st.st_mtime_ns):
+                return None
+
+            symbols = np.fromfile(f, dtype=np.uint8)
+    except OSError:
+        return None
+
+    return symbols if len(symbols) == count else None
+
+
+def write_cache(filename, symbols):
+    """
+    Write the sidecar cache of a log. Returns False if it cannot be written.
+    """
+    cache = cache_file(filename)
+    tmp = cache + ".tmp"
+    try:
+        st = os.stat(filename)
+        with open(tmp, 'wb') as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, st.st_size, st.st_mtime_ns,
+                                      len(symbols)))
+            f.write(symbols.tobytes())
+        os.replace(tmp, cache)
+    except OSError:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+        return False
+
+    return True
+
+
+def load_observations(filename, cache=True):
+    """
+    The observations of a log as an array of symbol ids (np.uint8), which the
+    vectorized engines take in place of the list of symbols. With cache, the
+    sidecar cache is used and written.
+    """
+    if cache:
+        symbols = read_cache(filename)
+        if symbols is not None:
+            return symbols
+
+    symbols = parse_observations(filename)
+    if cache:
+        write_cache(filename, symbols)
+
+    return symbols
+
+
+def symbol_list(symbols):
+    """
+    The observations as a list of symbols, e.g. ['g', 'b', 'r'], as
+    load_observation_sequence() returns them.
+    """
+    return [COLORS[s] for s in symbols.tolist()]
+
+
+if __name__ == '__main__':
+    from utils import parse_options
+
+    args, opts = parse_options(sys.argv[1:])
+    if len(args) < 1:
+        print("Usage:", sys.argv[0],
+              "<observation_file> [<observation_file> ...] [--no-cache]")
+        sys.exit(1)
+
+    for filename in args:
+        symbols = load_observations(filename, 'no-cache' not in opts)
+        print("%s: %d observations" % (filename, len(symbols)))
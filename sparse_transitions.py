@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# Sparse transition matrix for grid HMMs.
+#
+# On a color grid a robot can only stay or move to one of its 4 neighbors, so each
+# row of the transition matrix has at most 5 non-zeros plus the ending state (see the
+# comments at the top of hmm_viterbi.py). SparseTransitions keeps the matrix in CSR
+# form and, for the Viterbi recursion, a padded list of predecessors for every target
+# state. One step then costs O(N * 5) instead of O(N^2).
+#
+# The ending state N is the only state that every other state leads to, so its column
+# is kept as a dense vector and maximized separately.
+
+import numpy as np
+
+
+class SparseTransitions:
+    """
+    Transition matrix in CSR form: the non-zeros of row i are data[indptr[i]:indptr[i+1]]
+    at columns indices[indptr[i]:indptr[i+1]]. The last state is the ending state.
+
+    It provides the same step() as hmm_viterbi_np.DenseTransitions and can be used
+    wherever a transitions object is expected.
+    """
+
+    ARRAYS = ("indptr", "indices", "data", "end_probs", "pred_idx", "pred_probs")
+
+    def __init__(self, num_states, indptr, indices, data):
+        self.num_states = num_states
+        self.end_state = num_states - 1
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+        self.build_predecessors()
+
+    @classmethod
+    def from_matrix(cls, tm, n=None):
+        """
+        Build from a dense matrix, e.g. as returned by load_matrix().
+        """
+        tm = np.asarray(tm, dtype=np.float64)
+        if n is not None:
+            tm = tm[:n, :n]
+
+        rows, cols = np.nonzero(tm)
+        indptr = np.zeros(tm.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=tm.shape[0]), out=indptr[1:])
+        return cls(tm.shape[0], indptr, cols, tm[rows, cols])
+
+    @classmethod
+    def from_edges(cls, num_states, edges):
+        """
+        Build from an iterable of (i, j, prob) triples. Zero probabilities are dropped
+        and the triples may come in any order.
+        """
+        e = np.array([t for t in edges if t[2] != 0], dtype=np.float64).reshape(-1, 3)
+        rows = e[:, 0].astype(np.int64)
+        cols = e[:, 1].astype(np.int64)
+        order = np.lexsort((cols, rows))
+
+        indptr = np.zeros(num_states + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_states), out=indptr[1:])
+        return cls(num_states, indptr, cols[order], e[order, 2])
+
+    @classmethod
+    def from_train_grid(cls, traingrid):
+        """
+        Build directly from a trained gen_trans_matrix.TrainGrid, following the grid
+        neighbors instead of going through the dense (N+1)x(N+1) matrix.
+        """
+        return cls.from_edges(traingrid.grid.num_elements + 1,
+                              traingrid.prob_edges())
+
+    def arrays(self):
+        """
+        The arrays that make up this object, see from_arrays().
+        """
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild the object from arrays(), without copying them (e.g. from shared or
+        memory-mapped arrays).
+        """
+        trans = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(trans, name, arrays[name])
+
+        trans.num_states = len(trans.indptr) - 1
+        trans.end_state = trans.num_states - 1
+        return trans
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def rows(self):
+        """
+        Row numbers of all non-zeros, in CSR order.
+        """
+        return np.repeat(np.arange(self.num_states), np.diff(self.indptr))
+
+    def todense(self):
+        m = np.zeros((self.num_states, self.num_states))
+        m[self.rows(), self.indices] = self.data
+        return m
+
+    def build_predecessors(self):
+        """
+        Build the padded predecessor table for all states but the ending one. The
+        predecessors of every state are sorted by state number, and padding entries
+        have probability 0, so that argmax picks the same predecessor as predict().
+        """
+        end = self.end_state
+        rows = self.rows()
+        into_end = self.indices == end
+
+        self.end_probs = np.zeros(self.num_states)
+        self.end_probs[rows[into_end]] = self.data[into_end]
+
+        src, dst, p = rows[~into_end], self.indices[~into_end], self.data[~into_end]
+        order = np.lexsort((src, dst))
+        src, dst, p = src[order], dst[order], p[order]
+
+        counts = np.bincount(dst, minlength=end)
+        width = max(int(counts.max()) if len(counts) else 0, 1)
+        starts = np.cumsum(counts) - counts
+        slot = np.arange(len(dst)) - starts[dst]
+
+        self.pred_idx = np.zeros((end, width), dtype=np.int64)
+        self.pred_probs = np.zeros((end, width))
+        self.pred_idx[dst, slot] = src
+        self.pred_probs[dst, slot] = p
+
+    def successors(self):
+        """
+        Padded table of the states every state but the ending one can move to (not
+        counting the ending state), padded with the ending state. It is only needed
+        for beam pruning (see hmm_viterbi_beam.py), so it is built on first use.
+        """
+        if getattr(self, "succ_idx", None) is None:
+            end = self.end_state
+            rows = self.rows()
+            keep = (self.indices != end) & (rows != end)
+            src, dst = rows[keep], self.indices[keep]
+
+            counts = np.bincount(src, minlength=end)
+            width = max(int(counts.max()) if len(counts) else 0, 1)
+            slot = np.arange(len(src)) - (np.cumsum(counts) - counts)[src]
+            self.succ_idx = np.full((end, width), end, dtype=np.int64)
+            self.succ_idx[src, slot] = dst
+
+        return self.succ_idx
+
+    def column(self, j):
+        """
+        The states that can move to state j, and their transition probabilities.
+        """
+        if j == self.end_state:
+            return np.arange(self.num_states), self.end_probs
+
+        return self.pred_idx[j], self.pred_probs[j]
+
+    def step(self, src):
+        """
+        One step of the recursion, see hmm_viterbi_np.DenseTransitions.step().
+        """
+        cand = src[..., self.pred_idx] * self.pred_probs
+        slot = np.argmax(cand, axis=-1)
+        best = np.take_along_axis(cand, slot[..., None], axis=-1)[..., 0]
+        prev = self.pred_idx[np.arange(self.end_state), slot]
+        prev[best <= 0] = 0
+
+        end_cand = src * self.end_probs
+        end_prev = np.argmax(end_cand, axis=-1)
+        end_best = np.take_along_axis(end_cand, end_prev[..., None], axis=-1)
+
+        return (np.concatenate((best, end_best), axis=-1),
+                np.concatenate((prev, end_prev[..., None]), axis=-1))
+
+    def forward(self, src):
+        """
+        Sum-product version of step(), see hmm_viterbi_np.DenseTransitions.forward().
+        """
+        inner = (src[..., self.pred_idx] * self.pred_probs).sum(axis=-1)
+        end = src @ self.end_probs
+        return np.concatenate((inner, end[..., None]), axis=-1)
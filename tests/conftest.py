@@ -0,0 +1,127 @@
+#
+# Shared fixtures: the 4x4 model of the repository (trained like `make em tm`) and a
+# generated model on a grid that is not 4 columns wide, both loaded from text files
+# the same way as hmm_viterbi_test.py loads them.
+
+import os
+import sys
+from contextlib import redirect_stdout
+import numpy as np
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from color_grid import COLORS  # noqa: E402
+
+
+class Model:
+    """
+    A model and its files: n, init_probs, tm, em (as loaded from the text files),
+    num_cols, and the paths of grid.dat, train.dat, init.dat, tm.dat and em.dat in
+    `files`.
+    """
+
+    def __init__(self, files, num_cols):
+        from hmm_viterbi_test import load_init_prob_file, load_matrix, load_tm_file
+
+        self.files = files
+        self.num_cols = num_cols
+        self.tm = load_tm_file(files["tm"])
+        self.n = len(self.tm)
+        self.init_probs = load_init_prob_file(files["init"])[:self.n]
+        self.em = load_matrix(files["em"])[:self.n]
+
+    def predict(self, seq):
+        """
+        The trace of the baseline: the python engine with all delta rows.
+        """
+        from hmm_viterbi import ViterbiAlgorithm
+
+        va = ViterbiAlgorithm(self.n, self.init_probs, self.tm, self.em, list(seq))
+        va.predict()
+        return va.backtrace(len(seq) - 1)
+
+
+def train_model(directory, grid_file, train_file, init_file):
+    from array_grid import ArrayColorGrid
+    from hmm_train import train
+
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_file)
+    traingrid, emitgrid = train(grid, [train_file])
+
+    files = {"grid": grid_file, "train": train_file, "init": init_file,
+             "tm": os.path.join(directory, "tm.dat"),
+             "em": os.path.join(directory, "em.dat")}
+    with open(files["tm"], 'w') as f, redirect_stdout(f):
+        traingrid.dump_prob_full()
+    with open(files["em"], 'w') as f, redirect_stdout(f):
+        emitgrid.dump_emit_prob(False)
+
+    return Model(files, grid.num_cols)
+
+
+@pytest.fixture(scope="session")
+def repo_model(tmp_path_factory):
+    """
+    The model of `make em tm`: 16 cells, 17 states.
+    """
+    return train_model(str(tmp_path_factory.mktemp("repo")),
+                       os.path.join(REPO, "grid.dat"),
+                       os.path.join(REPO, "robot_perception_train.dat"),
+                       os.path.join(REPO, "init_prob.dat"))
+
+
+@pytest.fixture(scope="session")
+def repo_tests():
+    """
+    The observation files of the repository.
+    """
+    return [os.path.join(REPO, name) for name in
+            ("test1.dat", "test2.dat", "test3.dat", "robot_perception_test.dat")]
+
+
+@pytest.fixture(scope="session")
+def grid_model(tmp_path_factory):
+    """
+    A model trained on a random 6x9 grid, with logs sampled from it: files["test"]
+    (300 observations) and files["long"] (1500 observations). The python engine
+    computes without rescaling and underflows on the long log.
+    """
+    from array_grid import ArrayColorGrid
+    from gen_workload import (random_grid, random_walk, sample_sequence,
+                              write_grid, write_init, write_observations)
+    from sparse_transitions import SparseTransitions
+
+    directory = str(tmp_path_factory.mktemp("grid"))
+    rng = np.random.default_rng(7)
+    grid_file = os.path.join(directory, "grid.dat")
+    write_grid(grid_file, 6, 9, random_grid(6, 9, 0.15, rng))
+
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_file)
+    init_file = os.path.join(directory, "init.dat")
+    write_init(init_file, grid.num_elements)
+    train_file = os.path.join(directory, "train.dat")
+    cells, colors = random_walk(grid, 5000, 0.1, rng)
+    write_observations(train_file, cells, colors, grid.num_cols)
+
+    model = train_model(directory, grid_file, train_file, init_file)
+    trans = SparseTransitions.from_matrix(model.tm)
+    for name, length in (("test", 300), ("long", 1500)):
+        states, colors = sample_sequence(model.init_probs, trans,
+                                         np.asarray(model.em), length, rng)
+        model.files[name] = os.path.join(directory, name + ".dat")
+        write_observations(model.files[name], states, colors, grid.num_cols)
+    return model
+
+
+def load_seq(filename):
+    from hmm_viterbi_test import load_observation_sequence
+
+    return load_observation_sequence(filename)
+
+
+def symbols(seq):
+    return [COLORS[c] for c in seq]
@@ -0,0 +1,28 @@
+from conftest import load_seq
+from hmm_viterbi import ViterbiAlgorithm
+
+
+def test_decode_batch(repo_model, repo_tests, grid_model):
+    for model, files in ((repo_model, repo_tests),
+                         (grid_model, [grid_model.files["test"]] * 2)):
+        seqs = [load_seq(f) for f in files]
+        # sequences of different lengths in one batch
+        seqs.append(seqs[0][:7])
+        expected = [model.predict(seq) for seq in seqs]
+        for engine in ("numpy", "sparse"):
+            assert ViterbiAlgorithm.decode_batch(model.n, model.init_probs, model.tm,
+                                                 model.em, seqs, engine) == expected
+
+
+def test_decode_batch_ragged(grid_model):
+    seq = load_seq(grid_model.files["test"])
+    # prefixes in no particular order, from one observation to the whole sequence
+    seqs = [seq[:k] for k in (40, 1, len(seq), 2, 40, 150)]
+    expected = [grid_model.predict(s) for s in seqs]
+    for engine in ("numpy", "sparse"):
+        assert ViterbiAlgorithm.decode_batch(grid_model.n, grid_model.init_probs,
+                                             grid_model.tm, grid_model.em, seqs,
+                                             engine) == expected
+        assert ViterbiAlgorithm.decode_batch(grid_model.n, grid_model.init_probs,
+                                             grid_model.tm, grid_model.em, [],
+                                             engine) == []
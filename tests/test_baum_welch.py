@@ -0,0 +1,63 @@
+import numpy as np
+from conftest import load_seq
+from hmm_baum_welch import baum_welch, load_checkpoint
+from hmm_viterbi_np import encode_observations
+from sparse_transitions import SparseTransitions
+
+
+def observations(grid_model):
+    return [encode_observations(load_seq(grid_model.files[name]))
+            for name in ("test", "long")]
+
+
+def test_baum_welch(grid_model):
+    trans = SparseTransitions.from_matrix(grid_model.tm)
+    obs_list = observations(grid_model)
+    new_trans, em, history = baum_welch(grid_model.init_probs, trans, grid_model.em,
+                                        obs_list, iterations=3, workers=1)
+
+    # EM does not lower the likelihood
+    assert all([b >= a - 1e-6 * abs(a) for a, b in zip(history, history[1:])])
+    # the same non-zero transitions; the rows that were re-estimated sum to 1, the
+    # others are kept
+    assert np.array_equal(new_trans.indptr, trans.indptr)
+    assert np.array_equal(new_trans.indices, trans.indices)
+    inner = trans.indices != trans.end_state
+    rows = trans.rows()[inner]
+    old_sums = np.bincount(rows, weights=trans.data[inner], minlength=trans.num_states)
+    new_sums = np.bincount(rows, weights=new_trans.data[inner],
+                           minlength=trans.num_states)
+    changed = np.bincount(rows, weights=new_trans.data[inner] != trans.data[inner],
+                          minlength=trans.num_states) > 0
+    assert changed.any()
+    assert np.allclose(new_sums[changed], 1)
+    assert np.array_equal(new_sums[~changed], old_sums[~changed])
+    # the empty cells emit nothing
+    sums = em.sum(axis=1)
+    assert (np.isclose(sums, 1) | (sums == 0)).all()
+
+
+def test_baum_welch_workers_and_checkpoint(grid_model, tmp_path):
+    trans = SparseTransitions.from_matrix(grid_model.tm)
+    obs_list = observations(grid_model)
+    expected = baum_welch(grid_model.init_probs, trans, grid_model.em, obs_list,
+                          iterations=3, workers=1)
+
+    # the sequences split over two processes
+    new_trans, em, history = baum_welch(grid_model.init_probs, trans, grid_model.em,
+                                        obs_list, iterations=3, workers=2)
+    assert np.allclose(new_trans.data, expected[0].data)
+    assert np.allclose(em, expected[1])
+    assert np.allclose(history, expected[2])
+
+    # one iteration, then resumed from the checkpoint
+    checkpoint = str(tmp_path / "bw.hmm")
+    baum_welch(grid_model.init_probs, trans, grid_model.em, obs_list, iterations=1,
+               workers=1, checkpoint=checkpoint)
+    init_probs, trans, em, history = load_checkpoint(checkpoint)
+    assert len(history) == 1
+    new_trans, em, history = baum_welch(init_probs, trans, em, obs_list,
+                                        iterations=2, workers=1, history=history)
+    assert np.array_equal(new_trans.data, expected[0].data)
+    assert np.array_equal(em, expected[1])
+    assert history == expected[2]
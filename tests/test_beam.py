@@ -0,0 +1,31 @@
+from conftest import load_seq
+from hmm_viterbi import ViterbiAlgorithm
+
+
+def decode(model, seq, beam=None, threshold=None):
+    va = ViterbiAlgorithm(model.n, model.init_probs, model.tm, model.em, seq, "sparse",
+                          beam=beam, threshold=threshold)
+    va.predict()
+    return va.backtrace(len(seq) - 1)
+
+
+def test_beam_without_pruning(repo_model, repo_tests, grid_model):
+    for model, files in ((repo_model, repo_tests),
+                         (grid_model, [grid_model.files["test"]])):
+        for filename in files:
+            seq = load_seq(filename)
+            expected = model.predict(seq)
+            assert decode(model, seq, beam=model.n) == expected
+            assert decode(model, seq, threshold=1000.0) == expected
+
+
+def test_beam_pruned(grid_model):
+    seq = load_seq(grid_model.files["test"])
+    for beam, threshold in ((1, None), (5, None), (None, 2.0), (5, 2.0)):
+        va = ViterbiAlgorithm(grid_model.n, grid_model.init_probs, grid_model.tm,
+                              grid_model.em, seq, "sparse", beam=beam,
+                              threshold=threshold)
+        va.predict()
+        assert len(va.backtrace(len(seq) - 1)) == len(seq)
+        assert all([len(states) <= (beam or grid_model.n)
+                    for states, _ in va.pruned.steps])
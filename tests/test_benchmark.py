@@ -0,0 +1,51 @@
+import json
+import subprocess
+import sys
+from conftest import REPO
+from hmm_benchmark import DECODERS, TRAINERS
+
+
+def run_script(*args):
+    return subprocess.run([sys.executable] + [str(a) for a in args], cwd=REPO,
+                          check=True, capture_output=True, text=True).stdout
+
+
+def test_gen_workload(tmp_path):
+    grid, init = tmp_path / "grid.dat", tmp_path / "init.dat"
+    train, test = tmp_path / "train.dat", tmp_path / "test.dat"
+    run_script("gen_workload.py", "grid", 3, 5, grid)
+    run_script("gen_workload.py", "init", grid, init)
+    run_script("gen_workload.py", "walk", grid, 300, train)
+
+    lines = train.read_text().split('\n')
+    assert len(lines) == 301 and lines[-1] == ''
+    for line in lines[:-1]:
+        x, y = [int(v) for v in line.split()[0].split(':')]
+        assert 1 <= x <= 5 and 1 <= y <= 3
+
+
+def test_benchmark_smoke(tmp_path):
+    results = tmp_path / "results.json"
+    run_script("hmm_benchmark.py", results, "--sizes=3x5", "--lengths=20", "--runs=1",
+               "--train=300", "--workers=1")
+    data = json.loads(results.read_text())
+
+    assert set(data["meta"]) == {"created", "python", "numpy", "platform", "cpus",
+                                 "sizes", "lengths", "paths", "settings"}
+    assert {r["path"] for r in data["results"]} == set(TRAINERS) | set(DECODERS)
+    keys = {"kind", "path", "grid", "states", "length", "runs", "latency_ms",
+            "throughput", "peak_mb"}
+    for r in data["results"]:
+        assert set(r) == keys | ({"accuracy"} if r["kind"] == "decode" else set())
+        assert set(r["latency_ms"]) == {"mean", "p50", "p90", "p99", "max"}
+        assert (r["grid"], r["states"]) == ("3x5", 16)
+
+    # the decoders that are exact find the same states
+    exact = {r["accuracy"] for r in data["results"]
+             if r["kind"] == "decode" and r["path"] not in ("beam", "threshold")}
+    assert len(exact) == 1
+
+    out = run_script("hmm_benchmark.py", tmp_path / "again.json", "--sizes=3x5",
+                     "--lengths=20", "--runs=1", "--train=300", "--paths=sparse",
+                     "--compare=%s" % results)
+    assert "speedup" in out
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import pytest
+from conftest import REPO
+from compare_result import evaluate
+from observations import parse_values
+
+TEST_FILE = os.path.join(REPO, "robot_perception_test.dat")
+
+
+def compare(*args, stdin=None):
+    return subprocess.run([sys.executable, os.path.join(REPO, "compare_result.py"),
+                           TEST_FILE] + list(args), input=stdin, capture_output=True,
+                          check=True).stdout.decode()
+
+
+def test_compare_piped_prediction():
+    with open(TEST_FILE, 'rb') as f:
+        data = f.read()
+
+    expected = "correct predict: 200\ncorrect percentage: 100.00%\n"
+    assert compare(TEST_FILE) == expected
+    assert compare("/dev/stdin", stdin=data) == expected
+
+
+def test_compare_chunks(tmp_path):
+    with open(TEST_FILE) as f:
+        lines = f.read().splitlines()
+    # every other cell is wrong
+    predicted = tmp_path / "predicted.dat"
+    predicted.write_text(''.join(
+        [("%s\n" % line) if i % 2 else ("9:9 %s\n" % line.split()[-1])
+         for i, line in enumerate(lines)]))
+
+    for chunk_bytes in (None, 50):
+        test_lines, (ev,) = evaluate(TEST_FILE, [str(predicted)], chunk_bytes)
+        assert (test_lines, ev.lines, ev.correct) == (200, 200, 100)
+
+
+def test_parse_values_errors():
+    assert parse_values(b"1:2 r\n3:4 y").tolist() == [[1, 2, 0], [3, 4, 3]]
+    with pytest.raises(Exception, match="line 12"):
+        parse_values(b"1:2 r\n3:4 q\n", 11)
@@ -0,0 +1,41 @@
+from conftest import load_seq
+from hmm_viterbi import ViterbiAlgorithm
+from observations import load_observations
+
+
+def cases(repo_model, repo_tests, grid_model):
+    """
+    (model, observation file) pairs: the repository tests and the 9 column grid.
+    """
+    return [(repo_model, f) for f in repo_tests] + \
+        [(grid_model, grid_model.files["test"])]
+
+
+def decode(model, seq, engine, memory="full"):
+    va = ViterbiAlgorithm(model.n, model.init_probs, model.tm, model.em, seq, engine,
+                          memory)
+    va.predict()
+    return va
+
+
+def test_engines(repo_model, repo_tests, grid_model):
+    for model, filename in cases(repo_model, repo_tests, grid_model):
+        seq = load_seq(filename)
+        expected = model.predict(seq)
+        for engine in ("numpy", "sparse"):
+            assert decode(model, seq, engine).backtrace(len(seq) - 1) == expected
+
+            # the symbol ids of observations.py in place of the list of symbols
+            va = decode(model, load_observations(filename, cache=False), engine)
+            assert va.backtrace(len(seq) - 1) == expected
+
+
+def test_backtrace_prefix(repo_model, repo_tests):
+    seq = load_seq(repo_tests[3])
+    python = decode(repo_model, seq, "python")
+    for engine, memory in (("numpy", "full"), ("sparse", "full"),
+                           ("sparse", "checkpoint")):
+        va = decode(repo_model, seq, engine, memory)
+        for k in (0, len(seq) // 3, len(seq) // 2):
+            assert va.backtrace(k) == python.backtrace(k), (engine, memory, k)
+
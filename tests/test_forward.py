@@ -0,0 +1,69 @@
+import math
+import numpy as np
+from color_grid import ob2id
+from conftest import load_seq
+from hmm_forward import forward, forward_batch
+from hmm_viterbi_np import encode_observations, make_transitions
+
+
+def naive_forward(model, seq):
+    """
+    P(seq), summed over the paths step by step without rescaling.
+    """
+    n, tm, em = model.n, model.tm, model.em
+    end = n - 1
+    total = sum(model.init_probs)
+    alpha = [model.init_probs[s] / total * em[s][ob2id(seq[0])] for s in range(0, n)]
+    for ob in seq[1:]:
+        alpha = [sum([alpha[i] * tm[i][j] for i in range(0, n)]) * em[j][ob2id(ob)]
+                 for j in range(0, n)]
+    return sum([alpha[i] * tm[i][end] for i in range(0, n)])
+
+
+def test_forward(repo_model, repo_tests, grid_model):
+    for model, files in ((repo_model, repo_tests),
+                         (grid_model, [grid_model.files["test"]])):
+        seqs = [load_seq(f)[:20] for f in files]
+        expected = [math.log(naive_forward(model, seq)) for seq in seqs]
+        obs_list = [encode_observations(seq) for seq in seqs]
+        for sparse in (False, True):
+            trans = make_transitions(model.tm, model.n, sparse)
+            for obs, logp in zip(obs_list, expected):
+                assert math.isclose(forward(model.init_probs, trans, model.em, obs),
+                                    logp, rel_tol=1e-9)
+            assert np.allclose(forward_batch(model.init_probs, trans, model.em,
+                                             obs_list), expected, rtol=1e-9)
+
+
+
+def log_forward(model, obs):
+    """
+    log P(obs) with the forward variables kept as logs, so nothing underflows.
+    """
+    n = model.n
+    with np.errstate(divide='ignore'):
+        log_tm = np.log(np.array(model.tm, dtype=np.float64))
+        log_em = np.log(np.array(model.em, dtype=np.float64))
+        init = np.array(model.init_probs, dtype=np.float64)[:n]
+        alpha = np.log(init / init.sum()) + log_em[:, obs[0]]
+    for ob in obs[1:]:
+        alpha = np.logaddexp.reduce(alpha[:, None] + log_tm, axis=0) + log_em[:, ob]
+    return np.logaddexp.reduce(alpha + log_tm[:, n - 1])
+
+
+def test_forward_long(grid_model):
+    # 1500 steps: far below the smallest float without the rescaling
+    obs = encode_observations(load_seq(grid_model.files["long"]))
+    expected = log_forward(grid_model, obs)
+    assert expected < -1000
+    for sparse in (False, True):
+        trans = make_transitions(grid_model.tm, grid_model.n, sparse)
+        assert math.isclose(forward(grid_model.init_probs, trans, grid_model.em, obs),
+                            expected, rel_tol=1e-9)
+        # an empty sequence in the batch scores 0, and does not change the others
+        scores = forward_batch(grid_model.init_probs, trans, grid_model.em,
+                               [obs[:0], obs, obs[:10]])
+        assert scores[0] == 0
+        assert np.allclose(scores[1:], [expected,
+                                        log_forward(grid_model, obs[:10])],
+                           rtol=1e-9)
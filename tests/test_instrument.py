@@ -0,0 +1,21 @@
+import numpy as np
+from instrument import Instrumentation
+
+MB = 1 << 20
+
+
+def test_nested_peaks():
+    inst = Instrumentation("test", memory=True)
+    with inst.phase("outer"):
+        a = np.ones(32 * MB // 8)
+        del a
+        with inst.phase("inner"):
+            b = np.ones(4 * MB // 8)
+            del b
+        with inst.phase("after"):
+            pass
+
+    phases = inst.finish()["phases"]
+    assert phases["outer"]["peak_bytes"] >= 32 * MB
+    assert 4 * MB <= phases["inner"]["peak_bytes"] < 32 * MB
+    assert phases["after"]["peak_bytes"] < 4 * MB
@@ -0,0 +1,51 @@
+import itertools
+import math
+from color_grid import ob2id
+from conftest import load_seq
+from hmm_viterbi import ViterbiAlgorithm
+from test_engines import cases
+
+
+def path_logprob(model, seq, trace):
+    """
+    log P(trace, seq), up to the normalization of the initial probabilities.
+    """
+    p = model.init_probs[trace[0]]
+    for i, (state, ob) in enumerate(zip(trace, seq)):
+        nxt = trace[i + 1] if i + 1 < len(trace) else model.n - 1
+        p *= model.em[state][ob2id(ob)] * model.tm[state][nxt]
+    return math.log(p) if p > 0 else -math.inf
+
+
+def test_kbest(repo_model, repo_tests, grid_model):
+    for model, filename in cases(repo_model, repo_tests, grid_model):
+        seq = load_seq(filename)
+        expected = model.predict(seq)
+        for engine in ViterbiAlgorithm.ENGINES:
+            va = ViterbiAlgorithm(model.n, model.init_probs, model.tm, model.em, seq,
+                                  engine)
+            paths = va.kbest(3)
+            assert paths[0][1] == expected
+            assert [p for p, _ in paths] == sorted([p for p, _ in paths],
+                                                   reverse=True)
+            assert len(set([tuple(trace) for _, trace in paths])) == len(paths)
+
+
+def test_kbest_exhaustive(repo_model, repo_tests):
+    # all (N - 1)^4 paths of a short sequence
+    seq = load_seq(repo_tests[3])[:4]
+    scores = sorted([path_logprob(repo_model, seq, trace) for trace in
+                     itertools.product(range(0, repo_model.n - 1), repeat=len(seq))],
+                    reverse=True)
+    k = 10
+    for engine in ViterbiAlgorithm.ENGINES:
+        va = ViterbiAlgorithm(repo_model.n, repo_model.init_probs, repo_model.tm,
+                              repo_model.em, seq, engine)
+        paths = va.kbest(k)
+        assert len(paths) == k
+        # the returned paths have the k best scores, and each score is its own
+        offset = paths[0][0] - scores[0]
+        for i, (logp, trace) in enumerate(paths):
+            assert math.isclose(logp - offset, scores[i], abs_tol=1e-9)
+            assert math.isclose(path_logprob(repo_model, seq, trace), scores[i],
+                                abs_tol=1e-9)
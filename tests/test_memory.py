@@ -0,0 +1,38 @@
+import model_cache
+from conftest import load_seq
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_memory import measure
+
+
+def test_memory_modes(repo_model, repo_tests, grid_model):
+    for model, files in ((repo_model, repo_tests),
+                         (grid_model, [grid_model.files["test"]])):
+        for filename in files:
+            seq = load_seq(filename)
+            expected = model.predict(seq)
+            for engine in ("numpy", "sparse"):
+                for memory in ViterbiAlgorithm.MEMORY_MODES:
+                    va = ViterbiAlgorithm(model.n, model.init_probs, model.tm,
+                                          model.em, seq, engine, memory)
+                    va.predict()
+                    assert va.backtrace(len(seq) - 1) == expected, (engine, memory)
+
+
+def test_measure(grid_model):
+    seq = load_seq(grid_model.files["test"])
+    args = (grid_model.n, grid_model.init_probs, grid_model.tm, grid_model.em, seq)
+    expected = grid_model.predict(seq)
+
+    peaks = {}
+    for memory in ViterbiAlgorithm.MEMORY_MODES:
+        # the model tables are built before the memory is traced
+        model_cache.model_cache.clear()
+        model_cache.identity_cache.clear()
+        peak, _, trace = measure(*(args + ("numpy", memory)))
+        assert trace == expected
+        # the same with the tables cached
+        assert abs(measure(*(args + ("numpy", memory)))[0] - peak) < 0.1 * peak
+        peaks[memory] = peak
+
+    assert peaks["compact"] < peaks["full"]
+    assert peaks["checkpoint"] < peaks["full"]
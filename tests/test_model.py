@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import numpy as np
+import pytest
+from hmm_model import ModelFile, transition_sections, write_model
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_test import load_model_section, load_tm_file
+from conftest import REPO, load_seq
+from sparse_transitions import SparseTransitions
+
+
+def write(filename, model, sparse):
+    tm = np.asarray(model.tm)
+    sections = transition_sections(SparseTransitions.from_matrix(tm) if sparse
+                                   else tm)
+    sections["init"] = np.asarray(model.init_probs, dtype=np.float64)
+    sections["em"] = np.asarray(model.em, dtype=np.float64)
+    write_model(filename, sections)
+
+
+def test_model_file_decodes_the_same(grid_model, tmp_path):
+    seq = load_seq(grid_model.files["test"])
+    expected = grid_model.predict(seq)
+    for sparse, engine in ((False, "python"), (False, "numpy"), (True, "sparse")):
+        filename = str(tmp_path / "model.hmm")
+        write(filename, grid_model, sparse)
+
+        init = load_model_section(filename, "init", None)
+        tm = load_model_section(filename, "tm", load_tm_file)
+        em = load_model_section(filename, "em", None)
+        if engine == "python":
+            tm = tm.tolist()
+        va = ViterbiAlgorithm(grid_model.n, init, tm, em, seq, engine)
+        va.predict()
+        assert va.backtrace(len(seq) - 1) == expected
+
+
+def test_model_file_corruption(repo_model, tmp_path):
+    filename = str(tmp_path / "model.hmm")
+    write(filename, repo_model, True)
+    model = ModelFile(filename)
+    _, _, offset, nbytes, _ = model.sections["em"]
+    del model
+
+    with open(filename, 'r+b') as f:
+        f.seek(offset + nbytes // 2)
+        f.write(b'\xff')
+
+    with pytest.raises(Exception, match="corrupted section em"):
+        load_model_section(filename, "em", None)
+    # the other sections are fine
+    assert load_model_section(filename, "tm", None).num_states == repo_model.n
+    # explicit opt-out
+    assert load_model_section(filename, "em", None, verify=False).shape == \
+        (repo_model.n, 4)
+
+
+def test_unpack_sparse(grid_model, tmp_path):
+    filename = str(tmp_path / "model.hmm")
+    write(filename, grid_model, True)
+    seq = load_seq(grid_model.files["test"])
+    expected = grid_model.predict(seq)
+
+    for dense in (False, True):
+        out = tmp_path / ("dense" if dense else "sparse")
+        subprocess.run([sys.executable, "hmm_model.py", "unpack", filename, str(out)] +
+                       (["--dense"] if dense else []), cwd=REPO, check=True)
+        with open(out / "tm.dat", 'r') as f:
+            assert f.readline().startswith("sparse") != dense
+
+        tm = load_tm_file(str(out / "tm.dat"))
+        assert isinstance(tm, SparseTransitions) != dense
+        engine = "numpy" if dense else "sparse"
+        va = ViterbiAlgorithm(grid_model.n, grid_model.init_probs, tm, grid_model.em,
+                              seq, engine)
+        va.predict()
+        assert va.backtrace(len(seq) - 1) == expected
@@ -0,0 +1,44 @@
+import copy
+import model_cache
+from conftest import load_seq
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_np import make_transitions
+from model_cache import identity_cache, model_tables
+
+
+def test_cache_hit_skips_fingerprint(grid_model, monkeypatch):
+    calls = []
+    fingerprint = model_cache.model_fingerprint
+
+    def counted(n, tm, em):
+        calls.append(n)
+        return fingerprint(n, tm, em)
+
+    monkeypatch.setattr(model_cache, "model_fingerprint", counted)
+    model_cache.model_cache.clear()
+    identity_cache.clear()
+
+    misses = model_cache.model_cache.misses
+    tm, em = copy.deepcopy(grid_model.tm), copy.deepcopy(grid_model.em)
+    first = model_tables(grid_model.n, tm, em, "sparse")
+    for _ in range(0, 3):
+        assert model_tables(grid_model.n, tm, em, "sparse") is first
+    assert len(calls) == 1
+
+    # an equal model in other objects shares the tables
+    other = copy.deepcopy(tm)
+    assert model_tables(grid_model.n, other, em, "sparse") is first
+    assert len(calls) == 2
+    assert model_cache.model_cache.misses == misses + 1
+
+
+def test_python_engine_with_transitions(repo_model, repo_tests):
+    seq = load_seq(repo_tests[2])
+    for sparse in (False, True):
+        trans = make_transitions(repo_model.tm, repo_model.n, sparse)
+        va = ViterbiAlgorithm(repo_model.n, repo_model.init_probs, trans,
+                              repo_model.em, seq, "python")
+        va.predict()
+        assert va.backtrace(len(seq) - 1) == repo_model.predict(seq)
+        assert model_tables(repo_model.n, trans, repo_model.em, "python") is \
+            model_tables(repo_model.n, trans, repo_model.em, "python")
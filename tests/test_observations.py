@@ -0,0 +1,62 @@
+import gzip
+import os
+import shutil
+import pytest
+from conftest import load_seq
+from observations import (load_observations, parse_observations, read_cache,
+                          symbol_list)
+
+
+def test_load_observations(repo_tests, grid_model, tmp_path):
+    for filename in repo_tests + [grid_model.files["long"]]:
+        expected = load_seq(filename)
+        assert symbol_list(load_observations(filename, cache=False)) == expected
+
+        compressed = tmp_path / (os.path.basename(filename) + ".gz")
+        with open(filename, 'rb') as f, gzip.open(compressed, 'wb') as g:
+            shutil.copyfileobj(f, g)
+        assert symbol_list(load_observations(str(compressed), cache=False)) == \
+            expected
+
+
+def test_observation_cache(repo_tests, tmp_path):
+    filename = str(tmp_path / "test.dat")
+    shutil.copy(repo_tests[3], filename)
+    expected = load_seq(filename)
+
+    assert read_cache(filename) is None
+    assert symbol_list(load_observations(filename)) == expected
+    assert symbol_list(read_cache(filename)) == expected
+    assert symbol_list(load_observations(filename)) == expected
+
+    # a changed log is parsed again
+    with open(filename, 'a') as f:
+        f.write("1:1 r\n")
+    assert read_cache(filename) is None
+    assert symbol_list(load_observations(filename)) == expected + ['r']
+
+
+def test_invalid_observation(tmp_path):
+    filename = tmp_path / "bad.dat"
+    filename.write_text("1:1 r\n1:2 g\n\n1:3 x\n")
+    with pytest.raises(Exception, match="line 4"):
+        load_observations(str(filename), cache=False)
+
+
+def test_observation_cache_not_written(repo_tests, tmp_path):
+    filename = str(tmp_path / "test.dat")
+    shutil.copy(repo_tests[3], filename)
+    expected = load_seq(filename)
+    # a directory in place of the cache file: it can be neither read nor replaced
+    os.mkdir(filename + ".obs")
+
+    assert symbol_list(load_observations(filename)) == expected
+    assert read_cache(filename) is None
+    assert sorted(os.listdir(tmp_path)) == ["test.dat", "test.dat.obs"]
+
+
+def test_parse_in_chunks(repo_tests, grid_model):
+    for filename in repo_tests + [grid_model.files["long"]]:
+        whole = parse_observations(filename)
+        # chunks that end in the middle of a line
+        assert (parse_observations(filename, chunk_bytes=7) == whole).all()
@@ -0,0 +1,30 @@
+import numpy as np
+from conftest import load_seq
+from hmm_viterbi_np import backtrace, encode_observations, make_transitions, viterbi
+from hmm_viterbi_parallel import viterbi_parallel
+
+
+def sequential(model, trans, obs):
+    _, prevs = viterbi(model.init_probs, trans, model.em, obs, False)
+    return backtrace(prevs, len(obs) - 1)
+
+
+def test_parallel_matches_viterbi(grid_model):
+    obs = encode_observations(load_seq(grid_model.files["long"]))
+    for sparse in (False, True):
+        trans = make_transitions(grid_model.tm, grid_model.n, sparse)
+        expected = sequential(grid_model, trans, obs)
+        for chunks in (2, 5):
+            assert viterbi_parallel(grid_model.init_probs, trans,
+                                    np.asarray(grid_model.em), obs, chunks,
+                                    2) == expected
+
+
+def test_parallel_repo_tests(repo_model, repo_tests):
+    trans = make_transitions(repo_model.tm, repo_model.n)
+    for filename in repo_tests:
+        seq = load_seq(filename)
+        obs = encode_observations(seq)
+        trace = viterbi_parallel(repo_model.init_probs, trans,
+                                 np.asarray(repo_model.em), obs, 3, 2)
+        assert trace == repo_model.predict(seq)
@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+import numpy as np
+from conftest import REPO
+from hmm_viterbi_test import load_tm_file
+
+
+def run_script(*args):
+    return subprocess.run([sys.executable] + [str(a) for a in args], cwd=REPO,
+                          check=True, capture_output=True, text=True).stdout
+
+
+def test_pipeline_matches_makefile(repo_model, repo_tests, grid_model, tmp_path):
+    for model, test_file in ((repo_model, repo_tests[3]),
+                             (grid_model, grid_model.files["test"])):
+        files = model.files
+        out = {name: tmp_path / name for name in ("tm.dat", "em.dat", "pred.dat")}
+        report = run_script("hmm_pipeline.py", files["grid"], files["train"],
+                            files["init"], test_file, "--tm=%s" % out["tm.dat"],
+                            "--em=%s" % out["em.dat"],
+                            "--predicted=%s" % out["pred.dat"])
+
+        # `make hmm compare`, on the model files written like `make em tm`
+        predicted = run_script("hmm_viterbi_test.py", model.n, files["init"],
+                               files["tm"], files["em"], test_file,
+                               "--cols=%d" % model.num_cols)
+        assert out["tm.dat"].read_text() == open(files["tm"]).read()
+        assert out["em.dat"].read_text() == open(files["em"]).read()
+        assert out["pred.dat"].read_text() == predicted
+        assert report == run_script("compare_result.py", test_file, out["pred.dat"])
+
+
+def test_pipeline_options(grid_model, tmp_path):
+    files = grid_model.files
+    test_file = files["test"]
+    args = ["hmm_pipeline.py", files["grid"], files["train"], files["init"], test_file]
+
+    # every engine finds the same path
+    reports, traces = [], []
+    for engine in ("python", "numpy", "sparse"):
+        predicted = tmp_path / ("%s.dat" % engine)
+        reports.append(run_script(*args, "--engine=%s" % engine,
+                                  "--predicted=%s" % predicted))
+        traces.append(predicted.read_text())
+    assert len(set(reports)) == 1 and len(set(traces)) == 1
+
+    # the sparse tm.dat holds the values of the dense one; every stage is recorded
+    tm, log = tmp_path / "tm.dat", tmp_path / "run.jsonl"
+    run_script(*args, "--tm=%s" % tm, "--sparse", "--instrument=%s" % log)
+    assert tm.read_text().startswith("sparse")
+    assert np.array_equal(load_tm_file(str(tm)).todense(), np.array(grid_model.tm))
+    record = json.loads(log.read_text())
+    assert set(record["phases"]) == {"total", "grid", "train", "model",
+                                     "write model", "decode", "compare"}
@@ -0,0 +1,18 @@
+import numpy as np
+from conftest import load_seq
+from hmm_viterbi_np import make_transitions
+from hmm_viterbi_pool import decode_files
+from hmm_viterbi_test import format_trace
+
+
+def test_pool_prints_grid_columns(grid_model, tmp_path):
+    seq = load_seq(grid_model.files["test"])
+    trans = make_transitions(grid_model.tm, grid_model.n, True)
+    results = list(decode_files(grid_model.init_probs, trans,
+                                np.asarray(grid_model.em), [grid_model.files["test"]],
+                                str(tmp_path), 1, grid_model.num_cols))
+    assert results[0][2] == len(seq)
+
+    with open(results[0][1]) as f:
+        lines = f.read().splitlines()
+    assert lines == format_trace(grid_model.predict(seq), seq, grid_model.num_cols)
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import numpy as np
+from conftest import load_seq
+from hmm_viterbi_np import make_transitions
+from hmm_viterbi_server import DecodeServer, client, decode_remote, open_connection
+
+
+def expected_reply(model, seq):
+    return ["%d:%d %s" % (s % model.num_cols + 1, s // model.num_cols + 1, ob)
+            for s, ob in zip(model.predict(seq), seq)]
+
+
+def run_server(server, address, test):
+    """
+    Run test(address) with the server listening on address.
+    """
+    async def main():
+        serving = asyncio.ensure_future(server.serve(address))
+        while not os.path.exists(address[len("unix:"):]):
+            await asyncio.sleep(0.01)
+        try:
+            await asyncio.wait_for(test(address), 10)
+        finally:
+            serving.cancel()
+
+    asyncio.run(main())
+
+
+def make_server(model, **kwargs):
+    trans = make_transitions(model.tm, model.n, True)
+    return DecodeServer(model.init_probs, trans, model.em, model.num_cols, **kwargs)
+
+
+def test_server_decodes(tmp_path, repo_model, repo_tests, grid_model):
+    for model, files in ((repo_model, repo_tests),
+                         (grid_model, [grid_model.files["test"]])):
+        server = make_server(model)
+
+        async def test(address):
+            for filename in files:
+                seq = load_seq(filename)
+                assert await client(address, seq) == expected_reply(model, seq)
+
+        run_server(server, "unix:%s" % (tmp_path / "server.sock"), test)
+        os.remove(tmp_path / "server.sock")
+
+
+def test_server_long_lines(tmp_path, repo_model, repo_tests):
+    server = make_server(repo_model, max_length=10)
+    seq = load_seq(repo_tests[0])[:10]
+
+    async def test(address):
+        reader, writer = await open_connection(address)
+        try:
+            for length in (11, 5000):
+                try:
+                    await decode_remote(reader, writer, ["r"] * length)
+                    assert False
+                except Exception as e:
+                    assert "at most 10" in str(e)
+                # the connection still reads requests from their start
+                assert await decode_remote(reader, writer, seq) == \
+                    expected_reply(repo_model, seq)
+        finally:
+            writer.close()
+
+    run_server(server, "unix:%s" % (tmp_path / "server.sock"), test)
+    assert server.counters["errors"] == 2
+
+
+def test_server_failed_batch(tmp_path, repo_model, repo_tests):
+    server = make_server(repo_model, max_delay=0.2)
+    seq = load_seq(repo_tests[0])[:20]
+    decode = server.decode
+
+    def fail(batch):
+        server.decode = decode
+        raise Exception("decoding failed")
+
+    async def test(address):
+        # the request of a client that went away, in the same batch
+        gone = asyncio.get_running_loop().create_future()
+        gone.cancel()
+        await server.queue.put((np.zeros(3, dtype=np.uint8), gone, 0))
+        server.decode = fail
+        try:
+            await client(address, seq)
+            assert False
+        except Exception as e:
+            assert str(e) == "decoding failed"
+        # the batches are still decoded
+        assert await client(address, seq) == expected_reply(repo_model, seq)
+
+    run_server(server, "unix:%s" % (tmp_path / "server.sock"), test)
+
+
+def test_server_long_request(tmp_path, grid_model):
+    server = make_server(grid_model, max_delay=0.2, max_batch_obs=100)
+    long_seq = load_seq(grid_model.files["test"])
+    short = [long_seq[i:i + 10] for i in range(0, 50, 10)]
+    sizes = []
+    decode = server.decode
+
+    def record(batch):
+        sizes.append([len(obs) for obs, _, _ in batch])
+        return decode(batch)
+
+    server.decode = record
+
+    async def test(address):
+        seqs = short[:2] + [long_seq] + short[2:]
+        replies = await asyncio.gather(*[client(address, seq) for seq in seqs])
+        assert replies == [expected_reply(grid_model, seq) for seq in seqs]
+
+    run_server(server, "unix:%s" % (tmp_path / "server.sock"), test)
+    # the long request is decoded alone, the short ones around it together
+    assert [len(long_seq)] in sizes
+    assert all([sum(s) <= 100 for s in sizes if len(s) > 1])
+    assert len(sizes) < len(short) + 1
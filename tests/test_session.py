@@ -0,0 +1,39 @@
+import numpy as np
+from conftest import load_seq
+from hmm_viterbi_session import ViterbiSession
+from observations import load_observations
+
+
+def bursts(seq, size):
+    return [seq[i:i + size] for i in range(0, len(seq), size)]
+
+
+def test_session_array_bursts(grid_model, tmp_path):
+    obs = load_observations(grid_model.files["test"], cache=False)
+    expected = grid_model.predict(load_seq(grid_model.files["test"]))
+    filename = str(tmp_path / "session.npz")
+
+    for engine in ("numpy", "sparse"):
+        session = ViterbiSession(grid_model.n, grid_model.init_probs, grid_model.tm,
+                                 grid_model.em, obs[:10], engine)
+        for burst in bursts(obs[10:], 70):
+            session.save(filename)
+            session = ViterbiSession.load(filename, grid_model.n, grid_model.tm,
+                                          grid_model.em)
+            session.extend(burst)
+
+        assert session.backtrace(len(obs) - 1) == expected
+        assert session.seq.dtype == np.uint8 and len(session.seq) == len(obs)
+
+
+def test_session_symbols(repo_model, repo_tests):
+    for filename in repo_tests:
+        seq = load_seq(filename)
+        session = ViterbiSession(repo_model.n, repo_model.init_probs, repo_model.tm,
+                                 repo_model.em)
+        for burst in bursts(seq, 7):
+            session.extend(burst)
+
+        for k in (0, len(seq) // 2, len(seq) - 1):
+            assert session.backtrace(k) == \
+                repo_model.predict(seq[:k + 1])
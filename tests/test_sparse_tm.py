@@ -0,0 +1,47 @@
+import io
+from contextlib import redirect_stdout
+import numpy as np
+import pytest
+from conftest import load_seq
+from array_grid import ArrayColorGrid
+from hmm_train import train
+from hmm_viterbi import ViterbiAlgorithm
+from hmm_viterbi_test import load_sparse_matrix, load_tm_file
+
+
+def write_sparse(grid_model, filename):
+    grid = ArrayColorGrid()
+    grid.init_from_file(grid_model.files["grid"])
+    traingrid, _ = train(grid, [grid_model.files["train"]])
+    out = io.StringIO()
+    with redirect_stdout(out):
+        traingrid.dump_prob_sparse()
+    filename.write_text(out.getvalue())
+    return str(filename)
+
+
+def test_sparse_tm_file(grid_model, tmp_path):
+    trans = load_tm_file(write_sparse(grid_model, tmp_path / "tm_sparse.dat"))
+
+    seq = load_seq(grid_model.files["test"])
+    va = ViterbiAlgorithm(grid_model.n, grid_model.init_probs, trans, grid_model.em,
+                          seq, "sparse")
+    va.predict()
+    assert va.backtrace(len(seq) - 1) == grid_model.predict(seq)
+
+    # the same values as the dense file, which is rounded the same way
+    assert np.array_equal(trans.todense(), np.array(grid_model.tm))
+
+
+def test_invalid_sparse_tm_file(grid_model, tmp_path):
+    filename = write_sparse(grid_model, tmp_path / "tm_sparse.dat")
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+
+    with open(filename, 'w') as f:
+        f.writelines(lines[:-2])
+    with pytest.raises(Exception, match="expected %d rows" % grid_model.n):
+        load_sparse_matrix(filename)
+
+    with pytest.raises(Exception, match="not a sparse matrix file"):
+        load_sparse_matrix(grid_model.files["tm"])
@@ -0,0 +1,93 @@
+import numpy as np
+from conftest import load_seq
+from hmm_viterbi_np import (backtrace, emission_table, encode_observations,
+                            make_transitions, rescale, viterbi)
+from hmm_viterbi_stream import StreamingViterbi
+
+
+def test_stream_matches_batch(grid_model):
+    obs = encode_observations(load_seq(grid_model.files["long"]))
+    for sparse in (False, True):
+        trans = make_transitions(grid_model.tm, grid_model.n, sparse)
+        _, prevs = viterbi(grid_model.init_probs, trans, grid_model.em, obs, False)
+        expected = backtrace(prevs, len(obs) - 1)
+        for lag in (None, 1000):
+            sv = StreamingViterbi(grid_model.init_probs, trans, grid_model.em, lag)
+            assert list(sv.decode(obs)) == expected
+
+
+def test_stream_repo_tests(repo_model, repo_tests):
+    trans = make_transitions(repo_model.tm, repo_model.n, True)
+    for filename in repo_tests:
+        seq = load_seq(filename)
+        sv = StreamingViterbi(repo_model.init_probs, trans, repo_model.em, None)
+        assert list(sv.decode(seq)) == repo_model.predict(seq)
+
+
+def reference(init_probs, trans, em, obs, lag):
+    """
+    The rules of StreamingViterbi, keeping all the backpointers.
+    """
+    em_t = emission_table(em, trans.num_states)
+    delta = np.asarray(init_probs, dtype=np.float64)
+    prevs, path = [], []
+
+    def ancestor(states, k, t):
+        for i in range(k - 1, t - 1, -1):
+            states = prevs[i][states]
+        return states
+
+    for k, ob in enumerate(obs):
+        src = delta * em_t[ob]
+        live = np.flatnonzero(src > 0)
+        if len(live):
+            for t in range(k, len(path) - 1, -1):
+                anc = ancestor(live, k, t)
+                if (anc == anc[0]).all():
+                    path += [int(ancestor(np.array([anc[0]]), t, i)[0])
+                             for i in range(len(path), t + 1)]
+                    break
+
+        ds, p = trans.step(src)
+        delta, _ = rescale(ds)
+        prevs.append(p)
+        if lag is not None and k + 1 - len(path) > lag:
+            t = k - lag
+            anc = ancestor(np.arange(trans.num_states), k + 1, t)
+            delta[anc != anc[-1]] = 0
+            path.append(int(anc[-1]))
+
+    end = trans.num_states - 1
+    return path + [int(ancestor(np.array([end]), len(obs), i)[0])
+                   for i in range(len(path), len(obs))]
+
+
+def test_stream_lag(grid_model, repo_model, repo_tests):
+    for model, files in ((grid_model, [grid_model.files["test"]]),
+                         (repo_model, repo_tests)):
+        trans = make_transitions(model.tm, model.n, True)
+        for filename in files:
+            obs = encode_observations(load_seq(filename))
+            for lag in (0, 1, 5):
+                sv = StreamingViterbi(model.init_probs, trans, model.em, lag)
+                assert list(sv.decode(obs)) == \
+                    reference(model.init_probs, trans, model.em, obs, lag)
+
+
+def test_stream_lag_bounds(grid_model):
+    seq = load_seq(grid_model.files["long"])
+    trans = make_transitions(grid_model.tm, grid_model.n, True)
+    tm = np.asarray(grid_model.tm)
+    for lag in (0, 1, 5):
+        sv = StreamingViterbi(grid_model.init_probs, trans, grid_model.em, lag)
+        path = []
+        for k, ob in enumerate(seq):
+            path += sv.push(ob)
+            # decided at the latest `lag` observations later
+            assert len(path) >= k + 1 - lag
+            assert sv.num_obs - sv.num_final <= lag
+        path += sv.flush()
+
+        assert len(path) == len(seq)
+        # one consistent path
+        assert (tm[path[:-1], path[1:]] > 0).all()
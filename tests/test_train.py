@@ -0,0 +1,48 @@
+import subprocess
+import sys
+import pytest
+from conftest import REPO
+from hmm_train import TrainCounts
+from test_train_counts import split_log
+
+
+def run_script(*args):
+    return subprocess.run([sys.executable] + list(args), cwd=REPO, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def test_train_matches_gen_scripts(repo_model, grid_model):
+    # the fixtures write tm.dat and em.dat with hmm_train.py
+    for model in (repo_model, grid_model):
+        files = model.files
+        with open(files["tm"], 'r') as f:
+            assert f.read() == run_script("gen_trans_matrix.py", files["grid"],
+                                          files["train"])
+        with open(files["em"], 'r') as f:
+            assert f.read() == run_script("gen_emit_matrix.py", files["grid"],
+                                          files["train"])
+
+
+def test_train_chunks(grid_model, tmp_path):
+    files = grid_model.files
+    whole = TrainCounts(grid_model.n - 1, grid_model.num_cols)
+    whole.add_file(files["train"])
+    # chunks that end in the middle of a line
+    chunked = TrainCounts(grid_model.n - 1, grid_model.num_cols)
+    chunked.add_file(files["train"], chunk_bytes=37)
+    assert (chunked.trans == whole.trans).all()
+    assert (chunked.emit == whole.emit).all()
+
+    # several files are counted as one log
+    tm, em = tmp_path / "tm.dat", tmp_path / "em.dat"
+    run_script("hmm_train.py", files["grid"], *split_log(files["train"], tmp_path),
+               "--tm=%s" % tm, "--em=%s" % em)
+    assert tm.read_text() == open(files["tm"]).read()
+    assert em.read_text() == open(files["em"]).read()
+
+
+def test_train_off_grid(repo_model, tmp_path):
+    log = tmp_path / "train.dat"
+    log.write_text("1:1 r\n1:2 g\n1:9 b\n")
+    with pytest.raises(Exception, match="out of the grid"):
+        TrainCounts(repo_model.n - 1, repo_model.num_cols).add_file(str(log))
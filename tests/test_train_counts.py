@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import pytest
+from conftest import REPO
+from array_grid import ArrayColorGrid
+from hmm_train import TrainCounts, train
+
+
+def split_log(filename, directory):
+    """
+    The log cut in two at a line boundary, as the files a.dat and b.dat.
+    """
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+
+    parts = []
+    for name, part in (("a.dat", lines[:len(lines) // 3]),
+                       ("b.dat", lines[len(lines) // 3:])):
+        path = directory / name
+        path.write_text(''.join(part))
+        parts.append(str(path))
+    return parts
+
+
+def load_grid(filename):
+    grid = ArrayColorGrid()
+    grid.init_from_file(filename)
+    return grid
+
+
+def test_counts_saved_and_extended(grid_model, tmp_path):
+    files = grid_model.files
+    grid = load_grid(files["grid"])
+    log_a, log_b = split_log(files["train"], tmp_path)
+
+    counts = TrainCounts(grid.num_elements, grid.num_cols)
+    train(grid, [log_a], counts)
+    counts.save(str(tmp_path / "counts.npz"))
+
+    loaded = TrainCounts.load(str(tmp_path / "counts.npz"))
+    traingrid, emitgrid = train(grid, [log_b], loaded)
+    whole = train(grid, [files["train"]])
+    assert (traingrid.transitions().todense() ==
+            whole[0].transitions().todense()).all()
+    assert (emitgrid.emissions() == whole[1].emissions()).all()
+
+    # merging the counts of b into those of a is the same
+    counts_b = TrainCounts(grid.num_elements, grid.num_cols)
+    counts_b.add_file(log_b)
+    counts.merge(counts_b)
+    assert (counts.trans == loaded.trans).all()
+    assert (counts.emit == loaded.emit).all()
+
+
+def test_counts_cli(grid_model, tmp_path):
+    files = grid_model.files
+    log_a, log_b = split_log(files["train"], tmp_path)
+    counts = str(tmp_path / "counts.npz")
+    tm, em = tmp_path / "tm.dat", tmp_path / "em.dat"
+
+    def run(*args):
+        return subprocess.run([sys.executable, "hmm_train.py"] + list(args), cwd=REPO,
+                              capture_output=True, text=True)
+
+    assert run(files["grid"], log_a, "--counts=%s" % counts).returncode == 0
+    assert run(files["grid"], log_b, "--counts=%s" % counts, "--tm=%s" % tm,
+               "--em=%s" % em).returncode == 0
+    # the fixture trained tm.dat and em.dat on the whole log
+    assert tm.read_text() == open(files["tm"]).read()
+    assert em.read_text() == open(files["em"]).read()
+
+    # the counts of the 6x9 grid do not fit the 4x4 grid of the repository
+    result = run(os.path.join(REPO, "grid.dat"), log_b, "--counts=%s" % counts)
+    assert result.returncode != 0
+    assert "do not match the grid" in result.stderr
+
+
+def test_counts_of_other_grid(grid_model, repo_model):
+    counts = TrainCounts(load_grid(grid_model.files["grid"]).num_elements, 9)
+    with pytest.raises(Exception, match="do not match the grid"):
+        train(load_grid(repo_model.files["grid"]), [repo_model.files["train"]], counts)
+    with pytest.raises(Exception, match="different grids"):
+        counts.merge(TrainCounts(16, 4))
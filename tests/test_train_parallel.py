@@ -0,0 +1,39 @@
+import io
+from contextlib import redirect_stdout
+from array_grid import ArrayColorGrid
+from hmm_train import train, train_parallel
+from test_train_counts import split_log
+
+
+def printed(dump, *args):
+    out = io.StringIO()
+    with redirect_stdout(out):
+        dump(*args)
+    return out.getvalue()
+
+
+def load_grid(filename):
+    grid = ArrayColorGrid()
+    grid.init_from_file(filename)
+    return grid
+
+
+def assert_same_model(a, b):
+    assert printed(a[0].dump_prob_full) == printed(b[0].dump_prob_full)
+    assert printed(a[1].dump_emit_prob, False) == printed(b[1].dump_emit_prob, False)
+
+
+def test_train_parallel(grid_model):
+    grid = load_grid(grid_model.files["grid"])
+    # the log is split into shards at line boundaries
+    assert_same_model(train_parallel(grid, [grid_model.files["train"]], workers=3),
+                      train(grid, [grid_model.files["train"]]))
+
+
+def test_train_parallel_files(grid_model, tmp_path):
+    grid = load_grid(grid_model.files["grid"])
+    logs = split_log(grid_model.files["train"], tmp_path)
+    # the logs are counted as one, also when a shard ends with a file
+    for workers in (1, 2, 5):
+        assert_same_model(train_parallel(grid, logs, workers=workers),
+                          train(grid, logs))
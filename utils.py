@@ -7,4 +7,19 @@ def id2coord(i, num_cols):
 
 def coord2id(x, y, num_cols):
     return (y-1) * num_cols + (x-1)
-    
\ No newline at end of file
+    
+
+def parse_options(argv):
+    """
+    Split command line arguments into positional arguments and "--name=value"
+    options. An option given without a value ("--name") maps to an empty string.
+    """
+    args, opts = [], {}
+    for arg in argv:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            opts[name] = value
+        else:
+            args.append(arg)
+
+    return args, opts